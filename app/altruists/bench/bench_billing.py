@@ -0,0 +1,86 @@
+"""
+Compare the cost of computing the billing totals.
+
+Generates a month of synthetic serving logs (sessions of the altruists of
+the chains, some overlapping, some crossing the month boundaries) and times
+manager.billing.Intervals: grouping the logs, the totals of the month and
+the totals of every day, against a plain Python loop clipping and merging
+the sessions of every altruist. The totals of both are compared.
+
+    pip install -r requirements.txt
+    python bench/bench_billing.py --intervals 100000 1000000 5000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "altruists.settings")
+
+import django
+django.setup()
+
+import numpy as np
+from manager.billing import Intervals
+
+US = 1000000
+DAY = 86400 * US
+
+def synthetic(count: int, altruists: int, chains: int, days: int, seed: int = 1):
+    """Sessions of up to 6 hours starting from a day before the month until its end"""
+    rng = np.random.default_rng(seed)
+    altruist = rng.integers(0, altruists, count)
+    chain = np.char.mod("%04d", altruist % chains)
+    starts = rng.integers(-DAY, days * DAY, count)
+    finishes = starts + rng.integers(0, 6 * 3600 * US, count)
+    return altruist, chain, starts, finishes
+
+def naive(altruist, chain, starts, finishes, start: int, finish: int) -> dict:
+    sessions = dict()
+    for a, c, s, f in zip(altruist.tolist(), chain.tolist(), starts.tolist(), finishes.tolist()):
+        s, f = max(s, start), min(f, finish)
+        if f > s:
+            sessions.setdefault((a, c), []).append((s, f))
+    totals = dict()
+    for key, spans in sessions.items():
+        spans.sort()
+        served, end = 0, None
+        for s, f in spans:
+            if end is None or s > end:
+                served += f - s
+                end = f
+            elif f > end:
+                served += f - end
+                end = f
+        totals[key] = served
+    return totals
+
+def timed(func):
+    begin = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - begin
+
+def main(args):
+    month = (0, args.days * DAY)
+    for count in args.intervals:
+        data = synthetic(count, args.altruists, args.chains, args.days)
+        intervals, grouping = timed(lambda: Intervals(*data))
+        totals, monthly = timed(lambda: intervals.served(*month))
+        _, daily = timed(lambda: [intervals.served(d * DAY, (d + 1) * DAY) for d in range(args.days)])
+        line = f"{count:>9} intervals: grouping {grouping:7.3f}s, month {monthly:7.3f}s, {args.days} days {daily:7.3f}s"
+
+        if count <= args.naive_limit:
+            expected, loop = timed(lambda: naive(*data, *month))
+            assert totals == expected, "totals differ"
+            line += f", python loop {loop:7.3f}s"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--intervals", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--altruists", type=int, default=1000)
+    parser.add_argument("--chains", type=int, default=50)
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--naive-limit", type=int, default=1000000, help="Largest count timed with the Python loop")
+    main(parser.parse_args())
@@ -2,8 +2,9 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Chain, Altruist, AltruistServingLog
+from .models import Chain, Altruist, AltruistServingLog, AltruistServingDay
 
 admin.site.register(Chain)
 admin.site.register(Altruist)
-admin.site.register(AltruistServingLog)
\ No newline at end of file
+admin.site.register(AltruistServingLog)
+admin.site.register(AltruistServingDay)
@@ -0,0 +1,178 @@
+from django.db import transaction
+from django.db.models import Q, Sum, FloatField
+from django.db.models.functions import Extract
+from django.utils import timezone
+
+from .models import AltruistServingLog, AltruistServingDay, ServingRollupState
+
+import datetime
+import logging
+import numpy as np
+
+ONE_DAY = datetime.timedelta(days=1)
+# Days recomputed in one transaction
+ROLLUP_CHUNK_DAYS = 31
+
+def midnight(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time(), tzinfo=timezone.get_current_timezone())
+
+def microseconds(time: datetime.datetime) -> int:
+    return round(time.timestamp() * 1e6)
+
+class Intervals:
+    """
+    Serving log intervals as arrays, grouped by (altruist, chain) and
+    sorted by start within the groups.
+    `altruists` - altruist ids (None allowed), `chains` - chain ids,
+    `starts` and `finishes` - microseconds since the epoch.
+    """
+    def __init__(self, altruists, chains, starts, finishes):
+        altruists = np.asarray([-1 if a is None else a for a in altruists], dtype=np.int64)
+        chains    = np.asarray(["" if c is None else c for c in chains], dtype=str)
+        starts    = np.asarray(starts, dtype=np.int64)
+        finishes  = np.asarray(finishes, dtype=np.int64)
+
+        altruist_ids, altruist_codes = np.unique(altruists, return_inverse=True)
+        chain_ids, chain_codes       = np.unique(chains, return_inverse=True)
+        pairs, groups = np.unique(altruist_codes * len(chain_ids) + chain_codes, return_inverse=True)
+        # (altruist, chain) of every group
+        self.keys = [(None if altruist_ids[p // len(chain_ids)] < 0 else int(altruist_ids[p // len(chain_ids)]),
+                      str(chain_ids[p % len(chain_ids)]) or None) for p in pairs]
+
+        order = np.lexsort((starts, groups))
+        self.groups   = groups[order].astype(np.int64)
+        self.starts   = starts[order]
+        self.finishes = finishes[order]
+
+    @classmethod
+    def load(cls, logs):
+        """Intervals of the logs, fetched in one query"""
+        rows = list(logs.annotate(
+                    start_sec=Extract('start_time', 'epoch', output_field=FloatField()),
+                    finish_sec=Extract('finish_time', 'epoch', output_field=FloatField()),
+                )\
+                .values_list('altruist', 'chain_id', 'start_sec', 'finish_sec'))
+        altruists, chains, starts, finishes = zip(*rows) if rows else ((), (), (), ())
+        return cls(altruists, chains,
+                   np.rint(np.asarray(starts, dtype=np.float64) * 1e6),
+                   np.rint(np.asarray(finishes, dtype=np.float64) * 1e6))
+
+    @classmethod
+    def overlapping(cls, start: datetime.datetime, finish: datetime.datetime, **filters):
+        """Intervals of the logs overlapping [start, finish)"""
+        return cls.load(AltruistServingLog.objects.filter(start_time__lt=finish, finish_time__gt=start, **filters))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def served(self, start: int, finish: int) -> dict:
+        """
+        Microseconds served within [start, finish) by (altruist, chain).
+        The intervals are clipped to the window and the overlapping intervals
+        of the same altruist are counted once.
+        """
+        # Clipping keeps the order of the starts
+        starts   = np.maximum(self.starts, start) - start
+        finishes = np.minimum(self.finishes, finish) - start
+        inside   = finishes > starts
+        if not inside.any():
+            return dict()
+        groups, starts, finishes = self.groups[inside], starts[inside], finishes[inside]
+
+        # Shifting every group past the previous one makes a single running
+        # maximum of the finishes give the end of the union covered so far
+        offsets  = groups * (finish - start + 1)
+        starts   = starts + offsets
+        finishes = finishes + offsets
+        covered  = np.empty_like(finishes)
+        covered[0] = np.iinfo(np.int64).min
+        np.maximum.accumulate(finishes[:-1], out=covered[1:])
+        added    = np.maximum(finishes - np.maximum(starts, covered), 0)
+
+        totals = np.bincount(groups, weights=added, minlength=len(self.keys))
+        return {self.keys[g]: int(totals[g]) for g in np.flatnonzero(totals)}
+
+def update_serving_rollup(rebuild: bool = False):
+    """
+    Recomputes the AltruistServingDay rows of the days completed since the
+    last update and of the earlier days with logs changed since then.
+    Returns the number of recomputed days.
+    """
+    now = timezone.now()
+    today = timezone.localdate(now)
+    state = ServingRollupState.objects.first()
+
+    if rebuild or state is None:
+        AltruistServingDay.objects.all().delete()
+        first = AltruistServingLog.objects.order_by('start_time').values_list('start_time', flat=True).first()
+        first = timezone.localtime(first).date() if first is not None else today
+    else:
+        first = state.rolled_up_until
+    days = {first + ONE_DAY * i for i in range((today - first).days)}
+
+    if state is not None and not rebuild:
+        # Every day a changed log covers
+        for start, finish in AltruistServingLog.objects.filter(start_time__lt=midnight(state.rolled_up_until),
+                                                               finish_time__gte=state.checked_at)\
+                                                       .values_list('start_time', 'finish_time'):
+            day = timezone.localtime(start).date()
+            last = min(timezone.localtime(finish).date(), today - ONE_DAY)
+            while day <= last:
+                days.add(day)
+                day += ONE_DAY
+
+    days = sorted(days)
+    for i in range(0, len(days), ROLLUP_CHUNK_DAYS):
+        chunk = days[i:i + ROLLUP_CHUNK_DAYS]
+        intervals = Intervals.overlapping(midnight(chunk[0]), midnight(chunk[-1] + ONE_DAY))
+        rows = []
+        for day in chunk:
+            for (altruist, chain), served in intervals.served(microseconds(midnight(day)), microseconds(midnight(day + ONE_DAY))).items():
+                rows.append(AltruistServingDay(altruist_id=altruist, chain_id=chain, day=day, served=served / 1e6))
+        with transaction.atomic():
+            AltruistServingDay.objects.filter(day__in=chunk).delete()
+            AltruistServingDay.objects.bulk_create(rows)
+        logging.debug(f"Rolled up {chunk[0]} - {chunk[-1]}, {len(intervals)} logs")
+
+    # Logs saved from now on are checked by the next update
+    ServingRollupState.objects.update_or_create(id=1, defaults={"rolled_up_until": today, "checked_at": now})
+    return len(days)
+
+class ServedTotals:
+    """
+    Seconds served within [start, finish) by altruist and by chain, summed
+    from the daily rollup for the rolled up whole days and from the logs
+    clipped to the rest of the window, i.e. the current partial day.
+    """
+    def __init__(self, start: datetime.datetime, finish: datetime.datetime, chains):
+        state = ServingRollupState.objects.first()
+        first = start.date() if start == midnight(start.date()) else start.date() + ONE_DAY
+        last  = min(state.rolled_up_until, finish.date()) if state is not None else first
+        if first >= last:
+            first = last = None
+
+        served = dict()
+        if first is not None:
+            for altruist, chain, seconds in AltruistServingDay.objects.filter(day__gte=first, day__lt=last, chain_id__in=chains)\
+                                                .values('altruist', 'chain_id')\
+                                                .annotate(served=Sum('served'))\
+                                                .values_list('altruist', 'chain_id', 'served'):
+                served[(altruist, chain)] = seconds
+
+        # Windows not covered by the rollup, loaded in one query
+        windows = [(start, finish)] if first is None else [(start, midnight(first)), (midnight(last), finish)]
+        windows = [(s, f) for s, f in windows if s < f]
+        if windows:
+            overlapping = Q()
+            for s, f in windows:
+                overlapping |= Q(start_time__lt=f, finish_time__gt=s)
+            intervals = Intervals.load(AltruistServingLog.objects.filter(overlapping, chain_id__in=chains))
+            for s, f in windows:
+                for key, us in intervals.served(microseconds(s), microseconds(f)).items():
+                    served[key] = served.get(key, 0) + us / 1e6
+
+        self.by_altruist = dict()
+        self.by_chain    = dict()
+        for (altruist, chain), seconds in served.items():
+            self.by_altruist[altruist] = self.by_altruist.get(altruist, 0) + seconds
+            self.by_chain[chain]       = self.by_chain.get(chain, 0) + seconds
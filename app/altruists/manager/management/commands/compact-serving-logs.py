@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from manager.servinglog import compact_serving_logs
+
+import datetime
+import logging
+import os
+
+if os.environ.get('DJANGO_DEBUG', 'True').upper() == "TRUE":
+    logging.getLogger().setLevel(logging.DEBUG)
+logging.debug('DEBUG level active')
+
+class Command(BaseCommand):
+    help = 'Merge the consecutive serving logs of the same altruist'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-gap', type=float, default=60,
+                            help='Seconds between the logs merged, the cron closes and opens the logs within a run')
+
+    def handle(self, *args, **options):
+        deleted = compact_serving_logs(max_gap=datetime.timedelta(seconds=options['max_gap']))
+        self.stdout.write(self.style.SUCCESS(f"Serving logs compacted, {deleted} logs merged."))
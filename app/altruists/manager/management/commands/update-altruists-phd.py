@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
-from manager.models import Chain, Altruist, AltruistServingLog
-from django.db.models import Count, Sum, Value, Case, When
+from manager.models import Chain, Altruist
+from manager.servinglog import annotate_served, update_servinglog
+from django.db.models import Value, Case, When
 from django.utils import timezone
 from django.conf import settings
 
@@ -23,23 +24,21 @@ PHD_API_KEY = os.environ.get('PHD_API_KEY')
 #Timeout     (Connect, Read)
 REQ_TIMEOUT = (5,15)
 
+# How altruists served equally long within the last hour are ranked:
+# "total"  - whole RPC durations
+# "server" - server response time only (exporter's DETAILED_TIMING ttfb),
+#            without the network distance and handshakes, falls back to
+#            "total" for chains without the phase timings
+RANK_BY = os.environ.get('RANK_BY', 'total')
+
+# Period of the command's cron job, the time served is compared in whole runs
+RUN_PERIOD = datetime.timedelta(minutes=5)
+
 if os.environ.get('DJANGO_DEBUG', 'True').upper() == "TRUE":
     logging.getLogger().setLevel(logging.DEBUG)
 
 logging.debug('DEBUG level active')
 ##################################
-def update_servinglog(altruist: Altruist):
-
-    # Close previous log for the chain
-    previous_log = AltruistServingLog.objects.filter(chain_id=altruist.chain_id.chain_id).order_by('-start_time')  #.latest("start_time")
-    if len(previous_log) == 0:
-        new_log = AltruistServingLog(altruist=altruist)
-        new_log.save()
-    else:
-        previous_log[0].save()
-        new_log = AltruistServingLog(altruist=altruist)
-        new_log.save()
-
 def update_altruist_phd(
     chain_id: str,
     altruist: str
@@ -97,17 +96,25 @@ def update_altruist_phd(
                             Response code: {resp.status_code}, content: {resp.content}""")
     return False
 
-def get_healthy_altruists(
+def healthy_query(
     chainid: str,
-    interval: str = '30m'
+    interval: str,
+    rank_by: str
 ):
-    query = ('sort('
-        f'sum_over_time(last_block_duration_ns{{job="{chainid}"}}[{interval}])'
-        f'+sum_over_time(node_syncing_duration_ns{{job="{chainid}"}}[{interval}])'
-        f' and node_syncing{{job="{chainid}"}}[{interval}]==0' # Node is synced
-        f' and probe_success{{job="{chainid}"}}[{interval}]==1' # Probe successful
+    if rank_by == "server":
+        duration = f'sum by (job, instance) (sum_over_time(rpc_phase_duration_ns{{job="{chainid}",phase="ttfb",rpc=~"last_block|syncing|batch"}}[{interval}]))'
+        match = ' and on (job, instance) '
+    else:
+        duration = (f'sum_over_time(last_block_duration_ns{{job="{chainid}"}}[{interval}])'
+                    f'+sum_over_time(node_syncing_duration_ns{{job="{chainid}"}}[{interval}])')
+        match = ' and '
+    return ('sort('
+        f'{duration}'
+        f'{match}node_syncing{{job="{chainid}"}}[{interval}]==0' # Node is synced
+        f'{match}probe_success{{job="{chainid}"}}[{interval}]==1' # Probe successful
         ')')
 
+def query_altruists(query: str):
     query_url = VM_ADDRESS + '/api/v1/query?query=' + requests.utils.quote(query)
     try:
         resp = requests.get(query_url, timeout=REQ_TIMEOUT)
@@ -124,38 +131,48 @@ def get_healthy_altruists(
         logging.error(f"Failed to request: {e}")
         raise e
 
+def get_healthy_altruists(
+    chainid: str,
+    interval: str = '30m'
+):
+    """Healthy altruists of the chain, the fastest first"""
+    altruists = query_altruists(healthy_query(chainid, interval, RANK_BY))
+    if not altruists and RANK_BY == "server":
+        # No phase timings, e.g. the exporter runs without DETAILED_TIMING
+        logging.warning(f"No server response times of {chainid}, ranking by total durations")
+        altruists = query_altruists(healthy_query(chainid, interval, "total"))
+    return altruists
+
 class Command(BaseCommand):
     help = 'Get healthy altruists from VM/Prom and update them on PHD'
 
     def handle(self, *args, **options):
 
-        now_minus_1h = timezone.now() - datetime.timedelta(hours=1)
         ERROR_COUNTER = 0
         for chain in Chain.objects.all():    #filter(chain_id = "0070"):  #
             healthy_altruists = get_healthy_altruists(chainid = chain.chain_id)
+            rank = {url: i for i, url in enumerate(healthy_altruists)}
 
-            # select available altruists ordered by num of logs wthin last hour
+            # select healthy altruists ordered by time served within last hour,
+            # so the serving altruist gives way to the others, then the fastest
             # If 'chains.cc.nodepilot.tech' in the DNS name then will be prioritised
-            altruists = Altruist.objects.filter(chain_id=chain, enabled=True)\
-                                        .select_related()\
-                                        .annotate(last_hour_sessions_number=Sum(Case(\
-                                            When(altruistservinglog__start_time__gte=now_minus_1h, then=Value(1)),\
-                                            When(altruistservinglog__start_time__lt=now_minus_1h, then=Value(0)) ), default=Value(0)))\
+            altruists = annotate_served(Altruist.objects.filter(chain_id=chain, enabled=True).select_related())\
                                         .annotate(is_community_chains=Case(\
                                             When(url__contains=settings.GLOBAL_SETTINGS["CC_DOMAIN"], then=Value(1)),\
                                             default=Value(0)))\
-                                        .order_by('-is_community_chains', 'last_hour_sessions_number')
+                                        .order_by('-is_community_chains', 'served', 'id')
+            altruists = sorted([a for a in altruists if a.url in rank],
+                               key=lambda a: (-a.is_community_chains, round(a.served / RUN_PERIOD), rank[a.url]))
 
             for a in altruists:
-                if a.url in healthy_altruists:
-                    # Update altruist in PHD and add log
-                    if update_altruist_phd(chain.chain_id, a.url) :
-                        update_servinglog(a)
-                        logging.info(f"Changed altruist for {a.chain_id}, served {a.last_hour_sessions_number} times within last hour.")
-                        break
-                    else:
-                        logging.error(f"Couldn't update altruist {a.chain_id}")
-                        ERROR_COUNTER+=1
+                # Update altruist in PHD and add log
+                if update_altruist_phd(chain.chain_id, a.url) :
+                    update_servinglog(a)
+                    logging.info(f"Changed altruist for {a.chain_id}, served {a.served.total_seconds():.0f}s within last hour.")
+                    break
+                else:
+                    logging.error(f"Couldn't update altruist {a.chain_id}")
+                    ERROR_COUNTER+=1
 
 
         if ERROR_COUNTER > 0 :
@@ -21,6 +21,9 @@ SCRAPE_INTERVAL = os.environ.get('SCRAPE_INTERVAL', '5m')
 SCRAPE_TIMEOUT = os.environ.get('SCRAPE_TIMEOUT', '30s')
 # Black Box Exporter address
 BB_EXPORTER_ADDRESS = os.environ.get('BB_EXPORTER_ADDRESS', 'blackbox-blockchain-exporter:9000')
+# "single" - one scrape per altruist on /probe
+# "multi"  - one scrape per chain on /probe_multi probing all chain's altruists
+SCRAPE_MODE = os.environ.get('SCRAPE_MODE', 'single')
 
 JOB_TMPL = """
 #### {{chain_id}}
@@ -42,6 +45,23 @@ JOB_TMPL = """
 {%- endfor -%}
 """
 
+# Exporter returns every series labeled by the altruist's instance
+MULTI_JOB_TMPL = """
+#### {{chain_id}}
+- job_name: "{{chain_id}}"
+  metrics_path: /probe_multi
+  honor_labels: true
+  params:
+    chainid: ["{{chain_id}}"]
+    target:
+{%- for url in urls %}
+      - {{ url }}
+{%- endfor %}
+  static_configs:
+    - targets:
+      - {{bb_exporter_address}}
+"""
+
 SCRAPE_TMPL = """
 global:
   scrape_interval: {{scrape_interval}}
@@ -102,9 +122,10 @@ class Command(BaseCommand):
                 altruist_by_chain[chain_id] = [a.url]
 
         env = Environment(loader=BaseLoader)
+        job_tmpl = MULTI_JOB_TMPL if SCRAPE_MODE == "multi" else JOB_TMPL
         jobs = ""
         for chain_id in sorted(altruist_by_chain.keys()):
-            jobs += env.from_string(JOB_TMPL).render(chain_id=chain_id, urls=sorted(altruist_by_chain[chain_id]), bb_exporter_address=BB_EXPORTER_ADDRESS)
+            jobs += env.from_string(job_tmpl).render(chain_id=chain_id, urls=sorted(altruist_by_chain[chain_id]), bb_exporter_address=BB_EXPORTER_ADDRESS)
 
         cm_data = env.from_string(SCRAPE_TMPL).render(jobs=jobs, cm_name=SCRAPE_CONFIGMAP, scrape_timeout=SCRAPE_TIMEOUT, scrape_interval=SCRAPE_INTERVAL)
 
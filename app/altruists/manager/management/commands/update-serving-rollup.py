@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from manager.billing import update_serving_rollup
+
+import logging
+import os
+
+if os.environ.get('DJANGO_DEBUG', 'True').upper() == "TRUE":
+    logging.getLogger().setLevel(logging.DEBUG)
+logging.debug('DEBUG level active')
+
+class Command(BaseCommand):
+    help = 'Update the daily serving time rollup used by the billing report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute all the days')
+
+    def handle(self, *args, **options):
+        days = update_serving_rollup(rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f"Serving rollup updated, {days} days recomputed."))
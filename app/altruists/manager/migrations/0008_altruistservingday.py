@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0007_alter_altruist_chain_id_alter_altruist_owner_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServingRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rolled_up_until', models.DateField()),
+                ('checked_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='altruistservinglog',
+            name='finish_time',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='altruistservinglog',
+            name='start_time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='AltruistServingDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chain_id', models.CharField(max_length=4, null=True)),
+                ('day', models.DateField(db_index=True)),
+                ('served', models.FloatField(default=0)),
+                ('altruist', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='manager.altruist')),
+            ],
+            options={
+                'unique_together': {('altruist', 'chain_id', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0008_altruistservingday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChainServingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('altruist', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='manager.altruist')),
+                ('chain', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='manager.chain')),
+                ('log', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='manager.altruistservinglog')),
+            ],
+        ),
+    ]
@@ -35,9 +35,10 @@ class AltruistServingLog(models.Model):
     altruist    = models.ForeignKey(Altruist, on_delete=models.CASCADE, null=True)
     chain_id    = models.CharField(max_length=4, null=True)
     # Automatically set the field to now when the object is first created.
-    start_time  = models.DateTimeField(auto_now_add=True, editable = False)
+    start_time  = models.DateTimeField(auto_now_add=True, editable = False, db_index=True)
     # Automatically set the field to now every time the object is saved.
-    finish_time = models.DateTimeField(auto_now=True, blank=True, editable = False)
+    # Indexed to find the logs changed since the last rollup update.
+    finish_time = models.DateTimeField(auto_now=True, blank=True, editable = False, db_index=True)
 
     @property
     def get_chain_id(self):
@@ -48,5 +49,35 @@ class AltruistServingLog(models.Model):
         return (self.finish_time - self.start_time).seconds
 
     def save(self, *args, **kwarg):
-        self.chain_id = self.get_chain_id
+        # The chain is resolved through the altruist only if not given
+        if self.chain_id is None:
+            self.chain_id = self.get_chain_id
         super(AltruistServingLog, self).save(*args, **kwarg)
+
+
+class ChainServingState(models.Model):
+    """The open serving log of a chain, maintained by update_servinglog"""
+    chain    = models.OneToOneField(Chain, on_delete=models.CASCADE)
+    altruist = models.ForeignKey(Altruist, on_delete=models.SET_NULL, null=True)
+    log      = models.ForeignKey(AltruistServingLog, on_delete=models.SET_NULL, null=True)
+
+
+class AltruistServingDay(models.Model):
+    """
+    Seconds served per altruist, chain and day: the union of the altruist's
+    logs clipped to the day. Maintained by the update-serving-rollup command.
+    """
+    altruist = models.ForeignKey(Altruist, on_delete=models.CASCADE, null=True)
+    chain_id = models.CharField(max_length=4, null=True)
+    day      = models.DateField(db_index=True)
+    served   = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('altruist', 'chain_id', 'day',)
+
+class ServingRollupState(models.Model):
+    """Progress of the AltruistServingDay rollup, a single row"""
+    # Days before this one are rolled up
+    rolled_up_until = models.DateField()
+    # Logs finished since then are checked for changes by the next update
+    checked_at      = models.DateTimeField()
@@ -0,0 +1,105 @@
+from django.db import transaction
+from django.db.models import Case, DateTimeField, DurationField, ExpressionWrapper, F, Q, QuerySet, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+from .models import Altruist, AltruistServingLog, ChainServingState
+
+import datetime
+import logging
+
+# Rows deleted or updated in one transaction by the compaction
+COMPACT_BATCH = 1000
+
+@transaction.atomic
+def update_servinglog(altruist: Altruist) -> int:
+    """
+    Records that the altruist serves its chain from now on. The open log of
+    the chain is extended if it's the altruist's, otherwise it's closed and
+    a new log is opened. Returns the id of the open log.
+    The open log is found through ChainServingState, so the writes don't
+    depend on the number of the logs.
+    """
+    now = timezone.now()
+    state, created = ChainServingState.objects.select_for_update().get_or_create(chain_id=altruist.chain_id_id)
+    if created:
+        # Chains served before the state was kept, the newest log is the open one
+        log = AltruistServingLog.objects.filter(chain_id=altruist.chain_id.chain_id).order_by('-start_time')\
+                                        .values_list('id', 'altruist_id').first()
+        if log is not None:
+            state.log_id, state.altruist_id = log
+
+    if state.log_id is not None:
+        # Close the open log, it goes on if the altruist is the same
+        closed = AltruistServingLog.objects.filter(id=state.log_id).update(finish_time=now)
+        if closed and state.altruist_id == altruist.id:
+            if created:
+                state.save()
+            return state.log_id
+
+    new_log = AltruistServingLog.objects.create(altruist=altruist, chain_id=altruist.chain_id.chain_id)
+    state.log, state.altruist = new_log, altruist
+    state.save()
+    return new_log.id
+
+def annotate_served(altruists: QuerySet, window: datetime.timedelta = datetime.timedelta(hours=1)) -> QuerySet:
+    """
+    Annotates the altruists with `served`, the time they served their chain
+    within the last `window`: the overlap of their logs with it, the open log
+    of the chain counting until now.
+    """
+    now = timezone.now()
+    since = now - window
+    log = 'altruistservinglog'
+    finish = Case(When(**{f'{log}__id': F('chain_id__chainservingstate__log_id')}, then=Value(now, output_field=DateTimeField())),
+                  default=F(f'{log}__finish_time'), output_field=DateTimeField())
+    overlap = ExpressionWrapper(Least(finish, Value(now, output_field=DateTimeField()))
+                                - Greatest(F(f'{log}__start_time'), Value(since, output_field=DateTimeField())),
+                                output_field=DurationField())
+    recent = Q(**{f'{log}__finish_time__gt': since}) | Q(**{f'{log}__id': F('chain_id__chainservingstate__log_id')})
+    return altruists.annotate(served=Coalesce(Sum(overlap, filter=recent), Value(datetime.timedelta(0)),
+                                              output_field=DurationField()))
+
+def compact_serving_logs(max_gap: datetime.timedelta = datetime.timedelta(minutes=1)) -> int:
+    """
+    Merges the consecutive logs of a chain served by the same altruist,
+    when the next one starts within `max_gap` of the previous finish.
+    The last log of a run is kept and extended back to the run's start, so
+    the open log of a chain stays. Returns the number of deleted logs.
+    """
+    deleted = 0
+    chains = AltruistServingLog.objects.order_by().values_list('chain_id', flat=True).distinct()
+    for chain in list(chains):
+        # (id, start, finish) of the run merged so far and the ids merged into it
+        run, merged = None, []
+        updates, deletes = [], []
+        rows = AltruistServingLog.objects.filter(chain_id=chain).order_by('start_time', 'id')\
+                                         .values_list('id', 'altruist_id', 'start_time', 'finish_time')
+        for id, altruist, start, finish in rows.iterator(chunk_size=COMPACT_BATCH):
+            if run is not None and altruist is not None and altruist == run[1] and start - run[3] <= max_gap:
+                merged.append(run[0])
+                run = (id, altruist, run[2], max(run[3], finish))
+                continue
+            if merged:
+                updates.append(run)
+                deletes.extend(merged)
+            run, merged = (id, altruist, start, finish), []
+            if len(deletes) >= COMPACT_BATCH:
+                deleted += apply_compaction(updates, deletes)
+                updates, deletes = [], []
+        if merged:
+            updates.append(run)
+            deletes.extend(merged)
+        deleted += apply_compaction(updates, deletes)
+        logging.debug(f"Compacted the serving logs of chain {chain}")
+    return deleted
+
+def apply_compaction(updates: list, deletes: list) -> int:
+    with transaction.atomic():
+        for id, _, start, finish in updates:
+            # update() keeps the finish_time of the open log, which is extended
+            # concurrently, unless merged logs finished later
+            AltruistServingLog.objects.filter(id=id).update(start_time=start)
+            AltruistServingLog.objects.filter(id=id, finish_time__lt=finish).update(finish_time=finish)
+        AltruistServingLog.objects.filter(id__in=deletes).delete()
+    return len(deletes)
@@ -15,6 +15,11 @@ def safeURL(value):
       value = value[value.index('//')+2:]
     return value
 
+@register.filter
+def minutes(value):
+    """Whole minutes of a timedelta"""
+    return int(value.total_seconds() // 60)
+
 @register.simple_tag
 def n_ago_first(months_ago):
     today = timezone.now()
@@ -1,3 +1,238 @@
+import datetime
+import importlib
+import requests
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Chain, Altruist, AltruistServingLog, AltruistServingDay, ChainServingState
+from .billing import update_serving_rollup
+from .servinglog import annotate_served, update_servinglog, compact_serving_logs
+
+class BillingReportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin", password="admin")
+        self.client.force_login(self.user)
+        self.today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def add_altruists(self, chain: Chain, number: int, served: int = 60):
+        """Adds `number` altruists of the chain which served `served` seconds today"""
+        for _ in range(number):
+            altruist = Altruist.objects.create(owner=self.user, chain_id=chain,
+                                               url=f"https://node{Altruist.objects.count()}.example.com")
+            self.add_log(altruist, self.today, served)
+
+    def add_log(self, altruist: Altruist, day: datetime.datetime, served: int):
+        start = day + datetime.timedelta(hours=1)
+        log = AltruistServingLog.objects.create(altruist=altruist)
+        AltruistServingLog.objects.filter(id=log.id)\
+            .update(start_time=start, finish_time=start + datetime.timedelta(seconds=served))
+        return log
+
+    def billing_url(self, days: int = 0):
+        """Report of the last `days` days and today"""
+        start = self.today - datetime.timedelta(days=days)
+        tomorrow = self.today + datetime.timedelta(days=1)
+        return reverse('manager:altruist-billing', args=[start.strftime('%Y-%m-%d'), tomorrow.strftime('%Y-%m-%d')])
+
+    def test_totals(self):
+        chain = Chain.objects.create(chain_id="0021", chain_name="Ethereum")
+        self.add_altruists(chain, 1, served=60)
+        self.add_altruists(chain, 1, served=180)
+
+        response = self.client.get(self.billing_url())
+        self.assertEqual(response.status_code, 200)
+        totals = sorted(response.context["total_by_altruist"], key=lambda a: a["total_duration"])
+        self.assertEqual([a["total_duration"] for a in totals], [60, 180])
+        self.assertEqual([a["total_ratio"] for a in totals], [25, 75])
+        self.assertEqual({(a["total_altruists"], a["cc_altruist"]) for a in totals}, {(2, 0)})
+
+    def test_constant_queries(self):
+        chains = [Chain.objects.create(chain_id=f"{i:04}", chain_name=f"Chain {i}") for i in range(3)]
+        self.add_altruists(chains[0], 2)
+        self.add_altruists(chains[1], 1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.billing_url())
+        self.assertEqual(len(response.context["total_by_altruist"]), 3)
+        few = len(queries)
+
+        for chain in chains:
+            self.add_altruists(chain, 20)
+        # More altruists and chains don't add queries
+        with self.assertNumQueries(few):
+            response = self.client.get(self.billing_url())
+        self.assertEqual(len(response.context["total_by_altruist"]), 63)
+
+    def test_rollup(self):
+        chain = Chain.objects.create(chain_id="0021", chain_name="Ethereum")
+        self.add_altruists(chain, 1, served=60)
+        altruist = Altruist.objects.get()
+        yesterday = self.today - datetime.timedelta(days=1)
+        changed = self.add_log(altruist, yesterday, 120)
+        self.add_log(altruist, yesterday - datetime.timedelta(days=1), 240)
+
+        # Completed days only, today is read from the logs
+        self.assertEqual(update_serving_rollup(), 2)
+        self.assertEqual(sorted(round(s) for s in AltruistServingDay.objects.values_list('served', flat=True)), [120, 240])
+        response = self.client.get(self.billing_url(days=2))
+        self.assertEqual(response.context["total_by_altruist"][0]["total_duration"], 60 + 120 + 240)
+
+        self.assertEqual(update_serving_rollup(), 0)
+        # The log is extended after the update, until now
+        AltruistServingLog.objects.filter(id=changed.id).update(finish_time=timezone.now())
+        changed.refresh_from_db()
+        # Only the completed day of the changed log is recomputed
+        self.assertEqual(update_serving_rollup(), 1)
+        self.assertAlmostEqual(AltruistServingDay.objects.get(day=yesterday.date()).served,
+                               (self.today - changed.start_time).total_seconds(), delta=1)
+
+    def test_clipped_overlapping(self):
+        chain = Chain.objects.create(chain_id="0021", chain_name="Ethereum")
+        self.add_altruists(chain, 1, served=0)
+        altruist = Altruist.objects.get()
+        # Started yesterday, 1 hour within the report
+        log = self.add_log(altruist, self.today, 0)
+        AltruistServingLog.objects.filter(id=log.id).update(start_time=self.today - datetime.timedelta(hours=1),
+                                                            finish_time=self.today + datetime.timedelta(hours=1))
+        # Overlapping 01:00-01:10 and 01:05-01:20 count 20 minutes
+        self.add_log(altruist, self.today, 600)
+        log = self.add_log(altruist, self.today, 1200)
+        AltruistServingLog.objects.filter(id=log.id).update(start_time=self.today + datetime.timedelta(hours=1, minutes=5))
+
+        response = self.client.get(self.billing_url())
+        self.assertEqual(response.context["total_by_altruist"][0]["total_duration"], 3600 + 1200)
+
+class ServingLogTest(TestCase):
+    def setUp(self):
+        chain = Chain.objects.create(chain_id="0021", chain_name="Ethereum")
+        self.first, self.second = [Altruist.objects.create(chain_id=chain, url=f"https://node{i}.example.com") for i in range(2)]
+
+    def test_reselected(self):
+        log = update_servinglog(self.first)
+        # The open log is extended
+        self.assertEqual(update_servinglog(self.first), log)
+        self.assertEqual(AltruistServingLog.objects.count(), 1)
+
+        update_servinglog(self.second)
+        self.assertEqual(list(AltruistServingLog.objects.order_by('start_time').values_list('altruist', flat=True)),
+                         [self.first.id, self.second.id])
+        first = AltruistServingLog.objects.get(id=log)
+        self.assertLessEqual(first.finish_time, AltruistServingLog.objects.get(altruist=self.second).start_time)
+
+    def test_constant_writes(self):
+        update_servinglog(self.first)
+        with CaptureQueriesContext(connection) as queries:
+            update_servinglog(self.second)
+        # History doesn't add queries
+        for _ in range(20):
+            update_servinglog(self.first)
+            update_servinglog(self.second)
+        with self.assertNumQueries(len(queries)):
+            update_servinglog(self.first)
+
+    def test_existing_logs(self):
+        # Logs written before the state was kept
+        log = AltruistServingLog.objects.create(altruist=self.first)
+        self.assertEqual(update_servinglog(self.first), log.id)
+        self.assertNotEqual(update_servinglog(self.second), log.id)
+        self.assertEqual(AltruistServingLog.objects.count(), 2)
+
+    def ranked(self):
+        return annotate_served(Altruist.objects.filter(enabled=True)).order_by('served', 'id')
+
+    def test_served(self):
+        now = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=now - datetime.timedelta(hours=2)):
+            update_servinglog(self.first)
+        with mock.patch('django.utils.timezone.now', return_value=now - datetime.timedelta(minutes=20)):
+            update_servinglog(self.second)
+        with mock.patch('django.utils.timezone.now', return_value=now - datetime.timedelta(minutes=15)):
+            update_servinglog(self.first)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            served = {a.id: a.served for a in self.ranked()}
+        # The first served for 2 hours, the last one of them counts and the open log counts until now
+        self.assertEqual(served, {self.first.id: datetime.timedelta(minutes=55),
+                                  self.second.id: datetime.timedelta(minutes=5)})
+
+    def test_list(self):
+        self.client.force_login(User.objects.create_superuser("admin", password="admin"))
+        # Serving on one extended log for 2 hours
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - datetime.timedelta(hours=2)):
+            update_servinglog(self.first)
+        update_servinglog(self.first)
+        response = self.client.get(reverse('manager:altruist-list'))
+        self.assertEqual({a.id: a.served // datetime.timedelta(minutes=1) for a in response.context['object_list']},
+                         {self.first.id: 60, self.second.id: 0})
+        self.assertContains(response, "Minutes served in the last hour")
+
+    def test_rotation(self):
+        start = timezone.now()
+        picked = []
+        # Runs every 5 minutes for 2 hours
+        for run in range(24):
+            with mock.patch('django.utils.timezone.now', return_value=start + datetime.timedelta(minutes=5 * run)):
+                altruist = self.ranked().first()
+                update_servinglog(altruist)
+            picked.append(altruist.id)
+        # The serving altruist gives way, past the first hour too
+        self.assertNotIn([self.first.id] * 3, [picked[i:i + 3] for i in range(len(picked))])
+        self.assertNotIn([self.second.id] * 3, [picked[i:i + 3] for i in range(len(picked))])
+        self.assertLessEqual(abs(picked.count(self.first.id) - picked.count(self.second.id)), 2)
+
+    def test_compact(self):
+        start = timezone.now() - datetime.timedelta(hours=2)
+        # 5 minute logs: first x3, second, first, a gap and first
+        altruists = [self.first, self.first, self.first, self.second, self.first, None, self.first]
+        for i, altruist in enumerate(altruists):
+            if altruist is None:
+                continue
+            log = AltruistServingLog.objects.create(altruist=altruist)
+            AltruistServingLog.objects.filter(id=log.id)\
+                .update(start_time=start + datetime.timedelta(minutes=5 * i),
+                        finish_time=start + datetime.timedelta(minutes=5 * i + 5, seconds=-1))
+        last = log.id
+
+        self.assertEqual(compact_serving_logs(), 2)
+        self.assertEqual(compact_serving_logs(), 0)
+        logs = AltruistServingLog.objects.order_by('start_time')
+        self.assertEqual([(l.altruist_id, round((l.finish_time - l.start_time).total_seconds())) for l in logs],
+                         [(self.first.id, 899), (self.second.id, 299), (self.first.id, 299), (self.first.id, 299)])
+        # The open log is kept
+        self.assertEqual(logs.last().id, last)
+
+class UpdateAltruistsTest(TestCase):
+    command = importlib.import_module("manager.management.commands.update-altruists-phd")
+
+    def setUp(self):
+        chain = Chain.objects.create(chain_id="0021", chain_name="Ethereum")
+        self.a, self.b, self.c = [Altruist.objects.create(chain_id=chain, url=f"https://{name}.example.com") for name in "abc"]
+
+    def vm_reply(self, url: str, **kwargs):
+        # No phase timings, only the total durations are known
+        instances = [] if "rpc_phase_duration_ns" in requests.utils.unquote(url) else [self.b.url, self.a.url]
+        return mock.Mock(status_code=200, json=lambda: {"data": {"result": [{"metric": {"instance": i}} for i in instances]}})
+
+    def test_fallback(self):
+        with mock.patch.object(self.command, "VM_ADDRESS", "http://vm"), mock.patch.object(self.command, "RANK_BY", "server"),\
+             mock.patch.object(requests, "get", side_effect=self.vm_reply) as get:
+            self.assertEqual(self.command.get_healthy_altruists("0021"), [self.b.url, self.a.url])
+        self.assertEqual(get.call_count, 2)
 
-# Create your tests here.
+    def test_ranked(self):
+        start = timezone.now()
+        picked = []
+        # The fastest first, the unhealthy one isn't picked
+        with mock.patch.object(self.command, "get_healthy_altruists", return_value=[self.c.url, self.b.url, self.a.url]),\
+             mock.patch.object(self.command, "update_altruist_phd", return_value=True):
+            for run in range(4):
+                with mock.patch('django.utils.timezone.now', return_value=start + datetime.timedelta(minutes=5 * run)):
+                    call_command("update-altruists-phd")
+                    picked.append(ChainServingState.objects.get().altruist_id)
+        # The least served within the last hour, then the fastest
+        self.assertEqual(picked, [self.c.id, self.b.id, self.a.id, self.c.id])
@@ -10,6 +10,8 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
 
 from .models import Chain, Altruist, AltruistServingLog
+from .billing import ServedTotals
+from .servinglog import annotate_served
 from django.contrib.auth.models import User
 # from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView
@@ -195,8 +197,6 @@ class AltruistListView(ListView):
     fields = ['owner' ,'url', 'chain_id', 'enabled']
 
     def get_queryset(self):
-        now_minus_1h = timezone.now() - datetime.timedelta(hours=1)
-
         if self.request.user.is_superuser:
             qs = Altruist.objects.all()
         else:
@@ -205,10 +205,8 @@ class AltruistListView(ListView):
         if self.kwargs.get('pk'):
             qs = qs.filter(chain_id = self.kwargs.get('pk'))
 
-        return qs.select_related()\
-                    .annotate(last_hour_sessions_number=Sum(Case(\
-                        When(altruistservinglog__start_time__gte=now_minus_1h, then=Value(1))\
-                        ,When(altruistservinglog__start_time__lt=now_minus_1h, then=Value(0)) ), default=Value(0)))\
+        # Time served within the last hour, as the altruists are ranked by it
+        return annotate_served(qs.select_related())\
                     .order_by('chain_id')
 
 @method_decorator(login_required, name='dispatch')
@@ -236,56 +234,36 @@ class BillingReport(TemplateView):
                         if self.kwargs.get('finish_date') \
                         else timezone.now()
 
-        used_chains = []
+        alts = list(alts.select_related('chain_id', 'owner'))
+        used_chains = {a.chain_id.chain_id for a in alts}
+
+        # Served time clipped to the window, from the daily rollup and the
+        # logs of the days not rolled up yet
+        served = ServedTotals(start_date, finish_date, used_chains)
+        duration_by_altruist = served.by_altruist
+        total_by_chain = served.by_chain
+
+        chains_with_counts = {c.chain_id: c for c in Chain.objects.filter(chain_id__in=used_chains)\
+                .annotate(num_altruists=Count('altruist'))\
+                .annotate(cc_altruist=Sum(Case(
+                    When(altruist__url__icontains=settings.GLOBAL_SETTINGS["CC_DOMAIN"], then=Value(1)),
+                    default=Value(0)), default=Value(0)))}
+
         total_by_altruist = []
         for a in alts:
-            qs = AltruistServingLog.objects.filter(altruist=a, start_time__range=(start_date, finish_date))\
-                .annotate(
-                    duration_time=ExpressionWrapper(F("finish_time") - F("start_time"), output_field=DurationField()),
-                    duration_sec=Extract(F("duration_time"), "epoch")
-                )\
-                .aggregate(total_duration = Sum('duration_sec'))
-
+            chain_id = a.chain_id.chain_id
+            total_duration = duration_by_altruist.get(a.id) or 0
+            chain_duration = total_by_chain.get(chain_id) or 0
             total_by_altruist.append({
                                 "url": a.url,
                                 "chain": a.chain_id,
                                 "owner": a.owner,
-                                "total_duration": qs["total_duration"] if qs["total_duration"] else 0
+                                "total_duration": total_duration,
+                                "total_ratio": 100 * total_duration / chain_duration if chain_duration != 0 else None,
+                                "total_altruists": chains_with_counts[chain_id].num_altruists,
+                                "cc_altruist": chains_with_counts[chain_id].cc_altruist,
                             })
 
-            used_chains.append(a.chain_id.chain_id)
-
-        total_by_chain = dict()
-        for a in used_chains:
-            qs = AltruistServingLog.objects.filter(chain_id=a, start_time__range=(start_date, finish_date))\
-                .annotate(
-                    duration_time=ExpressionWrapper(F("finish_time") - F("start_time"), output_field=DurationField()),
-                    duration_sec=Extract(F("duration_time"), "epoch")
-                )\
-                .aggregate(total_duration = Sum('duration_sec'))
-
-            total_by_chain[a] = qs["total_duration"] if qs["total_duration"] else 0
-
-        chains_with_counts = Chain.objects.filter(chain_id__in=used_chains)\
-                .annotate(num_altruists=Count('altruist'))\
-                .annotate(cc_altruist=Sum(Case(
-                    When(altruist__url__icontains=settings.GLOBAL_SETTINGS["CC_DOMAIN"], then=Value(1)),
-                    default=Value(0)), default=Value(0)))
-                #     \
-                # .annotate(cc_altruists=Sum('is_cc_altruist'))
-
-        # print(chains_with_counts)
-
-        for a in total_by_altruist:
-            total_by_chain[ a["chain"].chain_id ]
-            if total_by_chain[ a["chain"].chain_id ] != 0:
-                a["total_ratio"] = 100 * a["total_duration"] / total_by_chain[ a["chain"].chain_id ]
-            else:
-                a["total_ratio"] = None
-
-            a["total_altruists"] = chains_with_counts.get(chain_id=a["chain"].chain_id).num_altruists
-            a["cc_altruist"] = chains_with_counts.get(chain_id=a["chain"].chain_id).cc_altruist
-
         context["total_by_altruist"] = total_by_altruist
         context["start_date"]        = start_date
         context["finish_date"]       = finish_date
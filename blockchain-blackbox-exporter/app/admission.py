@@ -0,0 +1,111 @@
+import time
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+from prometheus_client import Counter, Gauge, CollectorRegistry
+
+class Overloaded(Exception):
+    """The probe was shed by the admission control"""
+
+class AdmissionControl:
+    """
+    Caps the probes in flight to `limit` in total and `chain_limit` per chain
+    (0 - unlimited). Probes over the caps wait in a queue of `queue_size`
+    for up to `queue_timeout` seconds or their deadline, the ones which
+    don't fit in the queue or wait too long are rejected with Overloaded
+    at once, so overload turns into cheap rejections instead of timeouts.
+
+    admit() is used by threaded engines, aadmit() by the asyncio engine.
+    """
+    def __init__(self, registry: CollectorRegistry, limit: int = 64, chain_limit: int = 16,
+                 queue_size: int = 64, queue_timeout: float = 2):
+        self.limit         = limit
+        self.chain_limit   = chain_limit
+        self.queue_size    = queue_size
+        self.queue_timeout = queue_timeout
+        self.cond  = threading.Condition()
+        # Created in the running loop by the asyncio engine
+        self.acond = None
+        self.active = 0
+        # chainid -> probes in flight
+        self.chainActive = dict()
+        self.waiting = 0
+
+        self.queued   = Gauge('admission_queued_probes', 'Probes waiting for a free slot', [], registry=registry, multiprocess_mode='livesum')
+        self.rejected = Counter('admission_rejected_probes', 'Probes shed by the admission control by reason (queue_full, timeout)', ['reason'], registry=registry)
+
+    def admissible(self, chainid: str) -> bool:
+        return ((self.limit <= 0 or self.active < self.limit) and
+                (self.chain_limit <= 0 or self.chainActive.get(chainid, 0) < self.chain_limit))
+
+    def take(self, chainid: str):
+        self.active += 1
+        self.chainActive[chainid] = self.chainActive.get(chainid, 0) + 1
+
+    def free(self, chainid: str):
+        self.active -= 1
+        active = self.chainActive[chainid] - 1
+        if active:
+            self.chainActive[chainid] = active
+        else:
+            del self.chainActive[chainid]
+
+    def timeout(self, deadline: float = None) -> float:
+        if deadline is None:
+            return self.queue_timeout
+        return max(0, min(self.queue_timeout, deadline - time.monotonic()))
+
+    def reject(self, chainid: str, reason: str):
+        self.rejected.labels(reason).inc()
+        raise Overloaded(f"Probe of chain {chainid} shed: {reason}")
+
+    @contextmanager
+    def admit(self, chainid: str, deadline: float = None):
+        """Holds a slot of the chain while the probe runs, raises Overloaded if none is free in time"""
+        with self.cond:
+            if not self.admissible(chainid):
+                if self.waiting >= self.queue_size:
+                    self.reject(chainid, "queue_full")
+                self.waiting += 1
+                self.queued.set(self.waiting)
+                try:
+                    admitted = self.cond.wait_for(lambda: self.admissible(chainid), self.timeout(deadline))
+                finally:
+                    self.waiting -= 1
+                    self.queued.set(self.waiting)
+                if not admitted:
+                    self.reject(chainid, "timeout")
+            self.take(chainid)
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.free(chainid)
+                self.cond.notify_all()
+
+    @asynccontextmanager
+    async def aadmit(self, chainid: str, deadline: float = None):
+        """asyncio version of admit()"""
+        if self.acond is None:
+            self.acond = asyncio.Condition()
+        if not self.admissible(chainid):
+            if self.waiting >= self.queue_size:
+                self.reject(chainid, "queue_full")
+            self.waiting += 1
+            self.queued.set(self.waiting)
+            try:
+                async with self.acond:
+                    await asyncio.wait_for(self.acond.wait_for(lambda: self.admissible(chainid)), self.timeout(deadline))
+            except asyncio.TimeoutError:
+                self.reject(chainid, "timeout")
+            finally:
+                self.waiting -= 1
+                self.queued.set(self.waiting)
+        self.take(chainid)
+        try:
+            yield
+        finally:
+            self.free(chainid)
+            async with self.acond:
+                self.acond.notify_all()
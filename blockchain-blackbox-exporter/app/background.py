@@ -0,0 +1,159 @@
+import os
+import json
+import fcntl
+import time
+import heapq
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+from prometheus_client import Counter, Gauge, CollectorRegistry
+
+def loadTargets(path: str):
+    """
+    Reads the set of (chainid, target) to probe from either
+    - the VM scrape config generated by update-scrape-config (.yml/.yaml), or
+    - a JSON file {"<chainid>": ["<target>", ...]}
+    """
+    with open(path) as f:
+        if path.endswith((".yml", ".yaml")):
+            conf = yaml.safe_load(f) or {}
+            targets = set()
+            for job in conf.get("scrape_configs") or []:
+                params  = job.get("params", {})
+                chainid = params.get("chainid", [job.get("job_name")])[0]
+                if job.get("metrics_path") == "/probe_multi":
+                    urls = params.get("target", [])
+                else:
+                    urls = [t for sc in job.get("static_configs", []) for t in sc.get("targets", [])]
+                targets.update((chainid, url) for url in urls)
+            return targets
+
+        return {(chainid, url) for chainid, urls in json.load(f).items() for url in urls}
+
+class BackgroundProber:
+    """
+    Probes the targets of `path` continuously, every `interval` seconds
+    +/- `jitter` share of it, on a pool of `workers` threads.
+    Scrapes then get the latest stored result without waiting for the node.
+    The targets file is reloaded when it changes.
+    With a SharedStore only one worker, holding the store's lock file, probes
+    the targets and the results are shared with the other workers.
+    """
+    def __init__(self, registry: CollectorRegistry, probe, path: str,
+                 interval: float = 60, jitter: float = 0.1, workers: int = 16, store = None):
+        self.probe    = probe
+        self.path     = path
+        self.interval = interval
+        self.jitter   = jitter
+        self.shared   = store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background")
+        self.lock     = threading.Lock()
+        # (chainid, target) -> latest ProbeResult
+        self.results  = dict()
+        # Keys queued or being probed, they aren't scheduled again until done
+        self.pending  = set()
+        self.targets  = set()
+        self.mtime    = None
+        self.stopped  = threading.Event()
+
+        self.targetsNum = Gauge('background_targets', 'Number of targets probed in background', [], registry=registry, multiprocess_mode='max')
+        self.queued     = Gauge('background_queued_probes', 'Background probes waiting for or running on a worker', [], registry=registry, multiprocess_mode='livesum')
+        self.skipped    = Counter('background_skipped_probes', 'Background probes skipped because the previous one was not finished', [], registry=registry)
+
+    def start(self):
+        threading.Thread(target=self.lead if self.shared else self.loop, name="scheduler", daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops scheduling the probes, the running ones finish"""
+        self.stopped.set()
+
+    def lead(self):
+        """Runs the scheduler once this worker holds the lock, the leader keeps it until it exits"""
+        lockFile = open(f"{self.shared.path}.background.lock", "w")
+        while True:
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(5)
+        logging.info(f"Worker {os.getpid()} runs the background probes")
+        self.loop()
+
+    def nextTime(self, t: float):
+        return t + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.mtime:
+                return []
+            targets = loadTargets(self.path)
+        except Exception as e:
+            logging.error(f"Failed to load targets from {self.path}: {e}")
+            return []
+
+        self.mtime = mtime
+        added = targets - self.targets
+        with self.lock:
+            self.targets = targets
+            for key in set(self.results) - targets:
+                del self.results[key]
+        self.targetsNum.set(len(targets))
+        logging.info(f"Background probing {len(targets)} targets, {len(added)} added")
+        return added
+
+    def loop(self):
+        schedule = []
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            # New targets are spread over the first interval
+            for key in self.reload():
+                heapq.heappush(schedule, (now + random.uniform(0, self.interval), key))
+
+            while schedule and schedule[0][0] <= now:
+                due, key = heapq.heappop(schedule)
+                if key not in self.targets:
+                    continue
+                with self.lock:
+                    if key in self.pending:
+                        self.skipped.inc()
+                    else:
+                        self.pending.add(key)
+                        self.executor.submit(self.run, key)
+                    self.queued.set(len(self.pending))
+                heapq.heappush(schedule, (self.nextTime(max(due, now - self.interval)), key))
+
+            # Wake up at least every second to check the targets file
+            self.stopped.wait(min(1, max(0, schedule[0][0] - time.monotonic())) if schedule else 1)
+
+    def run(self, key):
+        try:
+            result = self.probe(*key)
+            self.store(key, result)
+        except Exception as e:
+            logging.error(f"Background probe {key} failed: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+                self.queued.set(len(self.pending))
+
+    def store(self, key, result):
+        """Keeps the result of a background target, only the leader knows them with a SharedStore"""
+        with self.lock:
+            if key not in self.targets:
+                return
+            if self.shared is None:
+                self.results[key] = result
+                return
+        # Expires unless probed again, e.g. the target was removed
+        self.shared.set("background", repr(key), result, 3 * self.interval)
+
+    def get(self, chainid: str, target: str):
+        """Latest result of the target or None if it isn't probed in background (yet)"""
+        if self.shared is not None:
+            return self.shared.get("background", repr((chainid, target)))
+        return self.results.get((chainid, target))
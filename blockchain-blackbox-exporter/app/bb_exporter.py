@@ -1,10 +1,25 @@
+import os
 import json
 import time
 import logging
-from flask import Flask, request, abort
-from prometheus_client import Info, Gauge, Counter, generate_latest, CollectorRegistry
 import requests
-from datetime import datetime
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, abort
+from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST
+
+from probes import REQ_TIMEOUT, PROBE_TIMEOUT, PARALLEL_PROBE, BATCH_PROBE, PROBE_CACHE_TTL, PROBE_CACHE_SIZE, DETAILED_TIMING,\
+                   CIRCUIT_FAILURES, CIRCUIT_BACKOFF, CIRCUIT_MAX_BACKOFF, HEAD_MAX_AGE, HEAD_IDLE_TIMEOUT,\
+                   MAX_QUEUED_PROBES, QUEUE_TIMEOUT,\
+                   ProbeResult, Rpc, probe, probeDeadline, circuitOpenResult, overloadedResult, render, renderMulti, decodeJson, sharedStore, headUrl
+from probe_cache import ProbeCache
+from exporter_metrics import ExporterMetrics, generateMetrics
+from background import BackgroundProber
+from circuit_breaker import CircuitBreaker
+from head_tracker import HeadTracker
+from admission import AdmissionControl, Overloaded
+from session_pool import SessionPool
+import rpc_timing
 
 # PHD api address
 # LOGGING = os.environ.get('LOGGING', 'INFO')
@@ -13,365 +28,215 @@ logging.basicConfig(
     level=logging.INFO,
     datefmt='%Y-%m-%d %H:%M:%S')
 
-#Timeout     (Connect, Read)
-REQ_TIMEOUT = (5,15)
-
-NOT_DEFINED = -1
-ERROR = -2
-ERROR_LAST_BLOCK = 2
-ERROR_PREV_BLOCK = 3
-ERROR_HEALTH     = 5
-
-# Maximum allowed age of the last block per chain
-# Required if eth_syncing returns not standard values
-METER_LAST_BLOCK_MAX_AGE = 15
+# Keep-alive upstream sessions
+SESSION_POOL_SIZE        = int(os.environ.get('SESSION_POOL_SIZE', 512))
+SESSION_IDLE_TIMEOUT     = int(os.environ.get('SESSION_IDLE_TIMEOUT', 300))
+SESSION_HOST_CONNECTIONS = int(os.environ.get('SESSION_HOST_CONNECTIONS', 8))
+
+# Threads of the gunicorn worker serving the requests, see gunicorn_conf.py
+THREADS = int(os.environ.get('THREADS', 8))
+# Threads sending the concurrent RPCs of parallel probes
+RPC_THREADS = int(os.environ.get('RPC_THREADS', 16))
+# Threads probing the targets of /probe_multi
+MULTI_PROBE_THREADS = int(os.environ.get('MULTI_PROBE_THREADS', 32))
+
+# Scrapes probing in total and per chain (0 - unlimited), a /probe_multi
+# scrape takes one slot for all its targets. Below THREADS, so a burst is
+# queued and shed by the admission control in a bounded time while other
+# requests still get a thread, instead of waiting in gunicorn's backlog for
+# probes to finish
+MAX_PROBES       = int(os.environ.get('MAX_PROBES', max(1, THREADS * 3 // 4)))
+MAX_CHAIN_PROBES = int(os.environ.get('MAX_CHAIN_PROBES', max(1, THREADS // 2)))
+
+# "inline"     - probe the node on every scrape
+# "background" - probe PROBE_TARGETS_FILE targets continuously, scrapes get the latest results
+PROBE_MODE          = os.environ.get('PROBE_MODE', 'inline')
+# VM scrape config (.yml) or JSON {"<chainid>": ["<target>", ...]}
+PROBE_TARGETS_FILE  = os.environ.get('PROBE_TARGETS_FILE', '/etc/bb-exporter/scrape/scrape.yml')
+BACKGROUND_INTERVAL = float(os.environ.get('BACKGROUND_INTERVAL', 60))
+BACKGROUND_JITTER   = float(os.environ.get('BACKGROUND_JITTER', 0.1))
+BACKGROUND_WORKERS  = int(os.environ.get('BACKGROUND_WORKERS', 16))
 
 ####################
 app = Flask(__name__)
 
-reg = CollectorRegistry()
-# Latest block metrics
-lastBlockNumber     = Gauge('last_block_number', "Number of the node's latest block", [], registry=reg)
-lastBlockAge        = Gauge('last_block_age', "How many seconds old is the node's latest block", [], registry=reg)
-lastBlockHash       =  Info('last_block_hash', "Latest block hash", [], registry=reg)
-lastBlockParentHash =  Info('last_block_parent_hash', "Latest block parent hash", [], registry=reg)
-lastBlockDuration   = Gauge('last_block_duration_ns', 'How many nanoseconds took to get the latest block', [], registry=reg)
-# Latest-1 block metrics
-prevBlockNumber     = Gauge('prev_block_number', "Number of the node's latest block", [], registry=reg)
-prevBlockAge        = Gauge('prev_block_age', "How many seconds old is the node's latest block", [], registry=reg)
-prevBlockHash       =  Info('prev_block_hash', "Latest block hash", [], registry=reg)
-prevBlockParentHash =  Info('prev_block_parent_hash', "Latest block parent hash", [], registry=reg)
-prevBlockDuration   = Gauge('prev_block_duration_ns', 'How many nanoseconds took to get the latest block', [], registry=reg)
-
-nodeSyncing         = Gauge('node_syncing', "Is the node syncing 0/1", [], registry=reg)
-nodeSyncingDuration = Gauge('node_syncing_duration_ns', 'How many nanoseconds took to get syncing status', [], registry=reg)
-
-probeSuccess       = Gauge('probe_success', 'Displays whether or not the probe was a successful (1 - success, >1 falure)', [], registry=reg)
-totalDuration      = Gauge('total_duration_ns', 'How many nanoseconds took whole job', [], registry=reg)
-
-def atoi(a: str):
-    # logging.debug(f"Given: {a}, {a[:2]}")
-    if a[:2] == "0x":
-        return int(a, 16), "hex"
-    else:
-        return int(a), "dec"
-
-def rpcRequest(target: str, data: str = None, method: str = "post"):
+# Exporter's own metrics, exposed on /metrics
+metricsReg = CollectorRegistry()
+
+sessionPool = SessionPool(metricsReg, SESSION_POOL_SIZE, SESSION_IDLE_TIMEOUT, SESSION_HOST_CONNECTIONS, DETAILED_TIMING)
+probeCache  = ProbeCache(metricsReg, PROBE_CACHE_TTL, PROBE_CACHE_SIZE, sharedStore)
+exporterMetrics = ExporterMetrics(metricsReg)
+circuitBreaker  = CircuitBreaker(metricsReg, CIRCUIT_FAILURES, CIRCUIT_BACKOFF, CIRCUIT_MAX_BACKOFF, sharedStore, PROBE_TIMEOUT)
+headTracker     = HeadTracker(metricsReg, HEAD_MAX_AGE, HEAD_IDLE_TIMEOUT, store=sharedStore).start()
+admission       = AdmissionControl(metricsReg, MAX_PROBES, MAX_CHAIN_PROBES, MAX_QUEUED_PROBES, QUEUE_TIMEOUT)
+# Scrapes being served, saturated when it reaches THREADS
+activeRequests  = exporterMetrics.pool("request", THREADS)
+exporterMetrics.pool("rpc", RPC_THREADS)
+exporterMetrics.pool("probe", MULTI_PROBE_THREADS)
+
+# Runs the independent RPCs of parallel probes
+rpcExecutor = ThreadPoolExecutor(max_workers=RPC_THREADS, thread_name_prefix="rpc")
+# Runs the probes of /probe_multi
+probeExecutor = ThreadPoolExecutor(max_workers=MULTI_PROBE_THREADS, thread_name_prefix="probe")
+
+# Failures meaning the node is unreachable
+CONNECTION_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+def rpcRequest(target: str, data: str = None, method: str = "post", decode = decodeJson, marks: dict = None,
+               timeout: tuple = REQ_TIMEOUT):
+    """`marks` gets the time the reply headers were received"""
     headers = {"Content-Type": "application/json"}
+    session = sessionPool.get(target)
+    # Streamed to tell the headers from the body, which is read by decode()
+    stream = marks is not None
+    if method == "post":
+        resp = session.post(target, data=data, headers=headers, timeout=timeout, stream=stream)
+    elif method == "get":
+        resp = session.get(f"{target}", timeout=timeout, stream=stream)
+    if stream:
+        marks["headers"] = time.perf_counter_ns()
+
+    if resp.status_code == 200 :
+        return decode(resp.content)
+    logging.error(resp.text)
+    raise Exception(f"Reply status_code: {resp.status_code} != 200")
+
+def execute(chainid: str, rpc: Rpc, res: ProbeResult, deadline: float):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        # Out of the probe's time budget, the RPC isn't sent
+        res.deadlineExceeded = True
+        return None
+
+    marks = rpc_timing.current.marks = dict() if DETAILED_TIMING else None
+    timeout = (min(REQ_TIMEOUT[0], remaining), min(REQ_TIMEOUT[1], remaining))
+    t0 = time.perf_counter_ns()
+    reply = error = None
     try:
-        if method == "post":
-            resp = requests.post(target, data=data, headers=headers, timeout=REQ_TIMEOUT)
-        elif method == "get":
-            resp = requests.get(f"{target}", timeout=REQ_TIMEOUT)
-
-        if resp.status_code == 200 :
-            return resp.json()
-        logging.error(resp.text)
-        raise Exception(f"Reply status_code: {resp.status_code} != 200")
+        reply = rpcRequest(rpc.target, rpc.data, rpc.method, rpc.decode, marks, timeout)
+        res.nodeReachable = True
+    except CONNECTION_ERRORS as e:
+        error = e
+        if time.monotonic() >= deadline:
+            res.deadlineExceeded = True
+        if res.nodeReachable is None:
+            res.nodeReachable = False
+        logging.warning(f"Failed to request: {e}")
     except Exception as e:
+        # The node replied with an error
+        error = e
+        res.nodeReachable = True
         logging.warning(f"Failed to request: {e}")
+    rpc.duration = time.perf_counter_ns() - t0
+    if marks is not None and "headers" in marks:
+        rpc.timings = rpc_timing.phaseDurations(marks, marks["headers"] - t0, rpc.duration)
+        res.addTimings(rpc)
+    exporterMetrics.rpc(chainid, rpc, error)
+    return reply
+
+def runProbe(chainid: str, target: str, parallel: bool = PARALLEL_PROBE, batch: bool = BATCH_PROBE, deadline: float = None,
+             ws: str = None, admitted: bool = False):
+    """
+    Runs the probe's RPCs until `deadline` (time.monotonic()), the RPCs
+    left when it passes aren't sent and fail with ERROR_DEADLINE.
+    `ws` - WebSocket endpoint pushing the target's latest block, see headUrl()
+    `admitted` - the caller holds the admission slot or is bounded by its own
+    pool, as /probe_multi and the background probes
+    Raises Overloaded when the probe is shed by the admission control.
+    """
+    deadline = deadline or probeDeadline()
+    res = ProbeResult()
+    with nullcontext() if admitted else admission.admit(chainid, deadline):
+        # Only admitted probes take the breaker's half-open trial
+        if not circuitBreaker.allow(target):
+            return circuitOpenResult()
+        url = headUrl(chainid, target, ws)
+        gen = probe(chainid, target, res, parallel, batch, headTracker.head(url) if url else None)
+        with exporterMetrics.inFlight.labels(chainid).track_inprogress():
+            try:
+                rpc = next(gen)
+                while True:
+                    if isinstance(rpc, list):
+                        # Independent RPCs, the first one runs in the request's thread
+                        futures = [exporterMetrics.submit("rpc", rpcExecutor, execute, chainid, r, res, deadline) for r in rpc[1:]]
+                        replies = [execute(chainid, rpc[0], res, deadline)] + [f.result() for f in futures]
+                        rpc = gen.send(replies)
+                    else:
+                        rpc = gen.send(execute(chainid, rpc, res, deadline))
+            except StopIteration:
+                pass
+            finally:
+                circuitBreaker.record(target, res.nodeReachable)
+    exporterMetrics.probe(chainid, res)
+    return res
+
+def cachedProbe(chainid: str, target: str, parallel: bool = PARALLEL_PROBE, batch: bool = BATCH_PROBE, deadline: float = None,
+                ws: str = None, admitted: bool = False):
+    """
+    Cached or new result of the target, its last cached result if the probe is shed.
+    Probes with other options get their own results.
+    """
+    key = (chainid, target, parallel, batch, ws)
+    try:
+        return probeCache.get(key, lambda: runProbe(chainid, target, parallel, batch, deadline, ws, admitted))
+    except Overloaded:
+        return probeCache.stale(key) or overloadedResult()
+
+backgroundProber = None
+if PROBE_MODE == "background":
+    # Bounded by BACKGROUND_WORKERS instead of the admission control
+    backgroundProber = BackgroundProber(metricsReg, lambda chainid, target: runProbe(chainid, target, admitted=True), PROBE_TARGETS_FILE,
+                                        BACKGROUND_INTERVAL, BACKGROUND_JITTER, BACKGROUND_WORKERS, sharedStore).start()
+
+def getResult(chainid: str, target: str, parallel: bool = PARALLEL_PROBE, batch: bool = BATCH_PROBE, deadline: float = None,
+              ws: str = None, admitted: bool = False):
+    """Latest background result of the target if any, otherwise probes it now"""
+    if backgroundProber is not None:
+        res = backgroundProber.get(chainid, target)
+        if res is not None:
+            return res
+        res = cachedProbe(chainid, target, parallel, batch, deadline, ws, admitted)
+        backgroundProber.store((chainid, target), res)
+        return res
+    return cachedProbe(chainid, target, parallel, batch, deadline, ws, admitted)
+
+def requestDeadline():
+    """Probe deadline given by the `timeout` query parameter or the Prometheus scrape timeout header"""
+    return probeDeadline(request.args.get('timeout', request.headers.get('X-Prometheus-Scrape-Timeout-Seconds')))
 
 @app.route('/probe')
 def get_metrics():
-    t00 = time.perf_counter_ns()
-    try:
-        target  = request.args.get('target')
-        chainid = request.args.get('chainid')
-
-        # INit probe status
-        probeStatus = 1
-        ########## POKT
-        if chainid in ["0001"]:
-            t0 = time.perf_counter_ns()
-            block = rpcRequest(f"{target}/v1/query/height",
-                                '{"height": 0}'
-                                )
-            lastBlockDuration.set(time.perf_counter_ns() - t0)
-            # Cannot determine timestamp
-            lastBlockAge.set(NOT_DEFINED)
-
-            lastBlockNumber.set(int(block["height"]))
-            #########                                                        
-            # t0 = time.perf_counter_ns()
-            # syncing = rpcRequest(target,
-            #                     '{"jsonrpc":"2.0","id":1, "method":"getHealth"}'
-            #                     )
-            # # response has result key only if node is synced otherwise 
-            # # it ll have error key instead
-            # # https://docs.ethereum-goerli.com/api/http#gethealth
-            # try:
-            #     if syncing["result"] == "ok":
-            #         nodeSyncing.set(0)
-            #     else:
-            #         nodeSyncing.set(1)
-            # except Exception as e:
-            #     logging.warning(f"Failed to request: {e}")
-            #     nodeSyncing.set(1)
-            # nodeSyncing.set(0)
-            # nodeSyncingDuration.set(time.perf_counter_ns() - t0)
-            # # Don't know how to get th einfo
-            # nodeNetVersion.set(NOT_DEFINED)
-            # nodeNetVersionDuration.set(NOT_DEFINED)
-
-        ########## ethereum-goerli VELAS
-        elif chainid in ["0006","0067","0068"]:
-            getSlotData   = '{"jsonrpc":"2.0","id":1, "method":"getSlot"}'
-            getBlockData   = '''{{
-                                "jsonrpc": "2.0","id":1,
-                                "method":"getBlock",
-                                "params": [
-                                    {slot},
-                                    {{
-                                    "encoding": "json",
-                                    "maxSupportedTransactionVersion":0,
-                                    "transactionDetails":"none",
-                                    "rewards":false
-                                    }}
-                                ]
-                                }}'''
-            getSyncingData = '{"jsonrpc":"2.0","id":1, "method":"getHealth"}'
-            fTimestamp   = "blockTime"
-            fBlockNumber = "blockHeight"
-            fBlockHash   = "blockhash"
-            fParentHash  = "previousBlockhash"
-
-            try:
-                t0 = time.perf_counter_ns()
-                slot = rpcRequest(target, getSlotData)["result"]
-                block = rpcRequest(target, getBlockData.format(slot=slot))["result"]
-                lastBlockDuration.set(time.perf_counter_ns() - t0)
-                b_timestamp = block[fTimestamp]
-
-                lastBlockAge.set(int(time.time()) - b_timestamp)
-                blockNum = block[fBlockNumber]
-                lastBlockNumber.set(blockNum)
-                lastBlockHash.info({"hash": str(block[fBlockHash])})
-                lastBlockParentHash.info({"hash": str(block[fParentHash])})
-            except Exception as e:
-                logging.warning(f"Failed to get latest block: {e}")
-                probeStatus *= ERROR_LAST_BLOCK
-
-            try:
-                t0 = time.perf_counter_ns()
-                block = rpcRequest(target, getBlockData.format(slot=block["parentSlot"]))["result"]
-                prevBlockDuration.set(time.perf_counter_ns() - t0)
-                b_timestamp = block[fTimestamp]
-                prevBlockAge.set(int(time.time()) - b_timestamp)
-
-                blockNum = block[fBlockNumber]
-                prevBlockNumber.set(blockNum)
-                prevBlockHash.info({"hash": str(block[fBlockHash])})
-                prevBlockParentHash.info({"hash": str(block[fParentHash])})
-            except Exception as e:
-                logging.warning(f"Failed to get previouse block: {e}")
-                probeStatus *= ERROR_PREV_BLOCK
-
-            # response has result key only if node is synced otherwise 
-            # it ll have error key instead
-            # https://docs.ethereum-goerli.com/api/http#gethealth
-            try:
-                sync = 1
-                t0 = time.perf_counter_ns()
-                syncing = rpcRequest(target, getSyncingData)
-                if "result" in syncing.keys():
-                    if syncing["result"] == "ok":
-                        sync = 0
-
-                nodeSyncing.set(sync)
-                nodeSyncingDuration.set(time.perf_counter_ns() - t0)
-
-            except Exception as e:
-                logging.warning(f"Failed to get syncing status: {e}")
-                probeStatus *= ERROR_HEALTH
-
-        # OSMOSIS
-        elif chainid in ["0054"]:
-
-            t0 = time.perf_counter_ns()
-            block = rpcRequest(target=f"{target}/block", method='get')["result"]["block"]
-            lastBlockDuration.set(time.perf_counter_ns() - t0)
-
-            last_block_age = int(time.time()) - int(datetime.fromisoformat(block["header"]["time"]).timestamp())
-            lastBlockAge.set(last_block_age)
-
-            lastBlockNumber.set(int(block["header"]["height"]))
-
-            t0 = time.perf_counter_ns()
-            syncing = rpcRequest(f"{target}/status", method='get')["result"]["sync_info"]
-
-            sync = 1
-            if syncing["catching_up"] == False:
-                sync = 0
-            nodeSyncing.set(sync)
-            nodeSyncingDuration.set(time.perf_counter_ns() - t0)
-
-        # NEAR
-        elif chainid in ["0052"]:
-            t0 = time.perf_counter_ns()
-            block = rpcRequest(target,
-                                '{"jsonrpc": "2.0", "id": "dontcare", "method": "block", "params": {"finality": "final"}}'
-                                )["result"]
-            lastBlockDuration.set(time.perf_counter_ns() - t0)
-            # print(block)
-            last_block_age = int(time.time()) - int(block["header"]["timestamp"]/1000000000)
-            lastBlockAge.set(last_block_age)
-
-            lastBlockNumber.set(int(block["header"]["height"]))
-
-            t0 = time.perf_counter_ns()
-            syncing = rpcRequest(target,
-                                '{"jsonrpc": "2.0", "id": "dontcare", "method": "status", "params": []}'
-                                )["result"]["sync_info"]["syncing"]
-            if syncing == False:
-                sync = 0
-            else:
-                sync = 1
-            nodeSyncing.set(sync)
-            nodeSyncingDuration.set(time.perf_counter_ns() - t0)
-
-        # SUI
-        elif chainid in ["0076"]:
-            t0 = time.perf_counter_ns()
-            block = rpcRequest(target,
-                                '{"jsonrpc":"2.0", "method":"sui_getLatestCheckpointSequenceNumber","id":1}'
-                                )
-            lastBlockDuration.set(time.perf_counter_ns() - t0)
-            # lastBlockAge.set(NOT_DEFINED)
-
-            lastBlockNumber.set(int(block["result"]))
-
-            # t0 = time.perf_counter_ns()
-            # syncing = rpcRequest(target,
-            #                     '{"jsonrpc": "2.0", "id": "dontcare", "method": "status", "params": []}'
-            #                     )["result"]["sync_info"]["syncing"]
-            # if syncing == False:
-            #     sync = 0
-            # else:
-            #     sync = 1
-            # nodeSyncing.set(0)
-            # nodeSyncingDuration.set(0)
-
-        else:
-            # Default do EVM requests
-
-            getBlockData   = '{{"jsonrpc":"2.0","method":"eth_getBlockByNumber","params":[{height}, false],"id":1}}'
-            getSyncingData = '{"jsonrpc":"2.0","method":"eth_syncing","params":[],"id":1}'
-            fTimestamp   = "timestamp"
-            fBlockNumber = "number"
-            fBlockHash   = "hash"
-            fParentHash  = "parentHash"
-
-            # on AVAX + subnets we need to adjust URL path
-            if chainid in ["0003"]:
-                target = f"{target}/ext/bc/C/rpc"
-            elif chainid in ["03DF"]:
-                target = f"{target}/ext/bc/q2aTwKuyzgs8pynF7UXBZCU7DejbZbZ6EUyHr3JQzYgwNPUPi/rpc"
-            elif chainid in ["03CB"]:
-                target = f"{target}/ext/bc/2K33xS9AyP9oCDiHYKVrHe7F54h2La5D8erpTChaAhdzeSu2RX/rpc"
-            elif chainid in ["0060", "0061"]:
-                getBlockData   = '{{"jsonrpc":"2.0","method":"starknet_getBlockWithTxHashes","params":[{height}],"id":1}}'
-                getSyncingData = '{"jsonrpc":"2.0","method":"starknet_syncing","params":[],"id":1}'
-                fTimestamp   = "timestamp"
-                fBlockNumber = "block_number"
-                fBlockHash   = "block_hash"
-                fParentHash  = "parent_hash"
-
-            try:
-                logging.debug(getBlockData.format(height='"latest"'))
-                t0 = time.perf_counter_ns()
-                block = rpcRequest(target, getBlockData.format(height='"latest"'))["result"]
-                lastBlockDuration.set(time.perf_counter_ns() - t0)
-                b_timestamp, base = atoi(str(block[fTimestamp]))
-
-                lastBlockAge.set(int(time.time()) - b_timestamp)
-                blockNum, base = atoi(str(block[fBlockNumber]))
-                lastBlockNumber.set(blockNum)
-                lastBlockHash.info({"hash": str(block[fBlockHash])})
-                lastBlockParentHash.info({"hash": str(block[fParentHash])})
-            except Exception as e:
-                logging.warning(f"Failed to get latest block: {e}")
-                probeStatus *= ERROR_LAST_BLOCK
-
-            if not (chainid in ["0060", "0061"]):
-            # Don't know how to get the previous block
-            # TODO!!! TBD
-                try:
-                    height = blockNum-1
-                    if base == "hex":
-                        height = str(hex(blockNum-1))
-                    logging.debug(getBlockData.format(height=f'"{height}"'))
-                    t0 = time.perf_counter_ns()
-
-                    block = rpcRequest(target, getBlockData.format(height=f'"{height}"'))["result"]
-
-                    prevBlockDuration.set(time.perf_counter_ns() - t0)
-                    b_timestamp, base = atoi(str(block[fTimestamp]))
-                    prevBlockAge.set(int(time.time()) - b_timestamp)
-
-                    blockNum, base = atoi(str(block[fBlockNumber]))
-                    prevBlockNumber.set(blockNum)
-                    prevBlockHash.info({"hash": str(block[fBlockHash])})
-                    prevBlockParentHash.info({"hash": str(block[fParentHash])})
-                except Exception as e:
-                    logging.warning(f"Failed to get previouse block: {e}")
-                    probeStatus *= ERROR_PREV_BLOCK
-
-            try:
-                if chainid in ["0074"]:
-                    t0 = time.perf_counter_ns()
-                    syncing = rpcRequest(target, getSyncingData)["result"]
-                    sync = 1
-                    if syncing['currentBlock'] == syncing['highestBlock'] or syncing['highestBlock'] == "0x0":                       
-                        sync = 0
-
-                else:
-                    t0 = time.perf_counter_ns()
-                    syncing = rpcRequest(target, getSyncingData)["result"]
-                    sync = 1
-                    if syncing == False:
-                        sync = 0
-                    elif 'current_block_num' in syncing.keys() and 'highest_block_num' in syncing.keys():
-                        if syncing['current_block_num'] == syncing['highest_block_num']:
-                            sync = 0
-                    elif 'currentBlock' in syncing.keys() and 'highestBlock' in syncing.keys():
-                        if syncing['currentBlock'] == syncing['highestBlock']:
-                        #  last_block_age < METER_LAST_BLOCK_MAX_AGE:
-                            sync = 0
-
-                nodeSyncing.set(sync)
-                nodeSyncingDuration.set(time.perf_counter_ns() - t0)
-
-            except Exception as e:
-                logging.warning(f"Failed to get syncing status: {e}")
-                probeStatus *= ERROR_HEALTH
-
-    except Exception as e:
-        probeStatus *= 7
-        logging.error(f"Caught exception: {e}")
-
-    if probeStatus % ERROR_LAST_BLOCK == 0:
-        # Invalidate all the metrics
-        lastBlockDuration.set(ERROR)
-        lastBlockAge.set(ERROR)
-        lastBlockNumber.set(ERROR)
-        lastBlockHash.info({"hash": "none"})
-        lastBlockParentHash.info({"hash": "none"})
-
-    if probeStatus % ERROR_PREV_BLOCK == 0:
-        prevBlockDuration.set(ERROR)
-        prevBlockAge.set(ERROR)
-        prevBlockNumber.set(ERROR)
-        prevBlockHash.info({"hash": "none"})
-        prevBlockParentHash.info({"hash": "none"})
-
-    if probeStatus % ERROR_HEALTH == 0:
-        nodeSyncing.set(ERROR)
-        nodeSyncingDuration.set(ERROR)
-
-    probeSuccess.set(probeStatus)
-    totalDuration.set(time.perf_counter_ns() - t00)
-
-    return generate_latest(registry=reg)
+    target   = request.args.get('target')
+    chainid  = request.args.get('chainid')
+    parallel = request.args.get('parallel', str(PARALLEL_PROBE)).upper() == "TRUE"
+    batch    = request.args.get('batch', str(BATCH_PROBE)).upper() == "TRUE"
+    deadline = requestDeadline()
+    ws       = request.args.get('ws')
+
+    with activeRequests.track_inprogress():
+        return render(getResult(chainid, target, parallel, batch, deadline, ws))
+
+@app.route('/probe_multi')
+def get_multi_metrics():
+    """Probes all the given targets of a chain concurrently, under one admission slot"""
+    targets  = list(dict.fromkeys(request.args.getlist('target')))
+    chainid  = request.args.get('chainid')
+    parallel = request.args.get('parallel', str(PARALLEL_PROBE)).upper() == "TRUE"
+    batch    = request.args.get('batch', str(BATCH_PROBE)).upper() == "TRUE"
+    deadline = requestDeadline()
+
+    with activeRequests.track_inprogress():
+        try:
+            with admission.admit(chainid, deadline):
+                futures = {t: exporterMetrics.submit("probe", probeExecutor, getResult, chainid, t, parallel, batch, deadline, None, True)
+                           for t in targets}
+                return renderMulti({t: f.result() for t, f in futures.items()})
+        except Overloaded:
+            return renderMulti({t: probeCache.stale((chainid, t, parallel, batch, None)) or overloadedResult() for t in targets})
+
+@app.route('/metrics')
+def get_exporter_metrics():
+    return generateMetrics(metricsReg), 200, {'Content-Type': CONTENT_TYPE_LATEST}
 
 @app.route('/health')
 def health():
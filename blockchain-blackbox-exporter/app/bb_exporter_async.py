@@ -0,0 +1,209 @@
+# asyncio engine of the exporter, keeps hundreds of probes in flight per process.
+# Run with:
+#   WORKER_CLASS=aiohttp.GunicornWebWorker gunicorn --conf /app/gunicorn_conf.py bb_exporter_async:app
+import os
+import time
+import asyncio
+import logging
+import aiohttp
+from aiohttp import web
+from contextlib import nullcontext
+
+from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST
+
+from probes import REQ_TIMEOUT, PROBE_TIMEOUT, PARALLEL_PROBE, BATCH_PROBE, PROBE_CACHE_TTL, PROBE_CACHE_SIZE, DETAILED_TIMING,\
+                   CIRCUIT_FAILURES, CIRCUIT_BACKOFF, CIRCUIT_MAX_BACKOFF, HEAD_MAX_AGE, HEAD_IDLE_TIMEOUT,\
+                   MAX_QUEUED_PROBES, QUEUE_TIMEOUT,\
+                   ProbeResult, Rpc, probe, probeDeadline, circuitOpenResult, overloadedResult, render, renderMulti, decodeJson, sharedStore, headUrl
+from probe_cache import ProbeCache
+from exporter_metrics import ExporterMetrics, generateMetrics
+from circuit_breaker import CircuitBreaker
+from head_tracker import HeadTracker
+from admission import AdmissionControl, Overloaded
+import rpc_timing
+
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+
+# Max number of open upstream connections (0 - unlimited)
+CONNECTION_LIMIT = 0
+# Longest request line, /probe_multi has all the targets of a chain in the query string
+MAX_REQUEST_LINE = 1024 * 1024
+
+# Scrapes probing in total and per chain (0 - unlimited), a /probe_multi
+# scrape takes one slot for all its targets. Waiting probes cost no thread,
+# the caps only bound the memory and upstream connections
+MAX_PROBES       = int(os.environ.get('MAX_PROBES', 1024))
+MAX_CHAIN_PROBES = int(os.environ.get('MAX_CHAIN_PROBES', 256))
+
+SESSION = web.AppKey("session", aiohttp.ClientSession)
+
+# Exporter's own metrics, exposed on /metrics
+metricsReg = CollectorRegistry()
+
+probeCache = ProbeCache(metricsReg, PROBE_CACHE_TTL, PROBE_CACHE_SIZE, sharedStore)
+exporterMetrics = ExporterMetrics(metricsReg)
+circuitBreaker  = CircuitBreaker(metricsReg, CIRCUIT_FAILURES, CIRCUIT_BACKOFF, CIRCUIT_MAX_BACKOFF, sharedStore, PROBE_TIMEOUT)
+headTracker     = HeadTracker(metricsReg, HEAD_MAX_AGE, HEAD_IDLE_TIMEOUT, store=sharedStore).start()
+admission       = AdmissionControl(metricsReg, MAX_PROBES, MAX_CHAIN_PROBES, MAX_QUEUED_PROBES, QUEUE_TIMEOUT)
+
+# Failures meaning the node is unreachable
+CONNECTION_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+async def rpcRequest(session: aiohttp.ClientSession, target: str, data: str = None, method: str = "post", decode = decodeJson, marks: dict = None,
+                     timeout: aiohttp.ClientTimeout = None):
+    """`marks` gets the connection phases and the time the reply headers were received"""
+    headers = {"Content-Type": "application/json"}
+    if method == "post":
+        resp = await session.post(target, data=data, headers=headers, trace_request_ctx=marks, timeout=timeout)
+    elif method == "get":
+        resp = await session.get(f"{target}", trace_request_ctx=marks, timeout=timeout)
+    if marks is not None:
+        marks["headers"] = time.perf_counter_ns()
+
+    async with resp:
+        if resp.status == 200 :
+            return decode(await resp.read())
+        logging.error(await resp.text())
+        raise Exception(f"Reply status_code: {resp.status} != 200")
+
+async def execute(session: aiohttp.ClientSession, chainid: str, rpc: Rpc, res: ProbeResult, deadline: float):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        # Out of the probe's time budget, the RPC isn't sent
+        res.deadlineExceeded = True
+        return None
+
+    marks = dict() if DETAILED_TIMING else None
+    # Whole request including the body is cut at the deadline
+    timeout = aiohttp.ClientTimeout(total=remaining, sock_connect=min(REQ_TIMEOUT[0], remaining),
+                                    sock_read=min(REQ_TIMEOUT[1], remaining))
+    t0 = time.perf_counter_ns()
+    reply = error = None
+    try:
+        reply = await rpcRequest(session, rpc.target, rpc.data, rpc.method, rpc.decode, marks, timeout)
+        res.nodeReachable = True
+    except CONNECTION_ERRORS as e:
+        error = e
+        if time.monotonic() >= deadline:
+            res.deadlineExceeded = True
+        if res.nodeReachable is None:
+            res.nodeReachable = False
+        logging.warning(f"Failed to request: {e!r}")
+    except Exception as e:
+        # The node replied with an error
+        error = e
+        res.nodeReachable = True
+        logging.warning(f"Failed to request: {e!r}")
+    rpc.duration = time.perf_counter_ns() - t0
+    if marks is not None and "headers" in marks:
+        rpc.timings = rpc_timing.phaseDurations(marks, marks["headers"] - t0, rpc.duration)
+        res.addTimings(rpc)
+    exporterMetrics.rpc(chainid, rpc, error)
+    return reply
+
+async def runProbe(session: aiohttp.ClientSession, chainid: str, target: str, parallel: bool = PARALLEL_PROBE, batch: bool = BATCH_PROBE,
+                   deadline: float = None, ws: str = None, admitted: bool = False):
+    """
+    Runs the probe's RPCs until `deadline` (time.monotonic()), the RPCs
+    left when it passes aren't sent and fail with ERROR_DEADLINE.
+    `ws` - WebSocket endpoint pushing the target's latest block, see headUrl()
+    `admitted` - the caller holds the admission slot, as /probe_multi
+    Raises Overloaded when the probe is shed by the admission control.
+    """
+    deadline = deadline or probeDeadline()
+    res = ProbeResult()
+    async with nullcontext() if admitted else admission.aadmit(chainid, deadline):
+        # Only admitted probes take the breaker's half-open trial
+        if not circuitBreaker.allow(target):
+            return circuitOpenResult()
+        url = headUrl(chainid, target, ws)
+        gen = probe(chainid, target, res, parallel, batch, headTracker.head(url) if url else None)
+        with exporterMetrics.inFlight.labels(chainid).track_inprogress():
+            try:
+                rpc = next(gen)
+                while True:
+                    if isinstance(rpc, list):
+                        rpc = gen.send(await asyncio.gather(*[execute(session, chainid, r, res, deadline) for r in rpc]))
+                    else:
+                        rpc = gen.send(await execute(session, chainid, rpc, res, deadline))
+            except StopIteration:
+                pass
+            finally:
+                circuitBreaker.record(target, res.nodeReachable)
+    exporterMetrics.probe(chainid, res)
+    return res
+
+async def cachedProbe(session: aiohttp.ClientSession, chainid: str, target: str, parallel: bool = PARALLEL_PROBE, batch: bool = BATCH_PROBE,
+                      deadline: float = None, ws: str = None, admitted: bool = False):
+    """
+    Cached or new result of the target, its last cached result if the probe is shed.
+    Probes with other options get their own results.
+    """
+    key = (chainid, target, parallel, batch, ws)
+    try:
+        return await probeCache.aget(key, lambda: runProbe(session, chainid, target, parallel, batch, deadline, ws, admitted))
+    except Overloaded:
+        return probeCache.stale(key) or overloadedResult()
+
+def requestDeadline(request: web.Request):
+    """Probe deadline given by the `timeout` query parameter or the Prometheus scrape timeout header"""
+    return probeDeadline(request.query.get('timeout', request.headers.get('X-Prometheus-Scrape-Timeout-Seconds')))
+
+async def get_metrics(request: web.Request):
+    target   = request.query.get('target')
+    chainid  = request.query.get('chainid')
+    parallel = request.query.get('parallel', str(PARALLEL_PROBE)).upper() == "TRUE"
+    batch    = request.query.get('batch', str(BATCH_PROBE)).upper() == "TRUE"
+    deadline = requestDeadline(request)
+    ws       = request.query.get('ws')
+
+    res = await cachedProbe(request.app[SESSION], chainid, target, parallel, batch, deadline, ws)
+    return web.Response(body=render(res), content_type="text/plain")
+
+async def get_multi_metrics(request: web.Request):
+    """Probes all the given targets of a chain concurrently, under one admission slot"""
+    targets  = list(dict.fromkeys(request.query.getall('target', [])))
+    chainid  = request.query.get('chainid')
+    parallel = request.query.get('parallel', str(PARALLEL_PROBE)).upper() == "TRUE"
+    batch    = request.query.get('batch', str(BATCH_PROBE)).upper() == "TRUE"
+
+    deadline = requestDeadline(request)
+    try:
+        async with admission.aadmit(chainid, deadline):
+            results = await asyncio.gather(*[cachedProbe(request.app[SESSION], chainid, t, parallel, batch, deadline, None, True)
+                                             for t in targets])
+    except Overloaded:
+        results = [probeCache.stale((chainid, t, parallel, batch, None)) or overloadedResult() for t in targets]
+    return web.Response(body=renderMulti(dict(zip(targets, results))), content_type="text/plain")
+
+async def get_exporter_metrics(request: web.Request):
+    return web.Response(body=generateMetrics(metricsReg), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+async def health(request: web.Request):
+    return web.json_response({'success':True})
+
+async def client_session(app: web.Application):
+    # One pooled client session shared by all the probes of the worker
+    timeout = aiohttp.ClientTimeout(sock_connect=REQ_TIMEOUT[0], sock_read=REQ_TIMEOUT[1])
+    connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT)
+    traceConfigs = [rpc_timing.traceConfig()] if DETAILED_TIMING else []
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector, trace_configs=traceConfigs) as session:
+        app[SESSION] = session
+        yield
+
+def create_app():
+    app = web.Application(handler_args={"max_line_size": MAX_REQUEST_LINE})
+    app.cleanup_ctx.append(client_session)
+    app.router.add_get('/probe', get_metrics)
+    app.router.add_get('/probe_multi', get_multi_metrics)
+    app.router.add_get('/metrics', get_exporter_metrics)
+    app.router.add_get('/health', health)
+    return app
+
+app = create_app()
+
+if __name__ == '__main__':
+    web.run_app(app, host="0.0.0.0", port=9000)
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+class BlockHistory:
+    """
+    Ring buffer of the recent blocks of a target, in preallocated arrays
+    indexed by block number modulo `size`, so lookups by number are O(1).
+    """
+    def __init__(self, size: int):
+        self.size       = size
+        self.lock       = threading.Lock()
+        self.numbers    = [-1] * size
+        self.hashes     = [None] * size
+        self.parents    = [None] * size
+        self.timestamps = [0] * size
+        self.latest     = -1
+        # Blocks seen with a different hash than before at the same height
+        self.reorgs     = 0
+
+    def record(self, number: int, blockHash: str, parentHash: str, timestamp: int):
+        i = number % self.size
+        with self.lock:
+            if self.numbers[i] == number:
+                if self.hashes[i] != blockHash:
+                    self.reorgs += 1
+            self.numbers[i]    = number
+            self.hashes[i]     = blockHash
+            self.parents[i]    = parentHash
+            self.timestamps[i] = timestamp
+            self.latest = max(self.latest, number)
+
+    def parent(self, number: int, parentHash: str):
+        """(number, hash, parent hash, timestamp) of the block's parent if it is known"""
+        i = (number - 1) % self.size
+        with self.lock:
+            if self.numbers[i] == number - 1 and self.hashes[i] == parentHash:
+                return self.numbers[i], self.hashes[i], self.parents[i], self.timestamps[i]
+        return None
+
+    def rate(self) -> float:
+        """Blocks per second between the oldest and the latest known block"""
+        with self.lock:
+            latest = self.latest
+            i = latest % self.size
+            if latest < 0 or self.numbers[i] != latest:
+                return 0
+            oldest = min((n for n in self.numbers if latest - self.size < n <= latest), default=latest)
+            seconds = self.timestamps[i] - self.timestamps[oldest % self.size]
+        return (latest - oldest) / seconds if seconds > 0 else 0
+
+class BlockHistories:
+    """Block histories of the most recently probed `maxsize` targets"""
+    def __init__(self, size: int = 32, maxsize: int = 4096):
+        self.size    = size
+        self.maxsize = maxsize
+        self.lock      = threading.Lock()
+        self.histories = OrderedDict()
+
+    def get(self, target: str) -> BlockHistory:
+        with self.lock:
+            history = self.histories.get(target)
+            if history is None:
+                history = self.histories[target] = BlockHistory(self.size)
+                if len(self.histories) > self.maxsize:
+                    self.histories.popitem(last=False)
+            else:
+                self.histories.move_to_end(target)
+            return history
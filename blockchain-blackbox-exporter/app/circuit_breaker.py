@@ -0,0 +1,135 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, CollectorRegistry
+
+CLOSED    = 0
+OPEN      = 1
+HALF_OPEN = 2
+
+class Breaker:
+    __slots__ = ("state", "failures", "backoff", "openUntil", "trialUntil")
+
+    def __init__(self):
+        self.state      = CLOSED
+        self.failures   = 0
+        self.backoff    = 0
+        self.openUntil  = 0
+        # End of the half-open trial, another one is let through after it
+        self.trialUntil = 0
+
+class CircuitBreaker:
+    """
+    Per-target circuit breaker of unreachable nodes.
+    After `threshold` consecutive probes failing to connect the breaker opens
+    and the target isn't probed for `backoff` seconds, doubled after every
+    failed trial up to `max_backoff`. When the window ends a single trial
+    probe is let through (half-open), it closes the breaker if the node
+    replies. A trial without outcome after `trial_timeout` seconds, e.g. its
+    worker died, is replaced by the next probe.
+    Only targets with failures are kept, `threshold` 0 disables the breaker.
+    With a SharedStore the breakers are shared with the other workers and
+    expire if not updated for `max_backoff` + `trial_timeout`.
+    """
+    def __init__(self, registry: CollectorRegistry, threshold: int = 3,
+                 backoff: float = 30, max_backoff: float = 600, store = None, trial_timeout: float = 25):
+        self.threshold     = threshold
+        self.backoff       = backoff
+        self.max_backoff   = max_backoff
+        self.store         = store
+        self.trial_timeout = trial_timeout
+        self.lock     = threading.Lock()
+        # target -> Breaker, without store
+        self.breakers = dict()
+
+        self.state    = Gauge('circuit_breaker_state', 'Breaker state of the targets which failed (0 - closed, 1 - open, 2 - half-open)', ['target'],
+                              registry=registry, multiprocess_mode='mostrecent')
+        self.rejected = Counter('circuit_breaker_rejected_probes', 'Probes failed without reaching the node', [], registry=registry)
+        self.opened   = Counter('circuit_breaker_opened', 'Times a breaker opened', [], registry=registry)
+
+    def load(self, target: str, db = None):
+        if self.store is None:
+            return self.breakers.get(target)
+        return self.store.get("breaker", target, db=db)
+
+    @contextmanager
+    def locked(self):
+        """Yields the store's connection in a transaction, None without store"""
+        if self.store is None:
+            with self.lock:
+                yield None
+        else:
+            with self.store.transaction() as db:
+                yield db
+
+    def save(self, target: str, breaker: Breaker, db):
+        if self.store is None:
+            self.breakers[target] = breaker
+        else:
+            self.store.set("breaker", target, breaker, self.max_backoff + self.trial_timeout, db=db)
+
+    def drop(self, target: str, db):
+        if self.store is None:
+            del self.breakers[target]
+        else:
+            self.store.delete("breaker", target, db=db)
+
+    def allow(self, target: str) -> bool:
+        """Whether the target can be probed now"""
+        if self.threshold <= 0 or self.load(target) is None:
+            return True
+        with self.locked() as db:
+            breaker = self.load(target, db)
+            if breaker is None or breaker.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if (breaker.state == OPEN and now >= breaker.openUntil or
+                    breaker.state == HALF_OPEN and now >= breaker.trialUntil):
+                breaker.state = HALF_OPEN
+                breaker.trialUntil = now + self.trial_timeout
+                self.save(target, breaker, db)
+                self.state.labels(target).set(HALF_OPEN)
+                return True
+            self.rejected.inc()
+            return False
+
+    def record(self, target: str, reachable: bool):
+        """
+        Records the outcome of an allowed probe, `reachable` None when no RPC
+        was completed, e.g. the probe was out of time budget
+        """
+        if self.threshold <= 0 or (reachable is not False and self.load(target) is None):
+            return
+        with self.locked() as db:
+            breaker = self.load(target, db)
+            if reachable:
+                if breaker is not None:
+                    self.drop(target, db)
+                    if breaker.state != CLOSED:
+                        self.state.labels(target).set(CLOSED)
+                return
+
+            if reachable is None:
+                # Unknown outcome, the next probe makes the trial again
+                if breaker is not None and breaker.state == HALF_OPEN:
+                    breaker.state = OPEN
+                    self.save(target, breaker, db)
+                    self.state.labels(target).set(OPEN)
+                return
+
+            if breaker is None:
+                breaker = Breaker()
+            breaker.failures += 1
+            if breaker.state == HALF_OPEN:
+                breaker.backoff = min(breaker.backoff * 2, self.max_backoff)
+            elif breaker.state == CLOSED and breaker.failures >= self.threshold:
+                breaker.backoff = self.backoff
+            else:
+                self.save(target, breaker, db)
+                return
+            breaker.state = OPEN
+            breaker.openUntil = time.monotonic() + breaker.backoff
+            self.save(target, breaker, db)
+            self.state.labels(target).set(OPEN)
+            self.opened.inc()
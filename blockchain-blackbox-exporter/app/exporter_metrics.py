@@ -0,0 +1,64 @@
+import os
+
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, multiprocess
+
+# Seconds, up to the read timeout of the upstream requests
+RPC_BUCKETS   = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 15)
+PROBE_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 15, 30, 60)
+
+class ExporterMetrics:
+    """
+    Exporter's own throughput, latency and saturation metrics, exposed on
+    /metrics next to the session pool and cache metrics.
+    Upstream latency is labeled by chain and probe phase (Rpc.phase) to tell
+    slow nodes from a saturated exporter.
+    """
+    def __init__(self, registry: CollectorRegistry):
+        self.rpcDuration   = Histogram('rpc_duration_seconds', 'Upstream RPC latency', ['chain', 'phase'],
+                                       buckets=RPC_BUCKETS, registry=registry)
+        self.rpcErrors     = Counter('rpc_errors', 'Failed upstream RPCs by exception type', ['chain', 'phase', 'error'], registry=registry)
+        self.probeDuration = Histogram('probe_duration_seconds', 'Duration of whole probes', ['chain'],
+                                       buckets=PROBE_BUCKETS, registry=registry)
+        self.probeErrors   = Counter('probe_errors', 'Probes aborted by an exception, by exception type', ['chain', 'error'], registry=registry)
+        # Summed over the live workers in multi-process mode
+        self.inFlight      = Gauge('probes_in_flight', 'Probes being run', ['chain'], registry=registry, multiprocess_mode='livesum')
+        self.poolThreads   = Gauge('thread_pool_threads', 'Threads of the pool', ['pool'], registry=registry, multiprocess_mode='livesum')
+        self.poolActive    = Gauge('thread_pool_active', 'Tasks running on the pool', ['pool'], registry=registry, multiprocess_mode='livesum')
+        self.poolQueued    = Gauge('thread_pool_queued', 'Tasks waiting for a thread of the pool', ['pool'], registry=registry, multiprocess_mode='livesum')
+
+    def rpc(self, chainid: str, rpc, error: Exception = None):
+        """Records a finished upstream request"""
+        self.rpcDuration.labels(chainid, rpc.phase).observe(rpc.duration / 1e9)
+        if error is not None:
+            self.rpcErrors.labels(chainid, rpc.phase, type(error).__name__).inc()
+
+    def probe(self, chainid: str, res):
+        """Records a finished probe"""
+        self.probeDuration.labels(chainid).observe(res.totalDuration / 1e9)
+        if res.error is not None:
+            self.probeErrors.labels(chainid, res.error).inc()
+
+    def pool(self, name: str, threads: int):
+        self.poolThreads.labels(name).set(threads)
+        return self.poolActive.labels(name)
+
+    def submit(self, name: str, executor, fn, *args):
+        """executor.submit() counting the queued and running tasks of the pool"""
+        queued, active = self.poolQueued.labels(name), self.poolActive.labels(name)
+        queued.inc()
+
+        def run():
+            queued.dec()
+            with active.track_inprogress():
+                return fn(*args)
+        return executor.submit(run)
+
+def generateMetrics(registry: CollectorRegistry):
+    """
+    /metrics output, merged from the files of all the gunicorn workers
+    when PROMETHEUS_MULTIPROC_DIR is set
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry=registry)
@@ -1,3 +1,7 @@
+import os
+import glob
+import shutil
+
 # Gunicorn config variables
 loglevel = "info"
 errorlog = "-"  # stderr
@@ -6,7 +10,36 @@ worker_tmp_dir = "/dev/shm"
 graceful_timeout = 120
 timeout = 30
 keepalive = 5
-worker_class = "gthread"
-workers = 1
-threads = 8
+# /probe_multi has all the targets of a chain in the query string, gthread
+# requests lines aren't limited (0), the asyncio engine sets its own limit
+limit_request_line = 0
+# "gthread" for bb_exporter:app
+# "aiohttp.GunicornWebWorker" for the asyncio engine bb_exporter_async:app
+worker_class = os.environ.get("WORKER_CLASS", "gthread")
+# Worker processes, with more than one the metrics are aggregated through
+# PROMETHEUS_MULTIPROC_DIR and the probe cache, circuit breakers, background
+# results and newHeads subscriptions are shared through the SHARED_STORE
+# SQLite file
+workers = int(os.environ.get("WORKERS", 1))
+threads = int(os.environ.get("THREADS", 8))
 bind = "0.0.0.0:9000"
+
+if workers > 1:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/dev/shm/bb-exporter-metrics")
+    os.environ.setdefault("SHARED_STORE", "/dev/shm/bb-exporter.sqlite")
+
+def on_starting(server):
+    """Drops the state left by a previous run"""
+    metricsDir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metricsDir:
+        shutil.rmtree(metricsDir, ignore_errors=True)
+        os.makedirs(metricsDir)
+    sharedStore = os.environ.get("SHARED_STORE")
+    if sharedStore:
+        for path in glob.glob(f"{sharedStore}*"):
+            os.remove(path)
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,175 @@
+import os
+import time
+import fcntl
+import random
+import asyncio
+import logging
+import threading
+
+import orjson
+import aiohttp
+from prometheus_client import Counter, Gauge, CollectorRegistry
+
+SUBSCRIBE_DATA = '{"jsonrpc":"2.0","method":"eth_subscribe","params":["newHeads"],"id":1}'
+
+class Subscription:
+    __slots__ = ("url", "header", "parent", "received", "connected", "lastUsed")
+
+    def __init__(self, url: str):
+        self.url       = url
+        self.header    = None
+        # Previous header if it is the parent of the latest one
+        self.parent    = None
+        # time.monotonic() of the latest header
+        self.received  = 0
+        self.connected = False
+        self.lastUsed  = time.monotonic()
+
+class HeadTracker:
+    """
+    Follows the latest block of EVM nodes through eth_subscribe("newHeads").
+    One WebSocket per endpoint, opened by the first head() asking for it and
+    closed when it isn't asked for `idle` seconds. Failed connections are
+    retried after `backoff` seconds, doubled up to `max_backoff`.
+    The connections run on an own asyncio loop thread, so both engines
+    share the same tracker code.
+    With a SharedStore only one worker, holding the store's lock file, opens
+    the subscriptions asked by all the workers and publishes the headers to
+    the others, so a node gets one subscription per host.
+    """
+    def __init__(self, registry: CollectorRegistry, max_age: float = 60, idle: float = 600,
+                 backoff: float = 1, max_backoff: float = 300, maxsize: int = 1024, store = None):
+        self.max_age     = max_age
+        self.idle        = idle
+        self.backoff     = backoff
+        self.max_backoff = max_backoff
+        self.maxsize     = maxsize
+        self.shared      = store
+        self.leader      = store is None
+        self.lock = threading.Lock()
+        # url -> Subscription, of the leader
+        self.subscriptions = dict()
+        # url -> time.monotonic() the endpoint was last asked for, of the other workers
+        self.wanted = dict()
+        self.loop    = asyncio.new_event_loop()
+        self.session = None
+
+        self.connections = Gauge('head_subscriptions', 'Open newHeads subscriptions', [], registry=registry, multiprocess_mode='livesum')
+        self.headers     = Counter('head_subscription_headers', 'Block headers pushed by the nodes', [], registry=registry)
+        self.failures    = Counter('head_subscription_failures', 'Subscriptions failed or closed by the node, by exception type', ['error'], registry=registry)
+
+    def start(self):
+        threading.Thread(target=self.loop.run_forever, name="head-tracker", daemon=True).start()
+        if self.shared is not None:
+            threading.Thread(target=self.lead, name="head-leader", daemon=True).start()
+        return self
+
+    def lead(self):
+        """Follows the endpoints asked by the workers once this worker holds the lock, the leader keeps it until it exits"""
+        lockFile = open(f"{self.shared.path}.heads.lock", "w")
+        while True:
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(5)
+        logging.info(f"Worker {os.getpid()} follows the head subscriptions")
+        self.leader = True
+        while True:
+            for url in self.shared.keys("head_wanted"):
+                with self.lock:
+                    self.subscription(url)
+            time.sleep(1)
+
+    def subscription(self, url: str):
+        """Subscription of the endpoint, opened if needed, None if there are too many. Must be called under the lock"""
+        sub = self.subscriptions.get(url)
+        if sub is None:
+            if len(self.subscriptions) >= self.maxsize:
+                return None
+            sub = self.subscriptions[url] = Subscription(url)
+            asyncio.run_coroutine_threadsafe(self.follow(sub), self.loop)
+        sub.lastUsed = time.monotonic()
+        return sub
+
+    def head(self, url: str):
+        """
+        (latest header, its parent header or None) of the endpoint, None if the
+        subscription isn't open or no header came for `max_age` seconds.
+        Subscribes to the endpoint on the first call.
+        """
+        if not self.leader:
+            return self.sharedHead(url)
+        with self.lock:
+            sub = self.subscription(url)
+            if sub is None or not sub.connected or time.monotonic() - sub.received > self.max_age:
+                return None
+            return sub.header, sub.parent
+
+    def sharedHead(self, url: str):
+        """Head published by the leader, asks it to follow the endpoint for `idle` seconds"""
+        now = time.monotonic()
+        with self.lock:
+            asked = self.wanted.get(url)
+            if asked is None and len(self.wanted) >= self.maxsize:
+                self.wanted = {u: t for u, t in self.wanted.items() if now - t < self.idle}
+                if len(self.wanted) >= self.maxsize:
+                    return None
+            # Written again when a tenth of the idle time passed
+            publish = asked is None or now - asked > self.idle / 10
+            if publish:
+                self.wanted[url] = now
+        if publish:
+            self.shared.set("head_wanted", url, True, self.idle)
+        return self.shared.get("head", url)
+
+    async def follow(self, sub: Subscription):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=10))
+        backoff = self.backoff
+        try:
+            while time.monotonic() - sub.lastUsed < self.idle:
+                try:
+                    await self.subscribe(sub)
+                    backoff = self.backoff
+                except Exception as e:
+                    self.failures.labels(type(e).__name__).inc()
+                    logging.warning(f"Head subscription {sub.url} failed: {e!r}")
+                await asyncio.sleep(backoff * random.uniform(1, 1.2))
+                backoff = min(backoff * 2, self.max_backoff)
+        finally:
+            with self.lock:
+                del self.subscriptions[sub.url]
+
+    async def subscribe(self, sub: Subscription):
+        """Receives the headers until the connection fails or isn't used anymore"""
+        async with self.session.ws_connect(sub.url, heartbeat=30, max_msg_size=0) as ws:
+            await ws.send_str(SUBSCRIBE_DATA)
+            reply = orjson.loads(await ws.receive_str(timeout=10))
+            if "result" not in reply:
+                raise Exception(f"Subscription refused: {reply.get('error')}")
+
+            sub.connected = True
+            self.connections.inc()
+            try:
+                while time.monotonic() - sub.lastUsed < self.idle:
+                    # A node not pushing headers is polled instead
+                    msg = await ws.receive(timeout=self.max_age)
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        raise ConnectionError(f"WebSocket closed: {msg.type.name}")
+                    header = orjson.loads(msg.data).get("params", {}).get("result")
+                    if not header:
+                        continue
+                    self.headers.inc()
+                    latest = sub.header
+                    sub.parent   = latest if latest is not None and latest.get("hash") == header.get("parentHash") else None
+                    sub.header   = header
+                    sub.received = time.monotonic()
+                    if self.shared is not None:
+                        # Expires like the local header when no new one comes
+                        self.shared.set("head", sub.url, (sub.header, sub.parent), self.max_age)
+            finally:
+                sub.connected = False
+                self.connections.dec()
+                if self.shared is not None:
+                    self.shared.delete("head", sub.url)
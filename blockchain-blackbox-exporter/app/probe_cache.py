@@ -0,0 +1,148 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from prometheus_client import Counter, Gauge, CollectorRegistry
+
+class ProbeCache:
+    """
+    Short-TTL, size-bounded LRU cache of probe results keyed by the probe's
+    parameters, e.g. (chainid, target, options), with single-flight: concurrent probes of the same key
+    wait for the one already in flight instead of hitting the node again.
+
+    get() is used by threaded engines, aget() by the asyncio engine.
+    With a SharedStore the results are also shared with the other workers.
+    """
+    def __init__(self, registry: CollectorRegistry, ttl: float = 5, maxsize: int = 4096, store = None):
+        self.ttl     = ttl
+        self.maxsize = maxsize
+        self.shared  = store
+        self.lock     = threading.Lock()
+        # key -> (expiration time, result), ordered from the least recently used
+        self.results  = OrderedDict()
+        # key -> future of the probe in flight
+        self.inflight = dict()
+
+        self.hits      = Counter('probe_cache_hits', 'Probes served from the results cache', [], registry=registry)
+        self.misses    = Counter('probe_cache_misses', 'Probes sent to the node', [], registry=registry)
+        self.coalesced = Counter('probe_cache_coalesced', 'Probes which waited for the same probe in flight', [], registry=registry)
+        self.size      = Gauge('probe_cache_size', 'Number of cached probe results', [], registry=registry, multiprocess_mode='livesum')
+
+    def remember(self, key, expires: float, result):
+        """Keeps the result until `expires` (time.monotonic()), must be called under the lock"""
+        self.results[key] = (expires, result)
+        self.results.move_to_end(key)
+        while len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+        self.size.set(len(self.results))
+
+    def cached(self, key):
+        """Fresh cached result of `key` or None, must be called under the lock"""
+        entry = self.results.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits.inc()
+            self.results.move_to_end(key)
+            return entry
+        # Expired results are kept for stale() until replaced or evicted
+        return None
+
+    def lookup(self, key, newFuture):
+        """
+        Returns (result, None, False) on a cache hit,
+        otherwise (None, future, leader) where only the leader runs the probe.
+        The shared store is read outside the lock, so a slow store doesn't
+        stall the lookups of the other keys.
+        """
+        with self.lock:
+            entry = self.cached(key)
+            if entry is not None:
+                return entry[1], None, False
+            future = self.inflight.get(key)
+            if future is not None:
+                self.coalesced.inc()
+                return None, future, False
+
+        shared = None
+        if self.shared is not None and self.ttl > 0:
+            shared = self.shared.get("probe", repr(key))
+
+        with self.lock:
+            if shared is not None:
+                expires, result = shared
+                self.hits.inc()
+                self.remember(key, time.monotonic() + expires - time.time(), result)
+                return result, None, False
+            # Probed by another thread meanwhile
+            entry = self.cached(key)
+            if entry is not None:
+                return entry[1], None, False
+            future = self.inflight.get(key)
+            if future is not None:
+                self.coalesced.inc()
+                return None, future, False
+
+            self.misses.inc()
+            future = self.inflight[key] = newFuture()
+            return None, future, True
+
+    def store(self, key, result):
+        """Caches the leader's result and ends its flight, then shares it with the other workers"""
+        with self.lock:
+            self.inflight.pop(key, None)
+            if result is None or self.ttl <= 0:
+                return
+            self.remember(key, time.monotonic() + self.ttl, result)
+        if self.shared is not None:
+            self.shared.set("probe", repr(key), (time.time() + self.ttl, result), self.ttl)
+
+    def stale(self, key):
+        """Latest cached result of `key` even if it has expired, None if there is none"""
+        with self.lock:
+            entry = self.results.get(key)
+        return entry[1] if entry is not None else None
+
+    def get(self, key, probe):
+        """Returns the cached result of `key` or calls `probe()` once for all the waiting threads"""
+        result, future, leader = self.lookup(key, Future)
+        if future is None:
+            return result
+        if not leader:
+            return future.result()
+
+        result = None
+        try:
+            result = probe()
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self.store(key, result)
+        return result
+
+    async def aget(self, key, probe):
+        """asyncio version of get(), `probe()` returns a coroutine"""
+        result, future, leader = self.lookup(key, asyncio.get_running_loop().create_future)
+        if future is None:
+            return result
+        if not leader:
+            return await asyncio.shield(future)
+
+        result = None
+        try:
+            result = await probe()
+            future.set_result(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Marks it as retrieved, asyncio logs the exceptions which no
+            # waiting probe has read
+            future.exception()
+            raise
+        finally:
+            self.store(key, result)
+        return result
@@ -0,0 +1,891 @@
+import os
+import json
+import time
+import logging
+import hashlib
+import inspect
+import orjson
+from prometheus_client import generate_latest, CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily, InfoMetricFamily
+from datetime import datetime
+
+from block_history import BlockHistories
+from shared_store import SharedStore
+
+#Timeout     (Connect, Read)
+REQ_TIMEOUT = (5,15)
+
+NOT_DEFINED = -1
+ERROR = -2
+ERROR_LAST_BLOCK = 2
+ERROR_PREV_BLOCK = 3
+ERROR_HEALTH     = 5
+# The probe ran out of its time budget, RPCs were cut or not sent,
+# the failed phase's code tells which one
+ERROR_DEADLINE   = 11
+# The target's circuit breaker is open, the node wasn't probed
+ERROR_CIRCUIT_OPEN = 13
+# The exporter was overloaded and no earlier result of the target was cached,
+# the node wasn't probed
+ERROR_OVERLOADED   = 17
+
+# Probe phases of the RPCs
+PHASE_LAST_BLOCK = "last_block"
+PHASE_PREV_BLOCK = "prev_block"
+PHASE_SYNCING    = "syncing"
+# Latest block and syncing status in one JSON-RPC batch
+PHASE_BATCH      = "batch"
+
+# Send independent RPCs of a probe concurrently, can be changed per probe
+# with the `parallel` query parameter
+PARALLEL_PROBE = os.environ.get('PARALLEL_PROBE', 'False').upper() == "TRUE"
+
+# Send EVM and Starknet RPCs as JSON-RPC batches, can be changed per probe
+# with the `batch` query parameter
+BATCH_PROBE = os.environ.get('BATCH_PROBE', 'False').upper() == "TRUE"
+# Seconds a node which rejected a JSON-RPC batch is probed with single
+# requests before the batch is tried again
+BATCH_RECHECK = float(os.environ.get('BATCH_RECHECK', 3600))
+
+# Measure DNS, connect, TLS, time to first byte and body transfer of every
+# RPC and export them as rpc_phase_duration_ns
+DETAILED_TIMING = os.environ.get('DETAILED_TIMING', 'False').upper() == "TRUE"
+
+# Seconds a probe may take when the scrape doesn't tell its timeout with the
+# X-Prometheus-Scrape-Timeout-Seconds header or the `timeout` query parameter
+PROBE_TIMEOUT        = float(os.environ.get('PROBE_TIMEOUT', 25))
+# Seconds kept from the scrape timeout to render and send the reply
+PROBE_TIMEOUT_OFFSET = float(os.environ.get('PROBE_TIMEOUT_OFFSET', 0.5))
+
+# Consecutive probes failing to connect which open the target's circuit
+# breaker (0 - disabled), and its first and longest backoff in seconds
+CIRCUIT_FAILURES    = int(os.environ.get('CIRCUIT_FAILURES', 3))
+CIRCUIT_BACKOFF     = float(os.environ.get('CIRCUIT_BACKOFF', 30))
+CIRCUIT_MAX_BACKOFF = float(os.environ.get('CIRCUIT_MAX_BACKOFF', 600))
+
+# Scrapes over the engine's caps of scrapes probing (MAX_PROBES and
+# MAX_CHAIN_PROBES, defaults per engine, a /probe_multi scrape takes one slot)
+# wait in a queue of MAX_QUEUED_PROBES for up to QUEUE_TIMEOUT seconds, then
+# they are shed and get the targets' last cached results if any
+MAX_QUEUED_PROBES = int(os.environ.get('MAX_QUEUED_PROBES', 64))
+QUEUE_TIMEOUT     = float(os.environ.get('QUEUE_TIMEOUT', 2))
+
+# Recent blocks kept per target (0 - disabled), the previous block metrics
+# are filled from them when the parent of the latest block is known
+BLOCK_HISTORY_SIZE = int(os.environ.get('BLOCK_HISTORY_SIZE', 32))
+
+# Seconds to reuse a probe result of the same chainid+target and options
+# (parallel, batch, ws) (0 - disabled), concurrent probes of the same
+# chainid+target and options always share one request
+PROBE_CACHE_TTL  = float(os.environ.get('PROBE_CACHE_TTL', 5))
+PROBE_CACHE_SIZE = int(os.environ.get('PROBE_CACHE_SIZE', 4096))
+
+# How block hashes are exported:
+# "info"        - *_hash info metrics labeled by the hash, a new series per block
+# "fingerprint" - *_hash_fingerprint gauges, the first 52 bits of the hash
+#                 as a number, one series per target
+# "none"        - not exported
+HASH_MODE = os.environ.get('HASH_MODE', 'info')
+
+# Latest block of EVM targets pushed by eth_subscribe("newHeads") instead
+# of polled, when the node doesn't push, the probe polls it as before:
+# "off"  - only for the WebSocket endpoint given by the `ws` parameter of /probe
+# "auto" - also at the target's URL with the ws:// or wss:// scheme
+HEAD_SUBSCRIPTION = os.environ.get('HEAD_SUBSCRIPTION', 'off')
+# Seconds without a new header after which the node is polled again
+HEAD_MAX_AGE      = float(os.environ.get('HEAD_MAX_AGE', 60))
+# Seconds a subscription is kept open without being probed
+HEAD_IDLE_TIMEOUT = float(os.environ.get('HEAD_IDLE_TIMEOUT', 600))
+
+# SQLite file sharing the probe cache, circuit breakers, batch support and
+# newHeads subscriptions between the gunicorn workers, set by gunicorn_conf.py with WORKERS > 1
+SHARED_STORE = os.environ.get('SHARED_STORE')
+
+# Optional JSON file with additional chain plugins, see loadChains()
+CHAINS_CONFIG = os.environ.get('CHAINS_CONFIG')
+
+# Maximum allowed age of the last block per chain
+# Required if eth_syncing returns not standard values
+METER_LAST_BLOCK_MAX_AGE = 15
+
+# Per-probe metrics: (ProbeResult attribute, metric name, description)
+PROBE_GAUGES = [
+    # Latest block metrics
+    ("lastBlockNumber",     "last_block_number",        "Number of the node's latest block"),
+    ("lastBlockAge",        "last_block_age",           "How many seconds old is the node's latest block"),
+    ("lastBlockDuration",   "last_block_duration_ns",   "How many nanoseconds took to get the latest block"),
+    # Latest-1 block metrics
+    ("prevBlockNumber",     "prev_block_number",        "Number of the node's latest block"),
+    ("prevBlockAge",        "prev_block_age",           "How many seconds old is the node's latest block"),
+    ("prevBlockDuration",   "prev_block_duration_ns",   "How many nanoseconds took to get the latest block"),
+
+    ("nodeSyncing",         "node_syncing",             "Is the node syncing 0/1"),
+    ("nodeSyncingDuration", "node_syncing_duration_ns", "How many nanoseconds took to get syncing status"),
+
+    # Block history metrics
+    ("blockRate",           "block_rate",               "Blocks per second over the node's recent blocks seen by the exporter"),
+    ("reorgs",              "block_reorgs",             "Blocks replaced by a different block of the same number since the exporter started"),
+
+    ("lastBlockPushed",     "last_block_pushed",        "Whether the latest block was pushed by the node's newHeads subscription (1) or requested (0)"),
+
+    ("probeSuccess",        "probe_success",            "Displays whether or not the probe was a successful (1 - success, >1 falure)"),
+    ("totalDuration",       "total_duration_ns",        "How many nanoseconds took whole job"),
+]
+PROBE_INFOS = [
+    ("lastBlockHash",       "last_block_hash",          "Latest block hash"),
+    ("lastBlockParentHash", "last_block_parent_hash",   "Latest block parent hash"),
+    ("prevBlockHash",       "prev_block_hash",          "Latest block hash"),
+    ("prevBlockParentHash", "prev_block_parent_hash",   "Latest block parent hash"),
+]
+
+class ProbeResult:
+    """
+    Values collected by a single probe.
+    Every /probe request fills its own result, so concurrent probes never
+    overwrite each other's values before they are rendered.
+    """
+    def __init__(self):
+        for attr, _, _ in PROBE_GAUGES:
+            setattr(self, attr, 0)
+        for attr, _, _ in PROBE_INFOS:
+            setattr(self, attr, None)
+        # Unix time when the probe finished
+        self.timestamp = None
+        # Type name of the exception which aborted the probe
+        self.error = None
+        # Rpc phase -> {connection phase: ns}, with DETAILED_TIMING only
+        self.timings = dict()
+        # Set by the engine when RPCs were cut or skipped by the probe deadline
+        self.deadlineExceeded = False
+        # Set by the engine: True if the node replied to any RPC,
+        # False if the RPCs failed to connect or timed out
+        self.nodeReachable = None
+
+    def addTimings(self, rpc):
+        """Adds the connection phase durations of the RPC to its probe phase"""
+        if rpc.timings:
+            phases = self.timings.setdefault(rpc.phase, dict())
+            for phase, ns in rpc.timings.items():
+                phases[phase] = phases.get(phase, 0) + ns
+
+class ProbeCollector:
+    """
+    Exposes ProbeResults as prometheus metric families.
+    `results` maps instance label values to results, a single result
+    without labels is given as {None: result}.
+    """
+    def __init__(self, results: dict):
+        self.results = results
+
+    def collect(self):
+        labels = [] if None in self.results else ["instance"]
+        for attr, name, doc in PROBE_GAUGES:
+            family = GaugeMetricFamily(name, doc, labels=labels)
+            for instance, result in self.results.items():
+                family.add_metric(labels and [instance], getattr(result, attr))
+            yield family
+        now = time.time()
+        family = GaugeMetricFamily('probe_result_age_seconds', 'How many seconds ago the probe finished', labels=labels)
+        for instance, result in self.results.items():
+            family.add_metric(labels and [instance], now - result.timestamp if result.timestamp else 0)
+        yield family
+        if any(result.timings for result in self.results.values()):
+            family = GaugeMetricFamily('rpc_phase_duration_ns', 'How many nanoseconds the RPCs of the probe phase spent in each connection phase',
+                                       labels=labels + ["rpc", "phase"])
+            for instance, result in self.results.items():
+                for rpcPhase, phases in result.timings.items():
+                    for phase, ns in phases.items():
+                        family.add_metric((labels and [instance]) + [rpcPhase, phase], ns)
+            yield family
+        if labels:
+            family = GaugeMetricFamily('last_block_consensus', 'Is the latest block hash the most common one among the targets at the same block number 0/1', labels=labels)
+            for instance, match in consensus(self.results).items():
+                family.add_metric([instance], match)
+            yield family
+
+        if HASH_MODE == "fingerprint":
+            for attr, name, doc in PROBE_INFOS:
+                family = GaugeMetricFamily(f"{name}_fingerprint", f"{doc}, first 52 bits", labels=labels)
+                for instance, result in self.results.items():
+                    family.add_metric(labels and [instance], fingerprint(getattr(result, attr)))
+                yield family
+        elif HASH_MODE == "info":
+            for attr, name, doc in PROBE_INFOS:
+                family = InfoMetricFamily(name, doc, labels=labels)
+                for instance, result in self.results.items():
+                    value = getattr(result, attr)
+                    family.add_metric(labels and [instance], {} if value is None else {"hash": value})
+                yield family
+
+def fingerprint(blockHash: str):
+    """
+    Number identifying the hash, exact in a float64: the first 13 digits of
+    hex hashes, 52 bits of its blake2b digest for others (e.g. base58)
+    """
+    if blockHash is None:
+        return NOT_DEFINED
+    if blockHash == "none":
+        return ERROR
+    try:
+        if blockHash[:2] == "0x":
+            return int(blockHash[2:15], 16)
+    except ValueError:
+        pass
+    return int.from_bytes(hashlib.blake2b(blockHash.encode(), digest_size=8).digest(), "big") >> 12
+
+def consensus(results: dict):
+    """
+    instance -> 1 if its latest block hash is the most common one among the
+    instances at the same block number, 0 if not, NOT_DEFINED without hash
+    """
+    counts = dict()
+    for result in results.values():
+        if result.lastBlockHash not in (None, "none"):
+            key = (result.lastBlockNumber, result.lastBlockHash)
+            counts[key] = counts.get(key, 0) + 1
+    best = dict()
+    for (number, _), count in counts.items():
+        best[number] = max(best.get(number, 0), count)
+
+    matches = dict()
+    for instance, result in results.items():
+        key = (result.lastBlockNumber, result.lastBlockHash)
+        matches[instance] = int(counts[key] == best[key[0]]) if key in counts else NOT_DEFINED
+    return matches
+
+def render(result: ProbeResult):
+    return renderMulti({None: result})
+
+def renderMulti(results: dict):
+    """Renders results of several targets labeled by their instance"""
+    reg = CollectorRegistry(auto_describe=False)
+    reg.register(ProbeCollector(results))
+    return generate_latest(registry=reg)
+
+def probeDeadline(timeout: str = None):
+    """time.monotonic() deadline of a probe given the scrape timeout in seconds"""
+    try:
+        seconds = float(timeout) - PROBE_TIMEOUT_OFFSET
+    except (TypeError, ValueError):
+        seconds = PROBE_TIMEOUT
+    return time.monotonic() + max(seconds, 0.1)
+
+def atoi(a: str):
+    # logging.debug(f"Given: {a}, {a[:2]}")
+    if a[:2] == "0x":
+        return int(a, 16), "hex"
+    else:
+        return int(a), "dec"
+
+def decodeJson(body: bytes):
+    return orjson.loads(body)
+
+def decodeBlock(body: bytes):
+    """
+    Decodes a block reply without its transaction hashes array, which is
+    most of a busy chain's block and isn't used by the probes.
+    Works for single and batch replies, anything unexpected is decoded as is.
+    """
+    key = body.find(b'"transactions"')
+    if key != -1:
+        start = key + len(b'"transactions"')
+        while start < len(body) and body[start:start+1] in b' \t\r\n:':
+            start += 1
+        end = body.find(b']', start)
+        # Only flat arrays of hashes, full transactions may contain brackets
+        if body[start:start+1] == b'[' and end != -1 and body.find(b'{', start, end) == -1:
+            try:
+                return orjson.loads(body[:start] + b'[]' + body[end+1:])
+            except orjson.JSONDecodeError:
+                pass
+    return orjson.loads(body)
+
+class Rpc:
+    """
+    Single upstream request of a probe.
+    Probes yield Rpc objects and the engine running the probe (blocking in
+    bb_exporter, asyncio in bb_exporter_async) sends back the decoded reply,
+    or None if the request failed.
+    A list of independent Rpc objects is executed concurrently and replied
+    with the list of their replies.
+    `decode` turns the raw reply body into the reply.
+    `phase` is the part of the probe the request belongs to, e.g. last_block.
+    """
+    __slots__ = ("target", "data", "method", "decode", "phase", "duration", "timings")
+
+    def __init__(self, target: str, data: str = None, method: str = "post", decode = decodeJson, phase: str = PHASE_LAST_BLOCK):
+        self.target = target
+        self.data   = data
+        self.method = method
+        self.decode = decode
+        self.phase  = phase
+        # Nanoseconds the request took, set by the engine
+        self.duration = NOT_DEFINED
+        # Connection phase -> nanoseconds, set by the engine with DETAILED_TIMING
+        self.timings  = None
+
+sharedStore = SharedStore(SHARED_STORE) if SHARED_STORE else None
+
+# target -> time.time() until which the node is probed without batches,
+# set when it rejected a batch
+batchRejected = sharedStore.mapping("batch", BATCH_RECHECK) if sharedStore else dict()
+
+def batchData(*requests: str):
+    """JSON-RPC batch of the given requests, ids are set to their positions"""
+    return json.dumps([dict(json.loads(r), id=i) for i, r in enumerate(requests)])
+
+def batchReplies(reply, size: int):
+    """Batch replies ordered by their ids, None if the node didn't process the batch"""
+    if not isinstance(reply, list) or len(reply) != size:
+        return None
+    replies = [None] * size
+    for r in reply:
+        if not isinstance(r, dict) or r.get("id") not in range(size):
+            return None
+        replies[r["id"]] = r
+    return replies
+
+class Payload:
+    """Request body template split once around its only parameter"""
+    def __init__(self, template: str, param: str):
+        self.prefix, self.suffix = template.format(**{param: "\0"}).split("\0")
+
+    def __call__(self, value) -> str:
+        return f"{self.prefix}{value}{self.suffix}"
+
+# target -> recent blocks of the node
+blockHistories = BlockHistories(BLOCK_HISTORY_SIZE) if BLOCK_HISTORY_SIZE > 0 else None
+
+########## Chain probe plugins
+class ChainProbe:
+    """
+    Base class of the per-chain probe plugins.
+    Plugins are built once at import time with their request payloads and
+    `run()` is a generator yielding the Rpc requests of a single probe.
+    Failed phases are recorded by multiplying res.probeSuccess by their
+    ERROR_* code.
+    """
+    # Whether the latest block can be pushed by a newHeads subscription
+    subscribable = False
+
+    def __init__(self, path: str = ""):
+        # URL path added to the target, e.g. AVAX subnets
+        self.path = path
+
+    def run(self, target: str, res: ProbeResult, parallel: bool, batch: bool):
+        raise NotImplementedError
+
+    @staticmethod
+    def recordLatest(target: str, res: ProbeResult, timestamp: int):
+        """
+        Adds the latest block to the target's history.
+        Fills the previous block values from the history and returns True
+        if the parent is known, then its RPC isn't needed.
+        """
+        if blockHistories is None:
+            return False
+        history = blockHistories.get(target)
+        history.record(res.lastBlockNumber, res.lastBlockHash, res.lastBlockParentHash, timestamp)
+        res.blockRate = history.rate()
+        res.reorgs    = history.reorgs
+
+        parent = history.parent(res.lastBlockNumber, res.lastBlockParentHash)
+        if parent is None:
+            return False
+        number, blockHash, parentHash, parentTimestamp = parent
+        # No RPC was sent
+        res.prevBlockDuration = 0
+        res.prevBlockAge = int(time.time()) - parentTimestamp
+        res.prevBlockNumber = number
+        res.prevBlockHash = blockHash
+        res.prevBlockParentHash = parentHash
+        return True
+
+    @staticmethod
+    def recordPrev(target: str, res: ProbeResult, timestamp: int):
+        """Adds the fetched previous block to the target's history"""
+        if blockHistories is None:
+            return
+        history = blockHistories.get(target)
+        history.record(res.prevBlockNumber, res.prevBlockHash, res.prevBlockParentHash, timestamp)
+        res.reorgs = history.reorgs
+
+class PoktProbe(ChainProbe):
+    heightData = '{"height": 0}'
+
+    def run(self, target: str, res: ProbeResult, parallel: bool, batch: bool):
+        heightRpc = Rpc(f"{target}{self.path}/v1/query/height", self.heightData)
+        block = yield heightRpc
+        res.lastBlockDuration = heightRpc.duration
+        # Cannot determine timestamp
+        res.lastBlockAge = NOT_DEFINED
+
+        res.lastBlockNumber = int(block["height"])
+
+class SolanaProbe(ChainProbe):
+    slotData    = '{"jsonrpc":"2.0","id":1, "method":"getSlot"}'
+    blockData   = Payload('''{{
+                        "jsonrpc": "2.0","id":1,
+                        "method":"getBlock",
+                        "params": [
+                            {slot},
+                            {{
+                            "encoding": "json",
+                            "maxSupportedTransactionVersion":0,
+                            "transactionDetails":"none",
+                            "rewards":false
+                            }}
+                        ]
+                        }}''', "slot")
+    syncingData = '{"jsonrpc":"2.0","id":1, "method":"getHealth"}'
+    fTimestamp   = "blockTime"
+    fBlockNumber = "blockHeight"
+    fBlockHash   = "blockhash"
+    fParentHash  = "previousBlockhash"
+
+    def run(self, target: str, res: ProbeResult, parallel: bool, batch: bool):
+        target = f"{target}{self.path}"
+        slotRpc    = Rpc(target, self.slotData)
+        syncingRpc = Rpc(target, self.syncingData, phase=PHASE_SYNCING)
+        if parallel:
+            # Health check doesn't depend on the blocks
+            slotReply, syncingReply = yield [slotRpc, syncingRpc]
+        else:
+            slotReply = yield slotRpc
+
+        prevKnown = False
+        try:
+            slot = slotReply["result"]
+            blockRpc = Rpc(target, self.blockData(slot))
+            block = (yield blockRpc)["result"]
+            res.lastBlockDuration = slotRpc.duration + blockRpc.duration
+            b_timestamp = block[self.fTimestamp]
+
+            res.lastBlockAge = int(time.time()) - b_timestamp
+            res.lastBlockNumber = block[self.fBlockNumber]
+            res.lastBlockHash = str(block[self.fBlockHash])
+            res.lastBlockParentHash = str(block[self.fParentHash])
+            prevKnown = self.recordLatest(target, res, b_timestamp)
+        except Exception as e:
+            logging.warning(f"Failed to get latest block: {e}")
+            res.probeSuccess *= ERROR_LAST_BLOCK
+
+        try:
+            if not prevKnown:
+                blockRpc = Rpc(target, self.blockData(block["parentSlot"]), phase=PHASE_PREV_BLOCK)
+                block = (yield blockRpc)["result"]
+                res.prevBlockDuration = blockRpc.duration
+                b_timestamp = block[self.fTimestamp]
+                res.prevBlockAge = int(time.time()) - b_timestamp
+
+                res.prevBlockNumber = block[self.fBlockNumber]
+                res.prevBlockHash = str(block[self.fBlockHash])
+                res.prevBlockParentHash = str(block[self.fParentHash])
+                self.recordPrev(target, res, b_timestamp)
+        except Exception as e:
+            logging.warning(f"Failed to get previouse block: {e}")
+            res.probeSuccess *= ERROR_PREV_BLOCK
+
+        # response has result key only if node is synced otherwise
+        # it ll have error key instead
+        # https://docs.solana.com/api/http#gethealth
+        try:
+            sync = 1
+            if not parallel:
+                syncingReply = yield syncingRpc
+            if "result" in syncingReply.keys():
+                if syncingReply["result"] == "ok":
+                    sync = 0
+
+            res.nodeSyncing = sync
+            res.nodeSyncingDuration = syncingRpc.duration
+
+        except Exception as e:
+            logging.warning(f"Failed to get syncing status: {e}")
+            res.probeSuccess *= ERROR_HEALTH
+
+class CosmosProbe(ChainProbe):
+    def run(self, target: str, res: ProbeResult, parallel: bool, batch: bool):
+        blockRpc   = Rpc(f"{target}{self.path}/block", method='get')
+        syncingRpc = Rpc(f"{target}{self.path}/status", method='get', phase=PHASE_SYNCING)
+        if parallel:
+            blockReply, syncingReply = yield [blockRpc, syncingRpc]
+        else:
+            blockReply = yield blockRpc
+
+        block = blockReply["result"]["block"]
+        res.lastBlockDuration = blockRpc.duration
+
+        last_block_age = int(time.time()) - int(datetime.fromisoformat(block["header"]["time"]).timestamp())
+        res.lastBlockAge = last_block_age
+
+        res.lastBlockNumber = int(block["header"]["height"])
+
+        if not parallel:
+            syncingReply = yield syncingRpc
+        syncing = syncingReply["result"]["sync_info"]
+
+        sync = 1
+        if syncing["catching_up"] == False:
+            sync = 0
+        res.nodeSyncing = sync
+        res.nodeSyncingDuration = syncingRpc.duration
+
+class NearProbe(ChainProbe):
+    blockData   = '{"jsonrpc": "2.0", "id": "dontcare", "method": "block", "params": {"finality": "final"}}'
+    syncingData = '{"jsonrpc": "2.0", "id": "dontcare", "method": "status", "params": []}'
+
+    def run(self, target: str, res: ProbeResult, parallel: bool, batch: bool):
+        target = f"{target}{self.path}"
+        blockRpc = Rpc(target, self.blockData)
+        block = (yield blockRpc)["result"]
+        res.lastBlockDuration = blockRpc.duration
+        last_block_age = int(time.time()) - int(block["header"]["timestamp"]/1000000000)
+        res.lastBlockAge = last_block_age
+
+        res.lastBlockNumber = int(block["header"]["height"])
+
+        syncingRpc = Rpc(target, self.syncingData, phase=PHASE_SYNCING)
+        syncing = (yield syncingRpc)["result"]["sync_info"]["syncing"]
+        if syncing == False:
+            sync = 0
+        else:
+            sync = 1
+        res.nodeSyncing = sync
+        res.nodeSyncingDuration = syncingRpc.duration
+
+class SuiProbe(ChainProbe):
+    checkpointData = '{"jsonrpc":"2.0", "method":"sui_getLatestCheckpointSequenceNumber","id":1}'
+
+    def run(self, target: str, res: ProbeResult, parallel: bool, batch: bool):
+        checkpointRpc = Rpc(f"{target}{self.path}", self.checkpointData)
+        block = yield checkpointRpc
+        res.lastBlockDuration = checkpointRpc.duration
+
+        res.lastBlockNumber = int(block["result"])
+
+class EvmProbe(ChainProbe):
+    blockData       = Payload('{{"jsonrpc":"2.0","method":"eth_getBlockByNumber","params":[{height}, false],"id":1}}', "height")
+    blockByHashData = Payload('{{"jsonrpc":"2.0","method":"eth_getBlockByHash","params":["{hash}", false],"id":1}}', "hash")
+    syncingData     = '{"jsonrpc":"2.0","method":"eth_syncing","params":[],"id":1}'
+    fTimestamp   = "timestamp"
+    fBlockNumber = "number"
+    fBlockHash   = "hash"
+    fParentHash  = "parentHash"
+    # Whether the previous block can be requested by its number
+    prevByNumber = True
+    subscribable = True
+
+    def __init__(self, path: str = "", fields: dict = None, strictSyncing: bool = False):
+        """
+        fields        - overrides of the block field names, e.g. {"fBlockNumber": "block_number"}
+        strictSyncing - syncing status must report currentBlock and highestBlock
+        """
+        super().__init__(path)
+        for attr, name in (fields or {}).items():
+            setattr(self, attr, name)
+        self.strictSyncing   = strictSyncing
+        self.latestBlockData = self.blockData('"latest"')
+        self.batchData       = batchData(self.latestBlockData, self.syncingData)
+
+    def syncStatus(self, syncing) -> int:
+        if self.strictSyncing:
+            sync = 1
+            if syncing['currentBlock'] == syncing['highestBlock'] or syncing['highestBlock'] == "0x0":
+                sync = 0
+            return sync
+
+        sync = 1
+        if syncing == False:
+            sync = 0
+        elif 'current_block_num' in syncing.keys() and 'highest_block_num' in syncing.keys():
+            if syncing['current_block_num'] == syncing['highest_block_num']:
+                sync = 0
+        elif 'currentBlock' in syncing.keys() and 'highestBlock' in syncing.keys():
+            if syncing['currentBlock'] == syncing['highestBlock']:
+            #  last_block_age < METER_LAST_BLOCK_MAX_AGE:
+                sync = 0
+        return sync
+
+    def run(self, target: str, res: ProbeResult, parallel: bool, batch: bool, head: tuple = None):
+        """`head` - (latest header, its parent header or None) pushed by the node"""
+        target = f"{target}{self.path}"
+
+        logging.debug(self.latestBlockData)
+        blockRpc   = Rpc(target, self.latestBlockData, decode=decodeBlock)
+        syncingRpc = Rpc(target, self.syncingData, phase=PHASE_SYNCING)
+        batched = False
+        batchTried = head is None and batch and batchRejected.get(target, 0) <= time.time()
+        if batchTried:
+            # Latest block and syncing status in one JSON-RPC batch
+            batchRpc = Rpc(target, self.batchData, decode=decodeBlock, phase=PHASE_BATCH)
+            batchReply = yield batchRpc
+            replies = batchReplies(batchReply, 2)
+            if replies is not None:
+                batched = True
+                blockReply, syncingReply = replies
+                blockRpc.duration = syncingRpc.duration = batchRpc.duration
+
+        parent = None
+        syncingPending = not (parallel or batched) or head is not None
+        if head is not None:
+            # No RPC was sent
+            header, parent = head
+            blockReply = {"result": header}
+            blockRpc.duration = 0
+            res.lastBlockPushed = 1
+        elif not batched:
+            if parallel:
+                # Syncing status doesn't depend on the blocks
+                blockReply, syncingReply = yield [blockRpc, syncingRpc]
+            else:
+                blockReply = yield blockRpc
+
+        if batchTried and not batched and batchReply is not None and blockReply is not None:
+            # The node answers single requests but replied something else to
+            # the batch. A failed batch request (None), e.g. a timeout or a
+            # proxy error, is tried again by the next probe.
+            logging.info(f"JSON-RPC batch not supported by {target}, tried again in {BATCH_RECHECK:.0f}s")
+            batchRejected[target] = time.time() + BATCH_RECHECK
+
+        prevKnown = False
+        try:
+            block = blockReply["result"]
+            res.lastBlockDuration = blockRpc.duration
+            b_timestamp, base = atoi(str(block[self.fTimestamp]))
+
+            res.lastBlockAge = int(time.time()) - b_timestamp
+            blockNum, base = atoi(str(block[self.fBlockNumber]))
+            res.lastBlockNumber = blockNum
+            res.lastBlockHash = str(block[self.fBlockHash])
+            res.lastBlockParentHash = str(block[self.fParentHash])
+            prevKnown = self.recordLatest(target, res, b_timestamp)
+        except Exception as e:
+            logging.warning(f"Failed to get latest block: {e}")
+            res.probeSuccess *= ERROR_LAST_BLOCK
+
+        if not prevKnown and (batched or self.prevByNumber or parent is not None):
+            try:
+                if parent is not None:
+                    # Pushed before the latest header
+                    blockRpc = Rpc(target, phase=PHASE_PREV_BLOCK)
+                    blockRpc.duration = 0
+                elif batched:
+                    blockRpc = Rpc(target, self.blockByHashData(block[self.fParentHash]), decode=decodeBlock, phase=PHASE_PREV_BLOCK)
+                else:
+                    height = blockNum-1
+                    if base == "hex":
+                        height = str(hex(blockNum-1))
+                    blockRpc = Rpc(target, self.blockData(f'"{height}"'), decode=decodeBlock, phase=PHASE_PREV_BLOCK)
+                logging.debug(blockRpc.data)
+
+                block = parent if parent is not None else (yield blockRpc)["result"]
+
+                res.prevBlockDuration = blockRpc.duration
+                b_timestamp, base = atoi(str(block[self.fTimestamp]))
+                res.prevBlockAge = int(time.time()) - b_timestamp
+
+                blockNum, base = atoi(str(block[self.fBlockNumber]))
+                res.prevBlockNumber = blockNum
+                res.prevBlockHash = str(block[self.fBlockHash])
+                res.prevBlockParentHash = str(block[self.fParentHash])
+                self.recordPrev(target, res, b_timestamp)
+            except Exception as e:
+                logging.warning(f"Failed to get previouse block: {e}")
+                res.probeSuccess *= ERROR_PREV_BLOCK
+
+        try:
+            if syncingPending:
+                syncingReply = yield syncingRpc
+            res.nodeSyncing = self.syncStatus(syncingReply["result"])
+            res.nodeSyncingDuration = syncingRpc.duration
+
+        except Exception as e:
+            logging.warning(f"Failed to get syncing status: {e}")
+            res.probeSuccess *= ERROR_HEALTH
+
+class StarknetProbe(EvmProbe):
+    blockData       = Payload('{{"jsonrpc":"2.0","method":"starknet_getBlockWithTxHashes","params":[{height}],"id":1}}', "height")
+    blockByHashData = Payload('{{"jsonrpc":"2.0","method":"starknet_getBlockWithTxHashes","params":[{{"block_hash":"{hash}"}}],"id":1}}', "hash")
+    syncingData     = '{"jsonrpc":"2.0","method":"starknet_syncing","params":[],"id":1}'
+    fTimestamp   = "timestamp"
+    fBlockNumber = "block_number"
+    fBlockHash   = "block_hash"
+    fParentHash  = "parent_hash"
+    # Previous block can be get by the parent hash in batch mode only
+    prevByNumber = False
+    subscribable = False
+
+# Protocol names usable in CHAINS_CONFIG
+PROTOCOLS = {
+    "pokt":     PoktProbe,
+    "solana":   SolanaProbe,
+    "cosmos":   CosmosProbe,
+    "near":     NearProbe,
+    "sui":      SuiProbe,
+    "evm":      EvmProbe,
+    "starknet": StarknetProbe,
+}
+
+# Chains without a plugin are probed as EVM
+DEFAULT_PROBE = EvmProbe()
+
+CHAINS = {
+    ########## POKT
+    "0001": PoktProbe(),
+    ########## SOLANA VELAS
+    "0006": SolanaProbe(),
+    "0067": SolanaProbe(),
+    "0068": SolanaProbe(),
+    ########## OSMOSIS
+    "0054": CosmosProbe(),
+    ########## NEAR
+    "0052": NearProbe(),
+    ########## SUI
+    "0076": SuiProbe(),
+    ########## AVAX + subnets need to adjust URL path
+    "0003": EvmProbe(path="/ext/bc/C/rpc"),
+    "03DF": EvmProbe(path="/ext/bc/q2aTwKuyzgs8pynF7UXBZCU7DejbZbZ6EUyHr3JQzYgwNPUPi/rpc"),
+    "03CB": EvmProbe(path="/ext/bc/2K33xS9AyP9oCDiHYKVrHe7F54h2La5D8erpTChaAhdzeSu2RX/rpc"),
+    ########## STARKNET
+    "0060": StarknetProbe(),
+    "0061": StarknetProbe(),
+    ##########
+    "0074": EvmProbe(strictSyncing=True),
+}
+
+def chainPlugin(params: dict) -> ChainProbe:
+    """Plugin of a CHAINS_CONFIG entry, raises ValueError naming the wrong key"""
+    if not isinstance(params, dict):
+        raise ValueError(f"expected an object, got {params!r}")
+    params = dict(params)
+    protocol = params.pop("protocol", "evm")
+    plugin = PROTOCOLS.get(protocol)
+    if plugin is None:
+        raise ValueError(f'unknown protocol "{protocol}", expected one of {", ".join(PROTOCOLS)}')
+    accepted = inspect.signature(plugin).parameters
+    for key in params:
+        if key not in accepted:
+            raise ValueError(f'unknown key "{key}" of protocol "{protocol}", expected one of {", ".join(accepted)}')
+    fields = params.get("fields") or {}
+    if not isinstance(fields, dict):
+        raise ValueError(f'"fields" must be an object, got {fields!r}')
+    for attr in fields:
+        if not (attr.startswith("f") and hasattr(plugin, attr)):
+            raise ValueError(f'unknown field "{attr}" of protocol "{protocol}"')
+    try:
+        return plugin(**params)
+    except TypeError as e:
+        raise ValueError(str(e)) from e
+
+def loadChains(path: str):
+    """
+    Reads chain plugins from a JSON file, e.g.
+    {"0099": {"protocol": "evm", "path": "/ext/bc/C/rpc"}}
+    All keys except "protocol" are passed to the plugin's constructor.
+    "fields" renames the block fields read by EVM plugins, their values are
+    keys of the block object, e.g. {"fBlockNumber": "block_number"}.
+    Entries with an unknown protocol or key are skipped with an error, so a
+    wrong entry doesn't stop the exporter.
+    """
+    try:
+        with open(path) as f:
+            conf = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to load chains from {path}: {e}")
+        return dict()
+    if not isinstance(conf, dict):
+        logging.error(f"Failed to load chains from {path}: expected an object of chainids")
+        return dict()
+
+    chains = dict()
+    for chainid, params in conf.items():
+        try:
+            chains[chainid] = chainPlugin(params)
+        except ValueError as e:
+            logging.error(f"Skipped chain {chainid} of {path}: {e}")
+    logging.info(f"Loaded {len(chains)} chains from {path}")
+    return chains
+
+if CHAINS_CONFIG:
+    CHAINS.update(loadChains(CHAINS_CONFIG))
+
+def invalidate(res: ProbeResult):
+    """Sets the values of the phases failed in res.probeSuccess to ERROR"""
+    probeStatus = res.probeSuccess
+
+    if probeStatus % ERROR_LAST_BLOCK == 0:
+        # Invalidate all the metrics
+        res.lastBlockDuration = ERROR
+        res.lastBlockAge = ERROR
+        res.lastBlockNumber = ERROR
+        res.lastBlockHash = "none"
+        res.lastBlockParentHash = "none"
+
+    if probeStatus % ERROR_PREV_BLOCK == 0:
+        res.prevBlockDuration = ERROR
+        res.prevBlockAge = ERROR
+        res.prevBlockNumber = ERROR
+        res.prevBlockHash = "none"
+        res.prevBlockParentHash = "none"
+
+    if probeStatus % ERROR_HEALTH == 0:
+        res.nodeSyncing = ERROR
+        res.nodeSyncingDuration = ERROR
+
+def unprobedResult(error: int):
+    """Result of a target which wasn't probed for the `error` reason"""
+    res = ProbeResult()
+    res.probeSuccess = ERROR_LAST_BLOCK * ERROR_PREV_BLOCK * ERROR_HEALTH * error
+    invalidate(res)
+    res.timestamp = time.time()
+    return res
+
+def circuitOpenResult():
+    """Result of a target not probed because its circuit breaker is open"""
+    return unprobedResult(ERROR_CIRCUIT_OPEN)
+
+def overloadedResult():
+    """Result of a target shed by the admission control without a cached result"""
+    return unprobedResult(ERROR_OVERLOADED)
+
+def headUrl(chainid: str, target: str, ws: str = None):
+    """WebSocket endpoint of the target's newHeads subscription, None if it isn't used"""
+    if not CHAINS.get(chainid, DEFAULT_PROBE).subscribable:
+        return None
+    if ws:
+        return ws
+    if HEAD_SUBSCRIPTION == "auto" and target.startswith(("http://", "https://")):
+        return "ws" + target[4:] + CHAINS.get(chainid, DEFAULT_PROBE).path
+    return None
+
+def probe(chainid: str, target: str, res: ProbeResult, parallel: bool = PARALLEL_PROBE, batch: bool = BATCH_PROBE, head: tuple = None):
+    """
+    Runs the chain's probe plugin, independent from the HTTP client.
+    Fills `res` with the probe values.
+    With `parallel` the RPCs which don't depend on each other (latest block
+    and syncing status) are sent at the same time.
+    With `batch` EVM and Starknet nodes get the latest block and syncing
+    status in one JSON-RPC batch and the previous block by its hash.
+    `head` - latest headers pushed by the node (HeadTracker.head()), only
+    the syncing status is requested then.
+    """
+    t00 = time.perf_counter_ns()
+    # INit probe status
+    res.probeSuccess = 1
+    try:
+        plugin = CHAINS.get(chainid, DEFAULT_PROBE)
+        if head is not None:
+            yield from plugin.run(target, res, parallel, batch, head)
+        else:
+            yield from plugin.run(target, res, parallel, batch)
+    except Exception as e:
+        res.probeSuccess *= 7
+        res.error = type(e).__name__
+        logging.error(f"Caught exception: {e}")
+    if res.deadlineExceeded:
+        res.probeSuccess *= ERROR_DEADLINE
+    invalidate(res)
+
+    res.totalDuration = time.perf_counter_ns() - t00
+    res.timestamp = time.time()
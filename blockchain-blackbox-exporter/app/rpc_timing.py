@@ -0,0 +1,107 @@
+import time
+import socket
+import threading
+from types import SimpleNamespace
+
+import aiohttp
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+def phaseDurations(marks: dict, headers: int, done: int):
+    """
+    Phase durations (ns) of a request from its time marks.
+    `marks` holds the dns/connect/tls durations measured while opening a new
+    connection, `headers` and `done` are the durations until the reply
+    headers and the whole body were received.
+    A request on a kept-alive connection spends 0 in dns, connect and tls.
+    """
+    timings = {phase: marks.get(phase, 0) for phase in ("dns", "connect", "tls")}
+    timings["ttfb"] = max(0, headers - sum(timings.values()))
+    timings["body"] = done - headers
+    return timings
+
+########## requests engine
+# Time marks of the request being sent by the current thread
+current = threading.local()
+
+def mark(phase: str, ns: int):
+    marks = getattr(current, "marks", None)
+    if marks is not None:
+        marks[phase] = marks.get(phase, 0) + ns
+
+class TimedHTTPConnection(HTTPConnection):
+    """Measures DNS resolution and TCP connect of new connections"""
+    def _new_conn(self):
+        t0 = time.perf_counter_ns()
+        try:
+            addresses = list(dict.fromkeys(info[4][0] for info in
+                                           socket.getaddrinfo(self._dns_host, self.port, type=socket.SOCK_STREAM)))
+        except socket.gaierror:
+            # Let urllib3 raise its own error
+            return super()._new_conn()
+        t1 = time.perf_counter_ns()
+        mark("dns", t1 - t0)
+
+        host = self._dns_host
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except Exception:
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+        mark("connect", time.perf_counter_ns() - t1)
+        return sock
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    """Also measures the TLS handshake, the rest of connect()"""
+    def connect(self):
+        marks = getattr(current, "marks", None)
+        before = sum(marks.get(phase, 0) for phase in ("dns", "connect")) if marks is not None else 0
+        t0 = time.perf_counter_ns()
+        super().connect()
+        if marks is not None:
+            opened = sum(marks.get(phase, 0) for phase in ("dns", "connect")) - before
+            mark("tls", time.perf_counter_ns() - t0 - opened)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections record their phase durations"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool,
+                                                   "https": TimedHTTPSConnectionPool}
+
+########## aiohttp engine
+async def onDnsStart(session, ctx, params):
+    ctx.dnsStart = time.perf_counter_ns()
+
+async def onDnsEnd(session, ctx, params):
+    ctx.trace_request_ctx["dns"] = time.perf_counter_ns() - ctx.dnsStart
+
+async def onConnectionStart(session, ctx, params):
+    ctx.connStart = time.perf_counter_ns()
+
+async def onConnectionEnd(session, ctx, params):
+    # aiohttp reports DNS, TCP connect and TLS handshake as one step,
+    # the TLS handshake is in "connect"
+    ctx.trace_request_ctx["connect"] = time.perf_counter_ns() - ctx.connStart - ctx.trace_request_ctx.get("dns", 0)
+
+def traceConfig():
+    """aiohttp tracing of the dns/connect phases into the request's trace_request_ctx dict"""
+    config = aiohttp.TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+    config.on_dns_resolvehost_start.append(onDnsStart)
+    config.on_dns_resolvehost_end.append(onDnsEnd)
+    config.on_connection_create_start.append(onConnectionStart)
+    config.on_connection_create_end.append(onConnectionEnd)
+    return config
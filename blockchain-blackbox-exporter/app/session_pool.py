@@ -0,0 +1,82 @@
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from prometheus_client import Counter, Gauge, CollectorRegistry
+
+from rpc_timing import TimedHTTPAdapter
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+class SessionPool:
+    """
+    Bounded, thread-safe pool of keep-alive requests sessions, one per
+    upstream scheme+host+port, so the RPCs of a probe reuse the TCP/TLS
+    connection instead of doing a new handshake for every request.
+
+    The least recently used session is evicted when the pool is full and
+    sessions unused for `idle_timeout` seconds are closed.
+    Every session keeps at most `host_connections` connections to its host
+    alive, RPCs over it open a connection of their own instead of waiting for
+    a free one, which would be outside the probe's deadline.
+    With `timed` new connections record their DNS/connect/TLS durations.
+    """
+    def __init__(self, registry: CollectorRegistry, maxsize: int = 512,
+                 idle_timeout: float = 300, host_connections: int = 8, timed: bool = False):
+        self.maxsize          = maxsize
+        self.idle_timeout     = idle_timeout
+        self.host_connections = host_connections
+        self.adapterClass     = TimedHTTPAdapter if timed else HTTPAdapter
+        self.lock     = threading.Lock()
+        # key -> [session, last used time], ordered from the least recently used
+        self.sessions = OrderedDict()
+
+        self.hits      = Counter('session_pool_hits', 'Requests served by an already open session', [], registry=registry)
+        self.misses    = Counter('session_pool_misses', 'Requests which had to open a new session', [], registry=registry)
+        self.evictions = Counter('session_pool_evictions', 'Sessions closed by the pool', ['reason'], registry=registry)
+        self.size      = Gauge('session_pool_size', 'Number of open sessions in the pool', [], registry=registry, multiprocess_mode='livesum')
+
+    @staticmethod
+    def key(target: str):
+        url = urlsplit(target)
+        return url.scheme, url.hostname, url.port or DEFAULT_PORTS.get(url.scheme)
+
+    def new_session(self):
+        session = requests.Session()
+        adapter = self.adapterClass(pool_connections=1, pool_maxsize=self.host_connections, pool_block=False)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, target: str) -> requests.Session:
+        key = self.key(target)
+        now = time.monotonic()
+        closed = []
+        with self.lock:
+            # Expire idle sessions, the oldest are at the beginning
+            while self.sessions:
+                oldest = next(iter(self.sessions.values()))
+                if now - oldest[1] < self.idle_timeout:
+                    break
+                closed.append(self.sessions.popitem(last=False)[1][0])
+                self.evictions.labels(reason="idle").inc()
+
+            entry = self.sessions.get(key)
+            if entry is not None:
+                self.hits.inc()
+                entry[1] = now
+                self.sessions.move_to_end(key)
+            else:
+                self.misses.inc()
+                entry = self.sessions[key] = [self.new_session(), now]
+                if len(self.sessions) > self.maxsize:
+                    closed.append(self.sessions.popitem(last=False)[1][0])
+                    self.evictions.labels(reason="lru").inc()
+            self.size.set(len(self.sessions))
+
+        for session in closed:
+            session.close()
+        return entry[0]
@@ -0,0 +1,77 @@
+import time
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+class SharedStore:
+    """
+    Key-value store shared by the gunicorn workers of the host, a SQLite
+    database meant to live in /dev/shm.
+    Values are pickled and expire after their ttl (None - never), keys are
+    grouped in namespaces. Every thread uses its own connection.
+    """
+    def __init__(self, path: str):
+        self.path  = path
+        self.local = threading.local()
+        self.writes = 0
+        with self.transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS kv (ns TEXT, key TEXT, value BLOB, expires REAL, PRIMARY KEY (ns, key))")
+
+    def connection(self) -> sqlite3.Connection:
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+        return db
+
+    @contextmanager
+    def transaction(self):
+        """Exclusive read-modify-write across the workers"""
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def get(self, ns: str, key: str, default=None, db: sqlite3.Connection = None):
+        row = (db or self.connection()).execute(
+            "SELECT value FROM kv WHERE ns = ? AND key = ? AND (expires IS NULL OR expires > ?)",
+            (ns, key, time.time())).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def set(self, ns: str, key: str, value, ttl: float = None, db: sqlite3.Connection = None):
+        expires = None if ttl is None else time.time() + ttl
+        db = db or self.connection()
+        db.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?)", (ns, key, pickle.dumps(value), expires))
+        self.writes += 1
+        if self.writes % 1000 == 0:
+            db.execute("DELETE FROM kv WHERE expires <= ?", (time.time(),))
+
+    def delete(self, ns: str, key: str, db: sqlite3.Connection = None):
+        (db or self.connection()).execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+    def keys(self, ns: str):
+        """Keys of the namespace which haven't expired"""
+        return [row[0] for row in self.connection().execute(
+            "SELECT key FROM kv WHERE ns = ? AND (expires IS NULL OR expires > ?)", (ns, time.time()))]
+
+    def mapping(self, ns: str, ttl: float = None):
+        return StoreMapping(self, ns, ttl)
+
+class StoreMapping:
+    """dict-like get/set view of a namespace, the values set expire after `ttl`"""
+    def __init__(self, store: SharedStore, ns: str, ttl: float = None):
+        self.store = store
+        self.ns    = ns
+        self.ttl   = ttl
+
+    def get(self, key: str, default=None):
+        return self.store.get(self.ns, key, default)
+
+    def __setitem__(self, key: str, value):
+        self.store.set(self.ns, key, value, self.ttl)
@@ -0,0 +1,1196 @@
+import gc
+import os
+import glob
+import json
+import subprocess
+import sys
+import time
+import asyncio
+import threading
+import tempfile
+import unittest
+from unittest import mock
+from contextlib import ExitStack
+
+import orjson
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer, unused_port
+from prometheus_client import CollectorRegistry
+
+import probes
+import bb_exporter
+import bb_exporter_async
+import circuit_breaker
+import rpc_timing
+from probes import ProbeResult, probe, headUrl, renderMulti, decodeBlock, consensus, fingerprint
+from block_history import BlockHistory, BlockHistories
+from head_tracker import HeadTracker
+from probe_cache import ProbeCache
+from session_pool import SessionPool
+from exporter_metrics import ExporterMetrics, generateMetrics
+from background import BackgroundProber, loadTargets
+from shared_store import SharedStore
+from circuit_breaker import CircuitBreaker
+from admission import AdmissionControl, Overloaded
+
+def header(number: int):
+    return {
+        "number": hex(number),
+        "hash": "0x%064x" % number,
+        "parentHash": "0x%064x" % (number - 1),
+        "timestamp": hex(int(time.time())),
+    }
+
+class LocalServer:
+    """aiohttp server on its own loop and thread, routes() adds the handlers"""
+    def __init__(self):
+        self.stopped = False
+        self.port = unused_port()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.runner = asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+
+    def routes(self, app: web.Application):
+        pass
+
+    async def start(self):
+        app = web.Application()
+        self.routes(app)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", self.port).start()
+        return runner
+
+    def stop(self):
+        self.stopped = True
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+class WsNode(LocalServer):
+    """
+    Local stand-in of an EVM node's WebSocket endpoint, pushes a header every
+    `interval` seconds and drops the connection after `closeAfter` headers
+    """
+    def __init__(self, interval: float = 0.05, closeAfter: int = None, refuse: bool = False):
+        self.interval   = interval
+        self.closeAfter = closeAfter
+        self.refuse     = refuse
+        # Headers aren't pushed while paused
+        self.paused     = False
+        self.height      = 100
+        self.connections = 0
+        super().__init__()
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}/"
+
+    def routes(self, app: web.Application):
+        app.router.add_get("/", self.handler)
+        app.router.add_get("/http", self.http)
+
+    async def http(self, request: web.Request):
+        return web.json_response({})
+
+    async def handler(self, request: web.Request):
+        self.connections += 1
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscribe = await ws.receive_json()
+        if self.refuse:
+            await ws.send_json({"jsonrpc": "2.0", "id": subscribe["id"], "error": {"code": -32601, "message": "Method not found"}})
+            await ws.close()
+            return ws
+
+        await ws.send_json({"jsonrpc": "2.0", "id": subscribe["id"], "result": "0x1"})
+        pushed = 0
+        while not (ws.closed or self.stopped) and (self.closeAfter is None or pushed < self.closeAfter):
+            await asyncio.sleep(self.interval)
+            if self.paused:
+                continue
+            self.height += 1
+            pushed += 1
+            await ws.send_str(json.dumps({"jsonrpc": "2.0", "method": "eth_subscription",
+                                          "params": {"subscription": "0x1", "result": header(self.height)}}))
+        await ws.close()
+        return ws
+
+def waitHead(tracker: HeadTracker, url: str, timeout: float = 5):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        head = tracker.head(url)
+        if head is not None and head[1] is not None:
+            return head
+        time.sleep(0.02)
+    return None
+
+def drive(gen, reply):
+    """Runs a probe generator, `reply(rpc)` answers its RPCs"""
+    try:
+        rpc = next(gen)
+        while True:
+            rpc = gen.send([reply(r) for r in rpc] if isinstance(rpc, list) else reply(rpc))
+    except StopIteration:
+        pass
+
+def evmReply(request: dict, height: int = 11):
+    """Reply of an EVM node at `height` to a single JSON-RPC request"""
+    if request["method"] == "eth_syncing":
+        result = False
+    elif request["params"][0] == "latest":
+        result = header(height)
+    else:
+        result = header(int(request["params"][0], 16))
+    return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+class EvmNode:
+    """Replies to the RPCs of EVM probes, `batch` - reply to batches with it instead"""
+    def __init__(self, batch = True):
+        self.batch  = batch
+        self.phases = []
+
+    def __call__(self, rpc):
+        self.phases.append(rpc.phase)
+        request = json.loads(rpc.data)
+        if not isinstance(request, list):
+            return evmReply(request)
+        if self.batch is True:
+            return [evmReply(r) for r in request]
+        return self.batch
+
+class RpcNode(LocalServer):
+    """
+    Local EVM node answering JSON-RPC over HTTP at any path after `delay`
+    seconds, paths starting with /fail and requests `fail(request)` is true
+    for get HTTP 500
+    """
+    def __init__(self, delay: float = 0, fail = None):
+        self.delay    = delay
+        self.fail     = fail
+        self.requests = 0
+        super().__init__()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def routes(self, app: web.Application):
+        app.router.add_post("/{path:.*}", self.handler)
+
+    async def handler(self, request: web.Request):
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        body = await request.json()
+        if request.path.startswith("/fail") or (self.fail and not isinstance(body, list) and self.fail(body)):
+            return web.Response(status=500, text="failed")
+        return web.json_response([evmReply(r) for r in body] if isinstance(body, list) else evmReply(body))
+
+class HeadTrackerTest(unittest.TestCase):
+    def tracker(self, **kwargs):
+        return HeadTracker(CollectorRegistry(), backoff=0.05, max_backoff=0.2, **kwargs).start()
+
+    def test_pushed_headers(self):
+        node = WsNode()
+        self.addCleanup(node.stop)
+        tracker = self.tracker()
+
+        self.assertIsNone(tracker.head(node.url))
+        latest, parent = waitHead(tracker, node.url)
+        self.assertEqual(latest["parentHash"], parent["hash"])
+        self.assertEqual(int(latest["number"], 16), int(parent["number"], 16) + 1)
+        self.assertEqual(node.connections, 1)
+
+    def test_reconnect(self):
+        node = WsNode(closeAfter=3)
+        self.addCleanup(node.stop)
+        tracker = self.tracker()
+
+        tracker.head(node.url)
+        end = time.monotonic() + 5
+        while node.connections < 3 and time.monotonic() < end:
+            time.sleep(0.02)
+        self.assertGreaterEqual(node.connections, 3)
+        self.assertIsNotNone(waitHead(tracker, node.url))
+
+    def test_not_available(self):
+        node = WsNode(refuse=True)
+        self.addCleanup(node.stop)
+        tracker = self.tracker()
+
+        for url in (node.url, f"ws://127.0.0.1:{node.port}/http", "ws://127.0.0.1:1/"):
+            self.assertIsNone(waitHead(tracker, url, 0.5))
+        self.assertGreater(sum(s.value for m in tracker.failures.collect() for s in m.samples
+                               if s.name.endswith("_total")), 3)
+
+    def test_stale(self):
+        node = WsNode()
+        self.addCleanup(node.stop)
+        tracker = self.tracker(max_age=0.3)
+
+        self.assertIsNotNone(waitHead(tracker, node.url))
+        node.paused = True
+        time.sleep(0.4)
+        # No header for max_age, the node is polled
+        self.assertIsNone(tracker.head(node.url))
+
+    def test_shared(self):
+        node = WsNode()
+        self.addCleanup(node.stop)
+        path = tempfile.mktemp()
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(f"{path}*")])
+        leader = self.tracker(store=SharedStore(path))
+        end = time.monotonic() + 5
+        while not leader.leader and time.monotonic() < end:
+            time.sleep(0.02)
+        self.assertTrue(leader.leader)
+        worker = self.tracker(store=SharedStore(path))
+
+        # Asked by the other worker, followed and published by the leader
+        latest, parent = waitHead(worker, node.url)
+        self.assertEqual(latest["parentHash"], parent["hash"])
+        self.assertIsNotNone(waitHead(leader, node.url))
+        self.assertFalse(worker.leader)
+        self.assertEqual(node.connections, 1)
+
+class HeadProbeTest(unittest.TestCase):
+    def test_pushed_probe(self):
+        res = ProbeResult()
+        gen = probe("0021", "http://node", res, head=(header(11), header(10)))
+        rpc = next(gen)
+        # Only the syncing status is requested
+        self.assertEqual(rpc.phase, probes.PHASE_SYNCING)
+        with self.assertRaises(StopIteration):
+            gen.send({"result": False})
+
+        self.assertEqual(res.probeSuccess, 1)
+        self.assertEqual(res.lastBlockPushed, 1)
+        self.assertEqual((res.lastBlockNumber, res.prevBlockNumber), (11, 10))
+        self.assertEqual((res.lastBlockDuration, res.prevBlockDuration), (0, 0))
+
+    def test_polled_probe(self):
+        res = ProbeResult()
+        gen = probe("0021", "http://node/polled", res, parallel=False, batch=False)
+        self.assertEqual(next(gen).phase, probes.PHASE_LAST_BLOCK)
+        self.assertEqual(res.lastBlockPushed, 0)
+
+    def test_head_url(self):
+        self.assertEqual(headUrl("0021", "https://node", "wss://node/ws"), "wss://node/ws")
+        self.assertEqual(headUrl("0006", "https://node", "wss://node/ws"), None)
+        self.assertEqual(headUrl("0060", "https://node", "wss://node/ws"), None)
+        if probes.HEAD_SUBSCRIPTION == "off":
+            self.assertEqual(headUrl("0021", "https://node"), None)
+
+class ParallelProbeTest(unittest.TestCase):
+    # Values which don't depend on the timing of the RPCs
+    VALUES = ("lastBlockNumber", "prevBlockNumber", "nodeSyncing", "probeSuccess", "lastBlockHash", "prevBlockHash", "error", "nodeReachable")
+
+    def values(self, res: ProbeResult):
+        return {attr: getattr(res, attr) for attr in self.VALUES}
+
+    def results(self, fail = None, path: str = "/"):
+        """Results of the probes of both engines, sequential and parallel"""
+        node = RpcNode(delay=0.01, fail=fail)
+        self.addCleanup(node.stop)
+        # Paths of their own, so every probe gets the previous block
+        target = f"{node.url}{path}{self.id()}"
+        results = {"sequential": bb_exporter.runProbe("0021", f"{target}/sequential", parallel=False, batch=False),
+                   "parallel": bb_exporter.runProbe("0021", f"{target}/parallel", parallel=True, batch=False)}
+        async def main():
+            async with aiohttp.ClientSession() as session:
+                for parallel in (False, True):
+                    results[f"async parallel={parallel}"] = await bb_exporter_async.runProbe(
+                        session, "0021", f"{target}/async-{parallel}", parallel=parallel, batch=False)
+        asyncio.run(main())
+        return {mode: self.values(res) for mode, res in results.items()}
+
+    def assertSame(self, results: dict, probeSuccess: int):
+        expected = results["sequential"]
+        self.assertEqual(expected["probeSuccess"], probeSuccess)
+        for mode, values in results.items():
+            self.assertEqual(values, expected, mode)
+
+    def test_success(self):
+        results = self.results()
+        self.assertSame(results, 1)
+        self.assertEqual(results["parallel"]["lastBlockNumber"], 11)
+        self.assertEqual(results["parallel"]["prevBlockNumber"], 10)
+
+    def test_syncing_failed(self):
+        self.assertSame(self.results(lambda request: request["method"] == "eth_syncing"), probes.ERROR_HEALTH)
+
+    def test_prev_block_failed(self):
+        self.assertSame(self.results(lambda request: request["params"][:1] == [hex(10)]), probes.ERROR_PREV_BLOCK)
+
+    def test_failed(self):
+        self.assertSame(self.results(path="/fail"), probes.ERROR_LAST_BLOCK * probes.ERROR_PREV_BLOCK * probes.ERROR_HEALTH)
+
+class BatchProbeTest(unittest.TestCase):
+    def run_probe(self, target: str, node: EvmNode):
+        res = ProbeResult()
+        drive(probe("0021", target, res, parallel=False, batch=True), node)
+        return res
+
+    def test_batched(self):
+        node = EvmNode()
+        res = self.run_probe("http://batched", node)
+        self.assertEqual(res.probeSuccess, 1)
+        self.assertEqual(node.phases[0], probes.PHASE_BATCH)
+        self.assertNotIn(probes.PHASE_LAST_BLOCK, node.phases)
+
+    def test_rejected(self):
+        target = "http://batch-rejected"
+        # Batches are answered with a single error
+        node = EvmNode({"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch not supported"}})
+        res = self.run_probe(target, node)
+        self.assertEqual(res.probeSuccess, 1)
+        self.assertEqual(node.phases[:2], [probes.PHASE_BATCH, probes.PHASE_LAST_BLOCK])
+        self.assertGreater(probes.batchRejected[target], time.time())
+
+        # Not tried again until BATCH_RECHECK passes
+        node.phases.clear()
+        self.run_probe(target, node)
+        self.assertNotIn(probes.PHASE_BATCH, node.phases)
+        probes.batchRejected[target] = time.time() - 1
+        node.phases.clear()
+        self.run_probe(target, node)
+        self.assertEqual(node.phases[0], probes.PHASE_BATCH)
+
+    def test_failed(self):
+        target = "http://batch-failed"
+        # Timeout or HTTP error of the batch request
+        node = EvmNode(None)
+        res = self.run_probe(target, node)
+        self.assertEqual(res.probeSuccess, 1)
+        self.assertEqual(node.phases[:2], [probes.PHASE_BATCH, probes.PHASE_LAST_BLOCK])
+        self.assertNotIn(target, probes.batchRejected)
+
+        node.phases.clear()
+        self.run_probe(target, node)
+        self.assertEqual(node.phases[0], probes.PHASE_BATCH)
+
+def samples(text: bytes):
+    """{(metric name, instance label): value} of rendered probe metrics"""
+    from prometheus_client.parser import text_string_to_metric_families
+    return {(s.name, s.labels.get("instance")): s.value
+            for family in text_string_to_metric_families(text.decode()) for s in family.samples}
+
+def metric(text: bytes, name: str, **labels) -> float:
+    """Sum of the samples of the metric with the given labels"""
+    from prometheus_client.parser import text_string_to_metric_families
+    return sum(s.value for family in text_string_to_metric_families(text.decode()) for s in family.samples
+               if s.name == name and labels.items() <= s.labels.items())
+
+# Records a probe and a failed RPC in the metrics files of its own process
+METRICS_SCRIPT = """
+import probes
+from prometheus_client import CollectorRegistry
+from exporter_metrics import ExporterMetrics
+metrics = ExporterMetrics(CollectorRegistry())
+res = probes.ProbeResult()
+res.totalDuration = 50000000
+metrics.probe("0021", res)
+rpc = probes.Rpc("http://node")
+rpc.duration = 1000000
+metrics.rpc("0021", rpc, ValueError())
+"""
+
+class ExporterMetricsTest(unittest.TestCase):
+    def scrape(self) -> bytes:
+        return bb_exporter.app.test_client().get("/metrics").data
+
+    def test_probe(self):
+        node = RpcNode()
+        self.addCleanup(node.stop)
+        client = bb_exporter.app.test_client()
+        before = self.scrape()
+        client.get("/probe", query_string={"chainid": "0021", "target": f"{node.url}/{self.id()}"})
+        client.get("/probe", query_string={"chainid": "0021", "target": f"{node.url}/fail/{self.id()}"})
+        after = self.scrape()
+
+        def added(name, **labels):
+            return metric(after, name, **labels) - metric(before, name, **labels)
+        self.assertEqual(added("probe_duration_seconds_count", chain="0021"), 2)
+        self.assertEqual(added("rpc_duration_seconds_count", chain="0021", phase=probes.PHASE_LAST_BLOCK), 2)
+        self.assertEqual(added("rpc_duration_seconds_count", chain="0021", phase=probes.PHASE_SYNCING), 2)
+        # The failed target's latest block and syncing status, the previous block isn't requested
+        self.assertEqual(added("rpc_errors_total", chain="0021", error="Exception"), 2)
+        self.assertGreater(added("rpc_duration_seconds_bucket", chain="0021", le="+Inf"), 0)
+        self.assertEqual(metric(after, "thread_pool_threads", pool="request"), bb_exporter.THREADS)
+        self.assertEqual(metric(after, "probes_in_flight", chain="0021"), 0)
+
+    def test_multiprocess(self):
+        """Metrics of the gunicorn workers are summed"""
+        metricsDir = tempfile.TemporaryDirectory()
+        self.addCleanup(metricsDir.cleanup)
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=metricsDir.name)
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", METRICS_SCRIPT], env=env, cwd=cwd, check=True, capture_output=True)
+        with mock.patch.dict(os.environ, PROMETHEUS_MULTIPROC_DIR=metricsDir.name):
+            text = generateMetrics(CollectorRegistry())
+        self.assertEqual(metric(text, "probe_duration_seconds_count", chain="0021"), 2)
+        self.assertEqual(metric(text, "probe_duration_seconds_sum", chain="0021"), 0.1)
+        self.assertEqual(metric(text, "rpc_errors_total", chain="0021", error="ValueError"), 2)
+
+class RpcTimingTest(unittest.TestCase):
+    PHASES = {"dns", "connect", "tls", "ttfb", "body"}
+
+    def setUp(self):
+        self.node = RpcNode(delay=0.02)
+        self.addCleanup(self.node.stop)
+
+    def rpc(self):
+        return probes.Rpc(self.node.url, '{"jsonrpc":"2.0","method":"eth_syncing","params":[],"id":1}', phase=probes.PHASE_SYNCING)
+
+    def assertPhases(self, rpc: probes.Rpc, res: ProbeResult):
+        self.assertEqual(set(rpc.timings), self.PHASES)
+        self.assertTrue(all(ns >= 0 for ns in rpc.timings.values()), rpc.timings)
+        self.assertLessEqual(sum(rpc.timings.values()), rpc.duration)
+        # The node's delay is the server's response time
+        self.assertGreaterEqual(rpc.timings["ttfb"], 20000000)
+        self.assertEqual(res.timings[probes.PHASE_SYNCING], rpc.timings)
+
+    def test_phase_durations(self):
+        self.assertEqual(rpc_timing.phaseDurations({"dns": 5, "connect": 10}, 40, 100),
+                         {"dns": 5, "connect": 10, "tls": 0, "ttfb": 25, "body": 60})
+        # Kept-alive connection
+        self.assertEqual(rpc_timing.phaseDurations({}, 40, 100), {"dns": 0, "connect": 0, "tls": 0, "ttfb": 40, "body": 60})
+
+    def test_threaded(self):
+        pool = SessionPool(CollectorRegistry(), timed=True)
+        with mock.patch.object(bb_exporter, "sessionPool", pool), mock.patch.object(bb_exporter, "DETAILED_TIMING", True):
+            connects = []
+            for _ in range(2):
+                rpc, res = self.rpc(), ProbeResult()
+                self.assertEqual(bb_exporter.execute("0021", rpc, res, time.monotonic() + 5), {"jsonrpc": "2.0", "id": 1, "result": False})
+                self.assertPhases(rpc, res)
+                connects.append(rpc.timings["connect"])
+        # The second RPC reuses the connection
+        self.assertGreater(connects[0], 0)
+        self.assertEqual(connects[1], 0)
+
+    def test_async(self):
+        async def main():
+            async with aiohttp.ClientSession(trace_configs=[rpc_timing.traceConfig()]) as session:
+                connects = []
+                for _ in range(2):
+                    rpc, res = self.rpc(), ProbeResult()
+                    await bb_exporter_async.execute(session, "0021", rpc, res, time.monotonic() + 5)
+                    self.assertPhases(rpc, res)
+                    connects.append(rpc.timings["connect"])
+                return connects
+        with mock.patch.object(bb_exporter_async, "DETAILED_TIMING", True):
+            connects = asyncio.run(main())
+        self.assertGreater(connects[0], 0)
+        self.assertEqual(connects[1], 0)
+
+class LoadChainsTest(unittest.TestCase):
+    def load(self, conf) -> dict:
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            f.write(conf if isinstance(conf, str) else json.dumps(conf))
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_plugins(self):
+        chains = probes.loadChains(self.load({
+            "0099": {"protocol": "starknet", "path": "/rpc"},
+            "0098": {"path": "/ext/bc/C/rpc", "fields": {"fBlockNumber": "block_number"}, "strictSyncing": True},
+            "0097": {"protocol": "cosmos"},
+        }))
+        self.assertIsInstance(chains["0099"], probes.StarknetProbe)
+        self.assertEqual(chains["0099"].path, "/rpc")
+        # EVM by default
+        self.assertIs(type(chains["0098"]), probes.EvmProbe)
+        self.assertEqual((chains["0098"].fBlockNumber, chains["0098"].strictSyncing), ("block_number", True))
+        self.assertEqual(probes.EvmProbe.fBlockNumber, "number")
+        self.assertIsInstance(chains["0097"], probes.CosmosProbe)
+
+    def test_skipped(self):
+        path = self.load({
+            "0099": {"protocol": "bitcoin"},
+            "0098": {"pth": "/rpc"},
+            "0097": {"protocol": "cosmos", "fields": {"fBlockNumber": "height"}},
+            "0096": {"fields": {"blockNumber": "height"}},
+            "0095": "evm",
+            "0094": {"path": "/rpc"},
+        })
+        with self.assertLogs(level="ERROR") as logs:
+            chains = probes.loadChains(path)
+        self.assertEqual(list(chains), ["0094"])
+        errors = "\n".join(logs.output)
+        for chainid, key in (("0099", "bitcoin"), ("0098", "pth"), ("0097", "fields"), ("0096", "blockNumber"), ("0095", "evm")):
+            self.assertIn(f"Skipped chain {chainid}", errors)
+            self.assertIn(key, errors)
+
+    def test_broken_file(self):
+        for conf in ("{not json", "[]"):
+            with self.assertLogs(level="ERROR"):
+                self.assertEqual(probes.loadChains(self.load(conf)), {})
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(probes.loadChains("/nonexistent/chains.json"), {})
+
+    def test_chains_config(self):
+        """CHAINS_CONFIG adds and overrides the built-in chains when the exporter starts"""
+        path = self.load({"0003": {"path": "/ext/bc/X/rpc"}, "0099": {"protocol": "sui"}, "0098": {"protocol": "bitcoin"}})
+        script = "import probes; print(probes.CHAINS['0003'].path, type(probes.CHAINS['0099']).__name__, '0098' in probes.CHAINS)"
+        out = subprocess.run([sys.executable, "-c", script], env=dict(os.environ, CHAINS_CONFIG=path),
+                             cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.split(), ["/ext/bc/X/rpc", "SuiProbe", "False"])
+
+class RenderTest(unittest.TestCase):
+    def result(self, number: int, success: int = 1):
+        res = ProbeResult()
+        res.lastBlockNumber = number
+        res.probeSuccess = success
+        return res
+
+    def test_render_multi(self):
+        metrics = samples(renderMulti({"http://a": self.result(11), "http://b": self.result(-2, 2)}))
+        self.assertEqual(metrics[("last_block_number", "http://a")], 11)
+        self.assertEqual(metrics[("probe_success", "http://a")], 1)
+        self.assertEqual(metrics[("probe_success", "http://b")], 2)
+        self.assertNotIn(("probe_success", None), metrics)
+
+    def test_consensus(self):
+        results = dict()
+        for instance, number, blockHash in (("a", 11, "0xaa"), ("b", 11, "0xaa"), ("c", 11, "0xbb"), ("d", 10, "0xcc"), ("e", -2, "none")):
+            results[instance] = self.result(number)
+            results[instance].lastBlockHash = blockHash
+        results["f"] = self.result(0)
+        self.assertEqual(consensus(results), {"a": 1, "b": 1, "c": 0, "d": 1, "e": probes.NOT_DEFINED, "f": probes.NOT_DEFINED})
+
+        metrics = samples(renderMulti(results))
+        self.assertEqual(metrics[("last_block_consensus", "c")], 0)
+        self.assertEqual(metrics[("last_block_consensus", "d")], 1)
+        # Single results have no consensus
+        self.assertNotIn("last_block_consensus", {name for name, _ in samples(renderMulti({None: results["a"]}))})
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("0x" + "f" * 64), 2**52 - 1)
+        self.assertEqual(fingerprint(None), probes.NOT_DEFINED)
+        self.assertEqual(fingerprint("none"), probes.ERROR)
+        # Not hex, e.g. base58 hashes
+        for blockHash in ("5Kd3NBUAdUnhyzenEwVLy9pBKxSwXvE9FMPyR4UKZvpe", "0xnothex"):
+            value = fingerprint(blockHash)
+            self.assertTrue(0 <= value < 2**52)
+            self.assertEqual(value, fingerprint(blockHash))
+
+class MultiProbeTest(unittest.TestCase):
+    """/probe_multi probes the targets concurrently, a failing target doesn't affect the others"""
+    def setUp(self):
+        node = RpcNode(delay=0.2)
+        self.addCleanup(node.stop)
+        self.ok = [f"{node.url}/{self.id()}-{i}" for i in range(4)]
+        self.failed = f"{node.url}/fail/{self.id()}"
+        self.unreachable = f"http://127.0.0.1:1/{self.id()}"
+        self.targets = self.ok[:2] + [self.failed] + self.ok[2:] + [self.unreachable]
+
+    def assertIsolated(self, text: bytes, elapsed: float):
+        metrics = samples(text)
+        for target in self.ok:
+            self.assertEqual(metrics[("probe_success", target)], 1, target)
+            self.assertEqual(metrics[("last_block_number", target)], 11)
+            self.assertEqual(metrics[("last_block_consensus", target)], 1)
+        self.assertEqual(metrics[("probe_success", self.failed)], probes.ERROR_LAST_BLOCK * probes.ERROR_PREV_BLOCK * probes.ERROR_HEALTH)
+        self.assertEqual(metrics[("last_block_number", self.failed)], probes.ERROR)
+        self.assertEqual(metrics[("probe_success", self.unreachable)] % probes.ERROR_LAST_BLOCK, 0)
+        # Concurrently: 3 RPCs of 0.2s per target
+        self.assertLess(elapsed, 1.2)
+
+    def test_threaded(self):
+        t0 = time.monotonic()
+        reply = bb_exporter.app.test_client().get("/probe_multi", query_string={"chainid": "0021", "target": self.targets})
+        self.assertIsolated(reply.data, time.monotonic() - t0)
+
+    def test_async(self):
+        async def main():
+            async with TestClient(TestServer(bb_exporter_async.create_app())) as client:
+                reply = await client.get("/probe_multi", params=[("chainid", "0021")] + [("target", t) for t in self.targets])
+                return await reply.read()
+        t0 = time.monotonic()
+        text = asyncio.run(main())
+        self.assertIsolated(text, time.monotonic() - t0)
+
+class ProbeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def probe(self, result: str = "result", delay: float = 0):
+        self.calls += 1
+        time.sleep(delay)
+        return result
+
+    def test_single_flight(self):
+        cache = ProbeCache(CollectorRegistry(), ttl=5)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("key", lambda: self.probe(delay=0.2))))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_ttl(self):
+        cache = ProbeCache(CollectorRegistry(), ttl=0.1)
+        cache.get("key", self.probe)
+        cache.get("key", self.probe)
+        self.assertEqual(self.calls, 1)
+        time.sleep(0.15)
+        cache.get("key", self.probe)
+        self.assertEqual(self.calls, 2)
+
+        cache = ProbeCache(CollectorRegistry(), ttl=0)
+        cache.get("key", self.probe)
+        cache.get("key", self.probe)
+        self.assertEqual(self.calls, 4)
+
+    def test_stale(self):
+        cache = ProbeCache(CollectorRegistry(), ttl=0.05)
+        self.assertIsNone(cache.stale("key"))
+        cache.get("key", lambda: self.probe("first"))
+        time.sleep(0.1)
+        # Expired results are kept until replaced
+        self.assertEqual(cache.stale("key"), "first")
+        cache.get("key", lambda: self.probe("second"))
+        self.assertEqual(cache.stale("key"), "second")
+
+    def test_failed(self):
+        cache = ProbeCache(CollectorRegistry(), ttl=5)
+        def fail():
+            raise ValueError("failed")
+        with self.assertRaises(ValueError):
+            cache.get("key", fail)
+        # Failures aren't cached
+        self.assertEqual(cache.get("key", self.probe), "result")
+
+    def test_async_failed(self):
+        unretrieved = []
+        async def main():
+            asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+            cache = ProbeCache(CollectorRegistry(), ttl=5)
+            async def fail():
+                await asyncio.sleep(0.05)
+                raise ValueError("failed")
+            # The waiting probe gets the leader's exception
+            results = await asyncio.gather(cache.aget("key", fail), cache.aget("key", fail), return_exceptions=True)
+            self.assertEqual([type(r) for r in results], [ValueError, ValueError])
+            # Nobody waits for this one
+            with self.assertRaises(ValueError):
+                await cache.aget("key", fail)
+            gc.collect()
+            await asyncio.sleep(0)
+        asyncio.run(main())
+        self.assertEqual(unretrieved, [])
+
+    def test_shared_lru(self):
+        path = tempfile.mktemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(f"{path}*")])
+        store = SharedStore(path)
+        first, second = ProbeCache(CollectorRegistry(), maxsize=2, store=store), ProbeCache(CollectorRegistry(), maxsize=2, store=store)
+        for key in ("a", "b", "c"):
+            first.get(key, lambda: self.probe(key))
+        second.get("d", lambda: self.probe("d"))
+        # Hits of the shared results are kept as the least recently used are evicted
+        self.assertEqual([second.get(key, self.probe) for key in ("a", "b", "c")], ["a", "b", "c"])
+        self.assertEqual(self.calls, 4)
+        self.assertEqual(list(second.results), ["b", "c"])
+
+    def test_slow_store(self):
+        class SlowStore:
+            def get(self, ns, key):
+                time.sleep(0.5)
+            def set(self, ns, key, value, ttl):
+                time.sleep(0.5)
+        cache = ProbeCache(CollectorRegistry(), store=SlowStore())
+        cache.results["cached"] = (time.monotonic() + 5, "cached")
+        slow = threading.Thread(target=lambda: cache.get("slow", self.probe))
+        slow.start()
+        time.sleep(0.1)
+        # Lookups of the other keys don't wait for the store
+        start = time.monotonic()
+        self.assertEqual(cache.get("cached", self.probe), "cached")
+        self.assertLess(time.monotonic() - start, 0.1)
+        slow.join()
+
+class DecodeBlockTest(unittest.TestCase):
+    def block(self, transactions) -> dict:
+        return dict(header(11), transactions=transactions, uncles=[])
+
+    def test_hashes_dropped(self):
+        reply = {"jsonrpc": "2.0", "id": 1, "result": self.block(["0x%064x" % i for i in range(100)])}
+        self.assertEqual(decodeBlock(json.dumps(reply).encode()), dict(reply, result=self.block([])))
+        # Batch replies and other spacing
+        batch = [reply, {"jsonrpc": "2.0", "id": 2, "result": False}]
+        self.assertEqual(decodeBlock(json.dumps(batch, indent=2).encode())[0]["result"]["transactions"], [])
+
+    def test_decoded_as_is(self):
+        for reply in (
+            # Full transactions
+            {"result": self.block([{"hash": "0x1", "input": "0x[]"}])},
+            {"result": self.block([])},
+            {"result": None},
+            {"error": {"code": -32000, "message": 'no "transactions" [here]'}},
+            {"result": dict(self.block(None), extraData="]")},
+        ):
+            self.assertEqual(decodeBlock(json.dumps(reply).encode()), reply)
+
+    def test_truncated(self):
+        body = json.dumps({"result": self.block(["0x%064x" % i for i in range(10)])}).encode()
+        for end in (len(body) - 1, body.find(b"]"), body.find(b"]") + 5, body.find(b'"transactions"') + 5, 1):
+            with self.assertRaises(orjson.JSONDecodeError):
+                decodeBlock(body[:end])
+        with self.assertRaises(orjson.JSONDecodeError):
+            decodeBlock(b"")
+
+class DeadlineTest(unittest.TestCase):
+    def assertSkipped(self, res: ProbeResult):
+        self.assertTrue(res.deadlineExceeded)
+        self.assertEqual(res.probeSuccess % probes.ERROR_DEADLINE, 0)
+        self.assertEqual(res.probeSuccess % probes.ERROR_LAST_BLOCK, 0)
+        self.assertEqual(res.lastBlockNumber, probes.ERROR)
+
+    def test_skipped(self):
+        # Nothing listens there, the RPCs would fail to connect if sent
+        self.assertSkipped(bb_exporter.runProbe("0021", "http://127.0.0.1:1/deadline", deadline=time.monotonic() - 1))
+        self.assertSkipped(asyncio.run(bb_exporter_async.runProbe(None, "0021", "http://127.0.0.1:1/deadline-async",
+                                                                  deadline=time.monotonic() - 1)))
+
+    def test_execute(self):
+        res = ProbeResult()
+        rpc = probes.Rpc("http://127.0.0.1:1/execute")
+        self.assertIsNone(bb_exporter.execute("0021", rpc, res, time.monotonic()))
+        self.assertTrue(res.deadlineExceeded)
+        # Not sent, so the node's reachability is unknown
+        self.assertIsNone(res.nodeReachable)
+        self.assertEqual(rpc.duration, probes.NOT_DEFINED)
+
+class SessionPoolTest(unittest.TestCase):
+    def pool(self, **kwargs):
+        return SessionPool(CollectorRegistry(), **kwargs)
+
+    def evictions(self, pool: SessionPool, reason: str):
+        return pool.evictions.labels(reason=reason)._value.get()
+
+    def test_reuse(self):
+        pool = self.pool()
+        session = pool.get("http://node:8545/rpc")
+        # The same scheme+host+port
+        self.assertIs(pool.get("http://node:8545/other"), session)
+        self.assertIs(pool.get("http://node"), pool.get("http://node:80/"))
+        self.assertIsNot(pool.get("https://node:8545"), session)
+        self.assertIsNot(pool.get("http://other:8545"), session)
+        self.assertEqual((pool.hits._value.get(), pool.misses._value.get()), (2, 4))
+
+    def test_lru(self):
+        pool = self.pool(maxsize=2)
+        first = pool.get("http://a")
+        pool.get("http://b")
+        pool.get("http://a")
+        # The least recently used one is evicted
+        pool.get("http://c")
+        self.assertEqual(list(pool.sessions), [SessionPool.key("http://a"), SessionPool.key("http://c")])
+        self.assertIs(pool.get("http://a"), first)
+        self.assertEqual(self.evictions(pool, "lru"), 1)
+        self.assertEqual(pool.size._value.get(), 2)
+
+    def test_idle(self):
+        pool = self.pool(idle_timeout=0.1)
+        first = pool.get("http://a")
+        pool.get("http://b")
+        time.sleep(0.06)
+        pool.get("http://b")
+        time.sleep(0.06)
+        # Only sessions unused for idle_timeout are closed
+        self.assertIsNot(pool.get("http://a"), first)
+        self.assertEqual(self.evictions(pool, "idle"), 1)
+        self.assertIn(SessionPool.key("http://b"), pool.sessions)
+
+    def test_host_connections(self):
+        """RPCs over the kept connections don't wait for a free one"""
+        node = RpcNode(delay=0.2)
+        self.addCleanup(node.stop)
+        session = self.pool(host_connections=1).get(node.url)
+        request = json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_syncing", "params": []})
+        threads = [threading.Thread(target=session.post, args=(node.url,), kwargs={"data": request, "timeout": 5}) for _ in range(3)]
+        t0 = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLess(time.monotonic() - t0, 0.35)
+        self.assertEqual(node.requests, 3)
+
+SCRAPE_CONFIG = """
+scrape_configs:
+- job_name: "0021"
+  metrics_path: /probe
+  params:
+    chainid: ["0021"]
+  static_configs:
+    - targets:
+      - http://a
+      - http://b
+- job_name: "0022"
+  metrics_path: /probe_multi
+  params:
+    chainid: ["0022"]
+    target:
+      - http://c
+  static_configs:
+    - targets:
+      - bb:9000
+"""
+
+class BackgroundProberTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, "targets.json")
+        # (chainid, target) -> monotonic times it was probed
+        self.probed = dict()
+        self.writes = 0
+
+    def probe(self, chainid: str, target: str):
+        self.probed.setdefault((chainid, target), []).append(time.monotonic())
+        return f"{chainid} {target}"
+
+    def write(self, targets, text: str = None):
+        with open(self.path, "w") as f:
+            f.write(text if text is not None else json.dumps(targets))
+        # A new mtime even within the file system's time resolution
+        self.writes += 1
+        os.utime(self.path, (time.time() + self.writes, time.time() + self.writes))
+
+    def prober(self, interval: float = 0.2, jitter: float = 0):
+        prober = BackgroundProber(CollectorRegistry(), self.probe, self.path, interval, jitter, workers=4)
+        self.addCleanup(prober.stop)
+        return prober.start()
+
+    def wait(self, condition, timeout: float = 3):
+        end = time.monotonic() + timeout
+        while not condition() and time.monotonic() < end:
+            time.sleep(0.02)
+        self.assertTrue(condition())
+
+    def test_load_targets(self):
+        path = os.path.join(self.dir.name, "scrape.yml")
+        with open(path, "w") as f:
+            f.write(SCRAPE_CONFIG)
+        self.assertEqual(loadTargets(path), {("0021", "http://a"), ("0021", "http://b"), ("0022", "http://c")})
+        self.write({"0021": ["http://a"], "0022": ["http://c", "http://d"]})
+        self.assertEqual(loadTargets(self.path), {("0021", "http://a"), ("0022", "http://c"), ("0022", "http://d")})
+
+    def test_results(self):
+        self.write({"0021": ["http://a", "http://b"]})
+        prober = self.prober()
+        self.assertIsNone(prober.get("0021", "http://c"))
+        self.wait(lambda: prober.get("0021", "http://a") and prober.get("0021", "http://b"))
+        self.assertEqual(prober.get("0021", "http://a"), "0021 http://a")
+        self.assertEqual(prober.targetsNum._value.get(), 2)
+
+    def test_reload(self):
+        self.write({"0021": ["http://a", "http://b"]})
+        prober = self.prober()
+        self.wait(lambda: prober.get("0021", "http://b"))
+        # http://b removed, http://c added
+        self.write({"0021": ["http://a", "http://c"]})
+        self.wait(lambda: prober.get("0021", "http://c"))
+        self.assertIsNone(prober.get("0021", "http://b"))
+        probed = len(self.probed[("0021", "http://b")])
+        time.sleep(0.3)
+        self.assertEqual(len(self.probed[("0021", "http://b")]), probed)
+
+        # A broken file keeps the targets
+        self.write(None, "{not json")
+        time.sleep(1.2)
+        self.assertEqual(prober.targets, {("0021", "http://a"), ("0021", "http://c")})
+        self.assertIsNotNone(prober.get("0021", "http://a"))
+
+    def test_interval(self):
+        self.write({"0021": ["http://a"]})
+        self.prober(interval=0.2)
+        self.wait(lambda: len(self.probed.get(("0021", "http://a"), [])) >= 5)
+        times = self.probed[("0021", "http://a")]
+        for previous, next in zip(times, times[1:]):
+            self.assertAlmostEqual(next - previous, 0.2, delta=0.05)
+
+class CircuitBreakerTest(unittest.TestCase):
+    target = "http://node"
+
+    def breaker(self, **kwargs):
+        return CircuitBreaker(CollectorRegistry(), **dict(dict(threshold=3, backoff=0.05, max_backoff=0.2, trial_timeout=0.1), **kwargs))
+
+    def state(self, breaker: CircuitBreaker):
+        state = breaker.load(self.target)
+        return circuit_breaker.CLOSED if state is None else state.state
+
+    def open(self, breaker: CircuitBreaker):
+        for _ in range(3):
+            self.assertTrue(breaker.allow(self.target))
+            breaker.record(self.target, False)
+
+    def test_opens(self):
+        breaker = self.breaker()
+        for _ in range(2):
+            self.assertTrue(breaker.allow(self.target))
+            breaker.record(self.target, False)
+        # Consecutive failures only
+        breaker.record(self.target, True)
+        self.open(breaker)
+        self.assertEqual(self.state(breaker), circuit_breaker.OPEN)
+        self.assertFalse(breaker.allow(self.target))
+
+    def test_trial_closes(self):
+        breaker = self.breaker()
+        self.open(breaker)
+        time.sleep(0.06)
+        # A single trial
+        self.assertTrue(breaker.allow(self.target))
+        self.assertEqual(self.state(breaker), circuit_breaker.HALF_OPEN)
+        self.assertFalse(breaker.allow(self.target))
+        breaker.record(self.target, True)
+        self.assertEqual(self.state(breaker), circuit_breaker.CLOSED)
+        self.assertTrue(breaker.allow(self.target))
+
+    def test_trial_fails(self):
+        breaker = self.breaker()
+        self.open(breaker)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow(self.target))
+        breaker.record(self.target, False)
+        state = breaker.load(self.target)
+        self.assertEqual(state.state, circuit_breaker.OPEN)
+        # Backoff doubled
+        self.assertAlmostEqual(state.openUntil - time.monotonic(), 0.1, delta=0.02)
+        self.assertFalse(breaker.allow(self.target))
+
+    def test_trial_unknown(self):
+        breaker = self.breaker()
+        self.open(breaker)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow(self.target))
+        # e.g. shed or out of time, the next probe makes the trial
+        breaker.record(self.target, None)
+        self.assertEqual(self.state(breaker), circuit_breaker.OPEN)
+        self.assertTrue(breaker.allow(self.target))
+
+    def test_trial_expires(self):
+        breaker = self.breaker()
+        self.open(breaker)
+        time.sleep(0.06)
+        # The trial never records an outcome
+        self.assertTrue(breaker.allow(self.target))
+        self.assertFalse(breaker.allow(self.target))
+        time.sleep(0.11)
+        self.assertTrue(breaker.allow(self.target))
+        self.assertFalse(breaker.allow(self.target))
+
+    def test_disabled(self):
+        breaker = self.breaker(threshold=0)
+        for _ in range(5):
+            breaker.record(self.target, False)
+        self.assertTrue(breaker.allow(self.target))
+
+    def test_shared(self):
+        path = tempfile.mktemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(f"{path}*")])
+        store = SharedStore(path)
+        first, second = self.breaker(store=store), self.breaker(store=store)
+        self.open(first)
+        self.assertFalse(second.allow(self.target))
+        time.sleep(0.06)
+        self.assertTrue(second.allow(self.target))
+        self.assertFalse(first.allow(self.target))
+        second.record(self.target, True)
+        self.assertTrue(first.allow(self.target))
+
+        # Breakers not updated expire
+        self.open(first)
+        expires = store.connection().execute("SELECT expires FROM kv WHERE ns = 'breaker'").fetchone()[0]
+        self.assertAlmostEqual(expires - time.time(), 0.3, delta=0.05)
+
+class BlockHistoryTest(unittest.TestCase):
+    def record(self, history: BlockHistory, number: int, fork: str = "a", parentFork: str = None):
+        history.record(number, f"{fork}{number}", f"{parentFork or fork}{number - 1}", 1000 + 12 * number)
+
+    def test_parent(self):
+        history = BlockHistory(4)
+        self.record(history, 10)
+        self.assertEqual(history.parent(11, "a10"), (10, "a10", "a9", 1120))
+        # Another parent or height
+        self.assertIsNone(history.parent(11, "b10"))
+        self.assertIsNone(history.parent(12, "a11"))
+
+    def test_ring(self):
+        history = BlockHistory(4)
+        for number in range(1, 11):
+            self.record(history, number)
+        # Only the latest `size` blocks are kept
+        self.assertIsNotNone(history.parent(8, "a7"))
+        self.assertIsNone(history.parent(6, "a5"))
+        self.assertAlmostEqual(history.rate(), 1 / 12)
+        self.assertEqual(history.reorgs, 0)
+
+    def test_reorg(self):
+        history = BlockHistory(8)
+        for number in range(10, 13):
+            self.record(history, number)
+        # Blocks 11 and 12 replaced, the new 11 is a child of the old 10
+        self.record(history, 11, "b", "a")
+        self.record(history, 12, "b")
+        self.assertEqual(history.reorgs, 2)
+        self.assertEqual(history.parent(13, "b12")[1:3], ("b12", "b11"))
+        self.assertIsNone(history.parent(13, "a12"))
+        # The same block again isn't a reorg
+        self.record(history, 12, "b")
+        self.assertEqual(history.reorgs, 2)
+
+    def test_histories(self):
+        histories = BlockHistories(size=4, maxsize=2)
+        first = histories.get("http://a")
+        histories.get("http://b")
+        self.assertIs(histories.get("http://a"), first)
+        # The least recently probed target is dropped
+        histories.get("http://c")
+        self.assertIs(histories.get("http://a"), first)
+        self.assertNotIn("http://b", histories.histories)
+
+    def test_probe(self):
+        node = EvmNode()
+        drive(probe("0021", "http://history", ProbeResult(), parallel=False, batch=False), node)
+        self.assertEqual(node.phases, [probes.PHASE_LAST_BLOCK, probes.PHASE_PREV_BLOCK, probes.PHASE_SYNCING])
+        node.phases.clear()
+        res = ProbeResult()
+        drive(probe("0021", "http://history", res, parallel=False, batch=False), node)
+        # The previous block is known from the first probe
+        self.assertEqual(node.phases, [probes.PHASE_LAST_BLOCK, probes.PHASE_SYNCING])
+        self.assertEqual((res.prevBlockNumber, res.prevBlockDuration, res.probeSuccess), (10, 0, 1))
+
+class AdmissionTest(unittest.TestCase):
+    def admission(self, **kwargs):
+        return AdmissionControl(CollectorRegistry(), **dict(dict(limit=2, chain_limit=0, queue_size=0, queue_timeout=0.1), **kwargs))
+
+    def rejected(self, admission: AdmissionControl, reason: str):
+        return admission.rejected.labels(reason)._value.get()
+
+    def test_caps(self):
+        admission = self.admission()
+        with ExitStack() as stack:
+            stack.enter_context(admission.admit("0021"))
+            stack.enter_context(admission.admit("0001"))
+            with self.assertRaises(Overloaded):
+                stack.enter_context(admission.admit("0021"))
+        self.assertEqual(self.rejected(admission, "queue_full"), 1)
+        # The slots are freed
+        with admission.admit("0021"), admission.admit("0021"):
+            pass
+
+    def test_chain_cap(self):
+        admission = self.admission(limit=0, chain_limit=1)
+        with admission.admit("0021"):
+            with self.assertRaises(Overloaded):
+                with admission.admit("0021"):
+                    pass
+            with admission.admit("0001"):
+                pass
+
+    def test_queue_timeout(self):
+        admission = self.admission(limit=1, queue_size=1)
+        with admission.admit("0021"):
+            t0 = time.monotonic()
+            with self.assertRaises(Overloaded):
+                with admission.admit("0021"):
+                    pass
+            self.assertAlmostEqual(time.monotonic() - t0, 0.1, delta=0.05)
+            # The probe's deadline comes first
+            t0 = time.monotonic()
+            with self.assertRaises(Overloaded):
+                with admission.admit("0021", deadline=time.monotonic() + 0.02):
+                    pass
+            self.assertLess(time.monotonic() - t0, 0.08)
+        self.assertEqual(self.rejected(admission, "timeout"), 2)
+        self.assertEqual(admission.waiting, 0)
+
+    def test_queued(self):
+        admission = self.admission(limit=1, queue_size=1, queue_timeout=1)
+        admitted = threading.Event()
+        def hold():
+            with admission.admit("0021"):
+                admitted.set()
+                time.sleep(0.1)
+        threading.Thread(target=hold).start()
+        admitted.wait()
+        # Waits for the slot
+        with admission.admit("0021"):
+            self.assertEqual(admission.active, 1)
+
+    def test_async(self):
+        admission = self.admission(limit=1, queue_size=1)
+        async def probe(delay: float):
+            async with admission.aadmit("0021"):
+                await asyncio.sleep(delay)
+                return True
+        async def main():
+            # One runs, one waits in the queue and one is shed
+            return await asyncio.gather(probe(0.05), probe(0), probe(0), return_exceptions=True)
+        results = asyncio.run(main())
+        self.assertEqual(results[:2], [True, True])
+        self.assertIsInstance(results[2], Overloaded)
+        self.assertEqual(admission.active, 0)
+
+    def test_shed_trial(self):
+        """A shed probe doesn't take the half-open trial of the breaker"""
+        admission = self.admission(limit=1)
+        breaker = CircuitBreaker(CollectorRegistry(), threshold=1, backoff=0.01)
+        target = "http://127.0.0.1:1/shed"
+        breaker.record(target, False)
+        time.sleep(0.02)
+        with mock.patch.object(bb_exporter, "admission", admission), mock.patch.object(bb_exporter, "circuitBreaker", breaker):
+            with admission.admit("0021"):
+                with self.assertRaises(Overloaded):
+                    bb_exporter.runProbe("0021", target)
+                self.assertEqual(breaker.load(target).state, circuit_breaker.OPEN)
+                # The cached probe gets the overloaded result
+                res = bb_exporter.cachedProbe("0021", target)
+                self.assertEqual(res.probeSuccess % probes.ERROR_OVERLOADED, 0)
+            self.assertTrue(breaker.allow(target))
+
+    def multiTargets(self, count: int):
+        node = RpcNode(delay=0.05)
+        self.addCleanup(node.stop)
+        # Paths of their own, so the results aren't cached
+        return [f"{node.url}/multi-{self.id()}-{i}" for i in range(count)]
+
+    def test_multi(self):
+        """A /probe_multi scrape takes one slot for all its targets"""
+        admission = self.admission(limit=1, chain_limit=1)
+        targets = self.multiTargets(10)
+        client = bb_exporter.app.test_client()
+        with mock.patch.object(bb_exporter, "admission", admission):
+            metrics = samples(client.get("/probe_multi", query_string={"chainid": "0021", "target": targets}).data)
+            self.assertEqual([metrics[("probe_success", t)] for t in targets], [1] * len(targets))
+            self.assertEqual(self.rejected(admission, "queue_full"), 0)
+
+            # A scrape over the caps is shed as a whole, probed targets get their cached results
+            new = self.multiTargets(1)[0]
+            with admission.admit("0021"):
+                metrics = samples(client.get("/probe_multi", query_string={"chainid": "0021", "target": [targets[0], new]}).data)
+        self.assertEqual(metrics[("probe_success", targets[0])], 1)
+        self.assertEqual(metrics[("probe_success", new)] % probes.ERROR_OVERLOADED, 0)
+
+    def test_multi_async(self):
+        admission = self.admission(limit=1, chain_limit=1)
+        targets = self.multiTargets(10)
+        async def main():
+            async with TestClient(TestServer(bb_exporter_async.create_app())) as client:
+                reply = await client.get("/probe_multi", params=[("chainid", "0021")] + [("target", t) for t in targets])
+                return await reply.read()
+        with mock.patch.object(bb_exporter_async, "admission", admission):
+            metrics = samples(asyncio.run(main()))
+        self.assertEqual([metrics[("probe_success", t)] for t in targets], [1] * len(targets))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Compare the cost of decoding block replies.
+
+Builds eth_getBlockByNumber(..., false) replies shaped like mainnet blocks
+(geth field order, full logsBloom, withdrawals) with the given numbers of
+transaction hashes, and times the full stdlib decode the exporter used to
+run (requests' resp.json()), a full orjson decode and probes.decodeBlock.
+
+    pip install -r requirements.txt
+    python bench/bench_decode.py --txs 150 400 1500 5000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import orjson
+from probes import decodeBlock
+
+def h(n: int = 32):
+    return "0x" + random.getrandbits(n * 8).to_bytes(n, "big").hex()
+
+def block_reply(txs: int, height: int = 19000000):
+    block = {
+        "baseFeePerGas": "0x5f5e100",
+        "blobGasUsed": "0x0",
+        "difficulty": "0x0",
+        "excessBlobGas": "0x0",
+        "extraData": "0x6265617665726275696c642e6f7267",
+        "gasLimit": "0x1c9c380",
+        "gasUsed": "0x1c8f7d3",
+        "hash": h(),
+        "logsBloom": h(256),
+        "miner": h(20),
+        "mixHash": h(),
+        "nonce": "0x0000000000000000",
+        "number": hex(height),
+        "parentBeaconBlockRoot": h(),
+        "parentHash": h(),
+        "receiptsRoot": h(),
+        "sha3Uncles": h(),
+        "size": hex(1000 + txs * 600),
+        "stateRoot": h(),
+        "timestamp": "0x65a1b2c3",
+        "totalDifficulty": "0xc70d815d562d3cfa955",
+        "transactions": [h() for _ in range(txs)],
+        "transactionsRoot": h(),
+        "uncles": [],
+        "withdrawals": [{"index": hex(i), "validatorIndex": hex(i), "address": h(20), "amount": "0x11b6d35"} for i in range(16)],
+        "withdrawalsRoot": h(),
+    }
+    return json.dumps({"jsonrpc": "2.0", "id": 1, "result": block}).encode()
+
+def main(args):
+    decoders = {
+        "json": lambda body: json.loads(body.decode("utf-8")),
+        "orjson": orjson.loads,
+        "decodeBlock": decodeBlock,
+    }
+    print(f"{'txs':>6}{'bytes':>10}" + "".join(f"{name + ' us':>16}" for name in decoders))
+    for txs in args.txs:
+        body = block_reply(txs)
+        full = json.loads(body)["result"]
+        header = decodeBlock(body)["result"]
+        for field in ("timestamp", "number", "hash", "parentHash"):
+            assert header[field] == full[field], field
+
+        times = [min(timeit.repeat(lambda: decode(body), number=args.number, repeat=5)) / args.number
+                 for decode in decoders.values()]
+        print(f"{txs:>6}{len(body):>10}" + "".join(f"{t * 1e6:>16.1f}" for t in times))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--txs", type=int, nargs="+", default=[150, 400, 1500, 5000], help="Transactions per block")
+    parser.add_argument("--number", type=int, default=200, help="Decodes per timing")
+    sys.exit(main(parser.parse_args()))
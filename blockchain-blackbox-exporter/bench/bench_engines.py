@@ -0,0 +1,112 @@
+"""
+Compare the blocking (gthread) and the asyncio exporter engines.
+
+Starts a local stand-in EVM RPC server that answers every request after
+`--delay` seconds, runs each engine under gunicorn and fires `concurrency`
+simultaneous /probe requests, each against its own slow target.
+
+    pip install -r requirements.txt
+    python bench/bench_engines.py --delay 1 --levels 10 100 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+ENGINES = {
+    "gthread": ("bb_exporter:app", "gthread"),
+    "asyncio": ("bb_exporter_async:app", "aiohttp.GunicornWebWorker"),
+}
+
+def evm_reply(body: dict):
+    if body["method"] == "eth_syncing":
+        return False
+    height = 1000 if body["params"][0] == "latest" else int(body["params"][0], 16)
+    return {
+        "number": hex(height),
+        "timestamp": hex(int(time.time()) - 2),
+        "hash": "0x%064x" % height,
+        "parentHash": "0x%064x" % (height - 1),
+    }
+
+def slow_rpc_app(delay: float):
+    async def handler(request: web.Request):
+        body = json.loads(await request.read())
+        await asyncio.sleep(delay)
+        return web.json_response({"jsonrpc": "2.0", "id": body.get("id"), "result": evm_reply(body)})
+
+    app = web.Application()
+    app.router.add_post("/{target}", handler)
+    return app
+
+def start_engine(engine: str, port: int):
+    module, worker_class = ENGINES[engine]
+    return subprocess.Popen(
+        ["gunicorn", "--conf", "gunicorn_conf.py", "--bind", f"127.0.0.1:{port}",
+         "--worker-class", worker_class, "--access-logfile", "/dev/null",
+         "--log-level", "warning", module],
+        cwd=APP_DIR)
+
+async def wait_ready(session: aiohttp.ClientSession, url: str):
+    for _ in range(100):
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} is not ready")
+
+async def run_level(session: aiohttp.ClientSession, exporter: str, rpc: str, concurrency: int):
+    async def one(i: int):
+        params = {"chainid": "0021", "target": f"{rpc}/target{i}"}
+        async with session.get(f"{exporter}/probe", params=params) as resp:
+            text = await resp.text()
+            return resp.status == 200 and "probe_success 1.0" in text
+
+    t0 = time.perf_counter()
+    ok = await asyncio.gather(*[one(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    return sum(ok), elapsed
+
+async def main(args):
+    runner = web.AppRunner(slow_rpc_app(args.delay))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.rpc_port).start()
+    rpc = f"http://127.0.0.1:{args.rpc_port}"
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        print(f"{'engine':<10}{'concurrency':>12}{'ok':>6}{'seconds':>10}{'probes/s':>10}")
+        for engine in args.engines:
+            proc = start_engine(engine, args.port)
+            exporter = f"http://127.0.0.1:{args.port}"
+            try:
+                await wait_ready(session, f"{exporter}/health")
+                for concurrency in args.levels:
+                    ok, elapsed = await run_level(session, exporter, rpc, concurrency)
+                    print(f"{engine:<10}{concurrency:>12}{ok:>6}{elapsed:>10.2f}{ok / elapsed:>10.1f}")
+            finally:
+                proc.terminate()
+                proc.wait()
+
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delay", type=float, default=1.0, help="Stand-in RPC reply delay, seconds")
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 100, 500], help="Concurrent slow targets")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--port", type=int, default=19000, help="Exporter port")
+    parser.add_argument("--rpc-port", type=int, default=18545, help="Stand-in RPC server port")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,140 @@
+"""
+Load benchmark of the exporter against the local multi-chain simulator.
+
+Starts rpc_simulator.py in process and the exporter engine under gunicorn,
+then for every concurrency level keeps `concurrency` clients probing for
+`--duration` seconds, each client with its own target, round-robin over
+the chosen protocols. Reports probes/s, successful probe share, p50/p99
+probe latency and the CPU time and peak RSS of the gunicorn processes
+(read from /proc, Linux only).
+
+The exporter inherits the environment, e.g. BATCH_PROBE=true or
+DETAILED_TIMING=true. PROBE_CACHE_TTL defaults to 0 so every probe
+reaches the simulator.
+
+    pip install -r requirements.txt
+    python bench/bench_load.py --latency 0.05 --jitter 0.02 --error-rate 0.01 --txs 1500 --levels 10 50 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+
+import rpc_simulator
+from bench_engines import ENGINES, start_engine, wait_ready
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE   = os.sysconf("SC_PAGE_SIZE")
+
+def process_tree(pid: int):
+    """pid and its children's pids"""
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+def usage(pids: list):
+    """CPU seconds and resident bytes of the processes"""
+    cpu = rss = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f"/proc/{pid}/statm") as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            pass
+    return cpu, rss
+
+def percentile(values: list, share: float):
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0
+
+async def run_level(session: aiohttp.ClientSession, exporter: str, rpc: str, protocols: list,
+                    concurrency: int, duration: float, pids: list):
+    latencies = []
+    ok = 0
+    deadline = time.monotonic() + duration
+
+    async def client(i: int):
+        nonlocal ok
+        protocol = protocols[i % len(protocols)]
+        params = {"chainid": rpc_simulator.CHAIN_IDS[protocol], "target": f"{rpc}/{protocol}/{i}"}
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            async with session.get(f"{exporter}/probe", params=params) as resp:
+                text = await resp.text()
+            latencies.append(time.perf_counter() - t0)
+            ok += resp.status == 200 and "probe_success 1.0" in text
+
+    peak = 0
+    async def sampler():
+        nonlocal peak
+        while time.monotonic() < deadline:
+            peak = max(peak, usage(pids)[1])
+            await asyncio.sleep(0.5)
+
+    cpu0 = usage(pids)[0]
+    t0 = time.perf_counter()
+    await asyncio.gather(sampler(), *[client(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    cpu = usage(pids)[0] - cpu0
+
+    latencies.sort()
+    return {
+        "probes": len(latencies),
+        "rate": len(latencies) / elapsed,
+        "ok": ok / len(latencies) if latencies else 0,
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "cpu": cpu / elapsed * 100,
+        "rss": peak / 2**20,
+    }
+
+async def main(args):
+    simulator = rpc_simulator.from_args(args)
+    runner = await rpc_simulator.start(simulator, args.rpc_port)
+    rpc = f"http://127.0.0.1:{args.rpc_port}"
+    os.environ.setdefault("PROBE_CACHE_TTL", "0")
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        print(f"{'engine':<10}{'clients':>8}{'probes':>8}{'probes/s':>10}{'ok %':>7}"
+              f"{'p50 ms':>9}{'p99 ms':>9}{'cpu %':>8}{'rss MiB':>9}")
+        for engine in args.engines:
+            proc = start_engine(engine, args.port)
+            exporter = f"http://127.0.0.1:{args.port}"
+            try:
+                await wait_ready(session, f"{exporter}/health")
+                pids = process_tree(proc.pid)
+                for concurrency in args.levels:
+                    r = await run_level(session, exporter, rpc, args.protocols, concurrency, args.duration, pids)
+                    print(f"{engine:<10}{concurrency:>8}{r['probes']:>8}{r['rate']:>10.1f}{r['ok'] * 100:>7.1f}"
+                          f"{r['p50']:>9.1f}{r['p99']:>9.1f}{r['cpu']:>8.1f}{r['rss']:>9.1f}")
+            finally:
+                proc.terminate()
+                proc.wait()
+
+    print(f"simulator: {simulator.requests} requests, {simulator.errors} failed")
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    rpc_simulator.add_arguments(parser)
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 50, 200], help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per level")
+    parser.add_argument("--protocols", nargs="+", default=list(rpc_simulator.CHAIN_IDS), choices=list(rpc_simulator.CHAIN_IDS))
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--port", type=int, default=19000, help="Exporter port")
+    parser.add_argument("--rpc-port", type=int, default=18545, help="Simulator port")
+    sys.exit(asyncio.run(main(parser.parse_args())))
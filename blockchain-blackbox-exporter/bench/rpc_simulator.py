@@ -0,0 +1,179 @@
+"""
+Local stand-in nodes for every protocol the exporter probes.
+
+One aiohttp server answers as any node, whatever the target path:
+  - EVM and Starknet JSON-RPC, single and batch requests
+  - Solana/Velas getSlot, getBlock and getHealth
+  - NEAR block and status
+  - SUI sui_getLatestCheckpointSequenceNumber
+  - Cosmos GET .../block and .../status
+  - POKT POST .../v1/query/height
+
+Every reply waits `latency` +/- `jitter` seconds, `error_rate` of the
+requests fail with HTTP 503, and blocks carry `txs` transaction hashes.
+Blocks are produced every `block_time` seconds.
+
+    python bench/rpc_simulator.py --port 18545 --latency 0.05 --jitter 0.02 --txs 400
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+# Exporter chainid probing each protocol
+CHAIN_IDS = {
+    "evm":      "0021",
+    "avax":     "0003",
+    "starknet": "0060",
+    "solana":   "0006",
+    "cosmos":   "0054",
+    "near":     "0052",
+    "sui":      "0076",
+    "pokt":     "0001",
+}
+
+class Simulator:
+    def __init__(self, latency: float = 0.05, jitter: float = 0, error_rate: float = 0,
+                 txs: int = 150, block_time: float = 2):
+        self.latency    = latency
+        self.jitter     = jitter
+        self.error_rate = error_rate
+        self.block_time = block_time
+        self.start      = time.time() - 1000 * block_time
+        # Same hashes in every block, only their number matters
+        self.txs        = ["0x%064x" % random.getrandbits(256) for _ in range(txs)]
+        self.requests   = 0
+        self.errors     = 0
+
+    def height(self):
+        return int((time.time() - self.start) / self.block_time)
+
+    def blockTime(self, height: int):
+        return int(self.start + height * self.block_time)
+
+    def evmBlock(self, height: int):
+        return {
+            "number": hex(height),
+            "hash": "0x%064x" % height,
+            "parentHash": "0x%064x" % (height - 1),
+            "timestamp": hex(self.blockTime(height)),
+            "logsBloom": "0x" + "0" * 512,
+            "gasUsed": "0x1c8f7d3",
+            "transactions": self.txs,
+        }
+
+    def starknetBlock(self, height: int):
+        return {
+            "block_number": height,
+            "block_hash": "0x%064x" % height,
+            "parent_hash": "0x%064x" % (height - 1),
+            "timestamp": self.blockTime(height),
+            "status": "ACCEPTED_ON_L2",
+            "transactions": self.txs,
+        }
+
+    def result(self, body: dict):
+        method = body.get("method")
+        params = body.get("params") or []
+        latest = self.height()
+
+        if method in ("eth_getBlockByNumber", "eth_getBlockByHash"):
+            if method == "eth_getBlockByHash":
+                height = int(params[0], 16)
+            else:
+                height = latest if params[0] == "latest" else int(params[0], 16)
+            return self.evmBlock(min(height, latest))
+        if method == "eth_syncing":
+            return False
+        if method == "starknet_getBlockWithTxHashes":
+            param = params[0]
+            if param == "latest":
+                height = latest
+            elif isinstance(param, dict) and "block_hash" in param:
+                height = int(param["block_hash"], 16)
+            else:
+                height = param.get("block_number", latest) if isinstance(param, dict) else int(param)
+            return self.starknetBlock(min(height, latest))
+        if method == "starknet_syncing":
+            return False
+        if method == "getSlot":
+            return latest + 50
+        if method == "getBlock":
+            slot = params[0]
+            return {"blockTime": self.blockTime(slot - 50), "blockHeight": slot - 50,
+                    "blockhash": f"slot{slot}", "previousBlockhash": f"slot{slot - 1}", "parentSlot": slot - 1}
+        if method == "getHealth":
+            return "ok"
+        if method == "block":
+            return {"header": {"height": latest, "timestamp": self.blockTime(latest) * 10**9}}
+        if method == "status":
+            return {"sync_info": {"syncing": False}}
+        if method == "sui_getLatestCheckpointSequenceNumber":
+            return str(latest)
+        raise KeyError(method)
+
+    def reply(self, body: dict):
+        try:
+            return {"jsonrpc": "2.0", "id": body.get("id"), "result": self.result(body)}
+        except (KeyError, IndexError, TypeError, ValueError):
+            return {"jsonrpc": "2.0", "id": body.get("id"), "error": {"code": -32601, "message": "Method not found"}}
+
+    def cosmos(self, path: str):
+        latest = self.height()
+        if path.endswith("/status"):
+            return {"result": {"sync_info": {"catching_up": False, "latest_block_height": str(latest)}}}
+        blockTime = datetime.fromtimestamp(self.blockTime(latest), timezone.utc).isoformat()
+        return {"result": {"block": {"header": {"height": str(latest), "time": blockTime}}}}
+
+    async def handler(self, request: web.Request):
+        self.requests += 1
+        body = await request.read()
+        await asyncio.sleep(max(0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text="Simulated failure")
+
+        path = request.path
+        if request.method == "GET":
+            return web.json_response(self.cosmos(path))
+        if path.endswith("/v1/query/height"):
+            return web.json_response({"height": self.height()})
+
+        body = json.loads(body)
+        if isinstance(body, list):
+            return web.json_response([self.reply(b) for b in body])
+        return web.json_response(self.reply(body))
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self.handler)
+        return app
+
+async def start(simulator: Simulator, port: int, host: str = "127.0.0.1"):
+    """Starts the simulator in the running loop, returns its runner to clean up"""
+    runner = web.AppRunner(simulator.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.05, help="Reply delay, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- added to the delay, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with HTTP 503")
+    parser.add_argument("--txs", type=int, default=150, help="Transaction hashes per EVM/Starknet block")
+    parser.add_argument("--block-time", type=float, default=2.0, help="Seconds between blocks")
+
+def from_args(args):
+    return Simulator(args.latency, args.jitter, args.error_rate, args.txs, args.block_time)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--port", type=int, default=18545)
+    args = parser.parse_args()
+    sys.exit(web.run_app(from_args(args).app(), host="127.0.0.1", port=args.port, access_log=None))